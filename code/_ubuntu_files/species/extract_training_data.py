@@ -1,48 +1,18 @@
 import pandas as pd
 import numpy as np
 from scipy.spatial import KDTree
-from shapely.geometry import Polygon, Point, box
+from shapely.geometry import Polygon, box
 from collections import Counter, defaultdict
 import geopandas as gpd
-import laspy
+from las_table import read_las_table
 
 # Set warning options
 pd.set_option('future.no_silent_downcasting', True)
 
 def load_forest_gdf(laz_file_path):
-    """Loads forest from a point cloud file as a GeoDataFrame, applying scale and offset transformations."""
-    with laspy.open(laz_file_path) as las:
-        points = las.read()
-        scale = las.header.scales
-        offset = las.header.offsets
-
-        # print(f"LAS Scale:\t{scale}")
-        # print(f"LAS Offset:\t{offset}")
-
-        # Convert from scaled integers to real-world coordinates
-        X = points.X * scale[0] + offset[0]
-        Y = points.Y * scale[1] + offset[1]
-        Z = points.Z * scale[2] + offset[2]
-
-        # Construct dataframe with transformed coordinates
-        attributes = {dimension.name: getattr(points, dimension.name) for dimension in points.point_format}
-        df = pd.DataFrame(attributes)
-
-    # Update transformed coordinates in the dataframe
-    df['X'] = X
-    df['Y'] = Y
-    df['Z'] = Z
-
-    # Drop irrelevant columns
-    df = df[[
-        'tree_id', 'X', 'Y', 'Z', 'red', 'green', 'blue', 'nir', 'ndvi', 'norm_g', 'mtvi2'
-    ]]
-
-    # Create the geometry column
-    df['geometry'] = df.apply(lambda row: Point(row['X'], row['Y'], row['Z']), axis=1)
-    df.drop(columns=['X', 'Y', 'Z'], inplace=True)
-
-    return gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:28992")
+    """Loads forest from a point cloud file as a GeoDataFrame (real-world coordinates, point geometries built in bulk)."""
+    table = read_las_table(laz_file_path, dims=['tree_id', 'red', 'green', 'blue', 'nir', 'ndvi', 'norm_g', 'mtvi2'])
+    return table.to_gdf()
 
 
 def load_municipality_geojson(filename):
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point
 from scipy.spatial import distance_matrix
 
@@ -128,17 +129,17 @@ def IabHmed(tree):
 def crown_width_at_percentile_gdf(tree, height_percentile=50, height_tol=0.5):
     z_target = tree["z"].quantile(height_percentile / 100)
     slice_mask = (tree["z"] >= z_target - height_tol) & (tree["z"] <= z_target + height_tol)
-    slice_df = tree.loc[slice_mask, ["x", "y"]]
+    xy = tree.loc[slice_mask, ["x", "y"]].to_numpy(dtype=np.float64)
 
-    if len(slice_df) < 3:
+    if len(xy) < 3:
         return np.nan
 
-    gdf = gpd.GeoDataFrame(slice_df, geometry=gpd.points_from_xy(slice_df["x"], slice_df["y"]))
-    hull = gdf.unary_union.convex_hull
+    # hull straight from the coordinates (no GeoDataFrame / union per call)
+    hull = shapely.convex_hull(shapely.multipoints(xy))
 
     # Estimate width as the longest distance between hull boundary points
     if hull.geom_type == "Polygon":
-        coords = list(hull.exterior.coords)
+        coords = shapely.get_coordinates(hull.exterior)
         dist_matrix = distance_matrix(coords, coords)
         width = np.max(dist_matrix)
         return width
@@ -266,6 +267,188 @@ def N(tree):
     """Total number of points"""
     return {"N": len(tree)}
 
+# ---------------------------- Grouped Feature Functions ----------------------------
+# The same features for all trees at once. The points are sorted by tree once
+# (TreeGroups); a per-tree statistic is then a segment reduction over the
+# contiguous slices (np.*.reduceat) and a percentile is an index into the
+# values sorted within each tree. Statistics shared by several features (mean,
+# median, percentiles, ...) are computed once per column. The results follow
+# pandas (std with ddof=1, bias-corrected skew / kurtosis, linear
+# percentiles) so they match the per-tree functions above.
+# GROUPED_FEATURES maps a per-tree function to its grouped version; the crown
+# width features have none and still run per tree.
+
+
+class TreeGroups:
+    """
+    Points grouped by tree.
+
+    Parameters:
+    - columns (dict): column name -> per-point array
+    - tree_ids (np.ndarray): tree id per point (only the points to group)
+
+    Attributes:
+    - tree_ids (np.ndarray): the trees, ascending
+    - starts, counts (np.ndarray): slice of every tree in the sorted columns
+    - columns (dict): the columns sorted by tree (stable, file order within a tree)
+    """
+
+    def __init__(self, columns, tree_ids):
+        order = np.argsort(tree_ids, kind="stable")
+        sorted_ids = np.asarray(tree_ids)[order]
+        self.tree_ids, self.starts, self.counts = np.unique(sorted_ids, return_index=True, return_counts=True)
+        self.group = np.repeat(np.arange(len(self.tree_ids)), self.counts)
+        self.columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.tree_ids)
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def max(self, col):
+        return self._cached(("max", col), lambda: np.maximum.reduceat(self.columns[col], self.starts))
+
+    def min(self, col):
+        return self._cached(("min", col), lambda: np.minimum.reduceat(self.columns[col], self.starts))
+
+    def sum(self, values):
+        return np.add.reduceat(np.asarray(values, dtype=np.float64), self.starts)
+
+    def mean(self, col):
+        return self._cached(("mean", col), lambda: self.sum(self.columns[col]) / self.counts)
+
+    def masked_mean(self, col, mask):
+        """Mean of col over the points in mask, per tree (NaN without such points)."""
+        n = self.sum(mask)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum(np.where(mask, self.columns[col], 0)) / n
+
+    def _moments(self, col):
+        """Sums of squared, cubed and 4th power deviations from the mean, and max |value|."""
+        def compute():
+            values = self.columns[col]
+            adjusted = values - self.mean(col)[self.group]
+            adjusted2 = adjusted ** 2
+            max_abs = np.maximum.reduceat(np.abs(values.astype(np.float64)), self.starts)
+            return (self.sum(adjusted2), self.sum(adjusted2 * adjusted), self.sum(adjusted2 ** 2), max_abs)
+        return self._cached(("moments", col), compute)
+
+    def std(self, col):
+        def compute():
+            m2 = self._moments(col)[0]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(self.counts > 1, np.sqrt(m2 / (self.counts - 1)), np.nan)
+        return self._cached(("std", col), compute)
+
+    def skew(self, col):
+        m2, m3, _, max_abs = self._moments(col)
+        n = self.counts.astype(np.float64)
+        eps = np.finfo(np.float64).eps
+        m2 = np.where(np.abs(m2) < (eps * max_abs) ** 2 * n, 0, m2)
+        m3 = np.where(np.abs(m3) < (eps * max_abs) ** 3 * n, 0, m3)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = (n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2 ** 1.5)
+        result = np.where(m2 == 0, 0, result)
+        return np.where(n < 3, np.nan, result)
+
+    def kurtosis(self, col):
+        m2, _, m4, max_abs = self._moments(col)
+        n = self.counts.astype(np.float64)
+        eps = np.finfo(np.float64).eps
+        m2 = np.where(np.abs(m2) < (eps * max_abs) ** 2 * n, 0, m2)
+        m4 = np.where(np.abs(m4) < (eps * max_abs) ** 4 * n, 0, m4)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            adj = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+            numerator = n * (n + 1) * (n - 1) * m4
+            denominator = (n - 2) * (n - 3) * m2 ** 2
+            result = numerator / denominator - adj
+        result = np.where(denominator == 0, 0, result)
+        return np.where(n < 4, np.nan, result)
+
+    def _sorted(self, col):
+        """col sorted within every tree (trees stay in place)."""
+        return self._cached(("sorted", col),
+                            lambda: self.columns[col][np.lexsort((self.columns[col], self.group))].astype(np.float64))
+
+    def median(self, col):
+        def compute():
+            values = self._sorted(col)
+            lo = self.starts + (self.counts - 1) // 2
+            hi = self.starts + self.counts // 2
+            return (values[lo] + values[hi]) / 2
+        return self._cached(("median", col), compute)
+
+    def quantile(self, col, q):
+        """Linear-interpolation quantile per tree (as Series.quantile)."""
+        def compute():
+            values = self._sorted(col)
+            pos = (self.counts - 1) * q
+            lo = np.floor(pos).astype(np.int64)
+            t = pos - lo
+            a = values[self.starts + lo]
+            b = values[self.starts + np.minimum(lo + 1, self.counts - 1)]
+            diff = b - a
+            return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+        return self._cached(("quantile", col, q), compute)
+
+    def first_or_single(self):
+        return (self.columns["return_number"] == 1) | (self.columns["number_of_returns"] == 1)
+
+
+def _ratio(num, den):
+    """num / den where den != 0, else NaN."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den != 0, num / den, np.nan)
+
+
+def _intensity_above_below(g):
+    """Mean intensity above / at or below the median height, per tree."""
+    def compute():
+        zmed = g.median("z")[g.group]
+        return g.masked_mean("intensity", g.columns["z"] > zmed), g.masked_mean("intensity", g.columns["z"] <= zmed)
+    return g._cached(("above_below",), compute)
+
+
+GROUPED_FEATURES = {
+    Hmax: lambda g: g.max("z"),
+    Hmed: lambda g: g.median("z"),
+    Hbase: lambda g: g.min("z"),
+    Hmean: lambda g: g.mean("z"),
+    Hstd: lambda g: g.std("z"),
+    Hcv: lambda g: _ratio(g.std("z"), g.mean("z")),
+    Hkur: lambda g: g.kurtosis("z"),
+    Hp25: lambda g: g.quantile("z", 0.25),
+    Hp90: lambda g: g.quantile("z", 0.90),
+    Hfirst_mean: lambda g: g.masked_mean("z", g.first_or_single()),
+
+    Imax: lambda g: g.max("intensity"),
+    Imean: lambda g: g.mean("intensity"),
+    Istd: lambda g: g.std("intensity"),
+    Icv: lambda g: _ratio(g.std("intensity"), g.mean("intensity")),
+    Ikur: lambda g: g.kurtosis("intensity"),
+    Iske: lambda g: g.skew("intensity"),
+    Ip25: lambda g: g.quantile("intensity", 0.25),
+    Ip90: lambda g: g.quantile("intensity", 0.90),
+    Ifirst_mean: lambda g: g.masked_mean("intensity", g.columns["return_number"] == 1),
+    IaHmed: lambda g: _intensity_above_below(g)[0],
+    IbHmed: lambda g: _intensity_above_below(g)[1],
+    IabHmed: lambda g: _ratio(*_intensity_above_below(g)),
+
+    CL_Hmax: lambda g: _ratio(g.max("z") - g.min("z"), g.max("z")),
+    CWns_ew: lambda g: _ratio(g.max("y") - g.min("y"), g.max("x") - g.min("x")),
+    CRR: lambda g: _ratio(g.mean("z") - g.min("z"), g.max("z") - g.min("z")),
+
+    Hmean_med: lambda g: _ratio(g.mean("z") - g.median("z"), g.max("z")),
+    Nfirst: lambda g: g.sum(g.first_or_single()) / g.counts,
+    Nlast: lambda g: g.sum(g.columns["return_number"] == g.columns["number_of_returns"]) / g.counts,
+    N: lambda g: g.counts,
+}
+
+
 # ---------------------------- Feature Functions ----------------------------
 # List of feature functions
 # to be used in the feature extraction process
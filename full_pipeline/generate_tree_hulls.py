@@ -8,16 +8,19 @@ from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor
 from shared_logging import setup_module_logger
 from merge_tree_ids import merge_tree_ids_into_las
-from species_matching import compute_tree_convex_hulls, load_forest_gdf
+from species_matching import compute_tree_convex_hulls
+from las_table import LAS_CRS, read_las_table
+from run_meta import input_stats
+from hull_store import hull_path, find_hulls, write_hulls
 
 logger = None
 
 def process_segmentation_file(args):
-    filename, forest_gdf_base, data_dir, segmentation_dir, hull_output_dir = args
+    filename, forest_table, data_dir, segmentation_dir, hull_output_dir = args
     base = os.path.splitext(filename)[0]
-    geojson_out = os.path.join(hull_output_dir, f"{base}.geojson")
+    hulls_out = hull_path(hull_output_dir, base)
 
-    if os.path.exists(geojson_out):
+    if find_hulls(hull_output_dir, base):
         return f"✓ Skipped {filename} (already exists)"
 
     merge_tree_ids_into_las(
@@ -30,20 +33,17 @@ def process_segmentation_file(args):
     seg_path = os.path.join(segmentation_dir, filename)
     seg_df = pd.read_csv(seg_path, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
 
-    forest_gdf = forest_gdf_base.copy()
-    forest_gdf["x"] = forest_gdf.geometry.x
-    forest_gdf["y"] = forest_gdf.geometry.y
-    forest_gdf["z"] = forest_gdf.geometry.z
-
-    merged_df = pd.merge(forest_gdf, seg_df, on=["x", "y", "z"], how="left")
+    merged_df = pd.merge(forest_table.to_frame(), seg_df, on=["x", "y", "z"], how="left")
     merged_df = merged_df[merged_df["tree_id"].notna()].copy()
     merged_df["tree_id"] = merged_df["tree_id"].astype(int)
 
-    merged_gdf = gpd.GeoDataFrame(merged_df, geometry="geometry", crs=forest_gdf.crs)
+    # point geometries only for the points that got a tree_id
+    merged_gdf = gpd.GeoDataFrame(merged_df, geometry=gpd.points_from_xy(merged_df["x"], merged_df["y"], merged_df["z"]),
+                                  crs=LAS_CRS)
     hulls_gdf = compute_tree_convex_hulls(merged_gdf)
-    hulls_gdf.to_file(geojson_out, driver="GeoJSON")
+    write_hulls(hulls_gdf, hulls_out)
 
-    return f"✓ Processed {filename} → {geojson_out}"
+    return f"✓ Processed {filename} → {hulls_out}"
 
 def filter_segmentation_files(stats_df, forest_point_count, min_trees, max_trees, max_point_loss):
     min_points = (1 - max_point_loss) * forest_point_count
@@ -67,7 +67,7 @@ def generate_all_hulls(data_dir, min_trees=15, max_trees=50, max_point_loss=0.1)
         return
 
     stats_df = pd.read_csv(stats_csv)
-    forest_point_count = pd.read_csv(os.path.join(data_dir, "forest.xyz"), sep=r"\s+", header=None).shape[0]
+    forest_point_count = input_stats(os.path.join(data_dir, "forest.xyz"))["points"]   # cached line count
 
     valid_rows = filter_segmentation_files(
         stats_df,
@@ -79,10 +79,10 @@ def generate_all_hulls(data_dir, min_trees=15, max_trees=50, max_point_loss=0.1)
     logger.info("Filtered down to %d valid segmentation results", len(valid_rows))
 
     valid_files = set(valid_rows["File Name"])
-    forest_gdf_base = load_forest_gdf(forest_las_path)
+    forest_table = read_las_table(forest_las_path)
 
     args = [
-        (f, forest_gdf_base, data_dir, segmentation_dir, hull_output_dir)
+        (f, forest_table, data_dir, segmentation_dir, hull_output_dir)
         for f in valid_files
     ]
 
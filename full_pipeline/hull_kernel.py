@@ -0,0 +1,365 @@
+# hull_kernel.py
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial import ConvexHull, QhullError
+
+# ---------------------------------------------------------------------------
+# Batched 2D convex hulls
+# ---------------------------------------------------------------------------
+# All hulls of a tile are computed in one pass: the points are sorted by
+# (label, x, y) once and Andrew's monotone chain is run for every label at the
+# same time. Instead of a per-label stack, the chain is pruned in rounds: in
+# each round every point that does not make a strict turn with its current
+# neighbours (within the same label) is dropped. A true hull vertex always
+# makes a strict turn with any pair of neighbours on either side of it, so it
+# is never dropped, and the rounds stop once every remaining triple turns the
+# right way, i.e. when only the hull chain is left. A normal crown needs a
+# few rounds; a long concave run can lose a single point per round, so after
+# PRUNE_ROUNDS the labels that are still not convex finish with a plain
+# monotone-chain stack (linear in their remaining points).
+
+
+PRUNE_ROUNDS = 16   # vectorized pruning rounds before the per-group stack takes over
+
+
+def _chain_drops(labels, x, y, alive, lower):
+    """Positions in alive of the points that do not make a strict turn with their neighbours."""
+    lab = labels[alive]
+    inner = np.zeros(len(alive), dtype=bool)
+    inner[1:-1] = (lab[1:-1] == lab[:-2]) & (lab[1:-1] == lab[2:])
+    mid = np.flatnonzero(inner)
+
+    a, b, c = alive[mid - 1], alive[mid], alive[mid + 1]
+    cross = (x[b] - x[a]) * (y[c] - y[a]) - (y[b] - y[a]) * (x[c] - x[a])
+    return mid[cross <= 0] if lower else mid[cross >= 0]
+
+
+def _monotone_stack(x, y, lower):
+    """Positions of the lower or upper chain of one sorted group (Andrew's monotone chain)."""
+    xs, ys = x.tolist(), y.tolist()
+    stack = []
+    for i in range(len(xs)):
+        while len(stack) >= 2:
+            a, b = stack[-2], stack[-1]
+            cross = (xs[b] - xs[a]) * (ys[i] - ys[a]) - (ys[b] - ys[a]) * (xs[i] - xs[a])
+            if (cross <= 0) if lower else (cross >= 0):
+                stack.pop()
+            else:
+                break
+        stack.append(i)
+    return np.asarray(stack, dtype=np.int64)
+
+
+def _prune_chain(labels, x, y, lower):
+    """Indices (into the sorted arrays) of the lower or upper hull chain of every label."""
+    alive = np.arange(len(labels))
+
+    for _ in range(PRUNE_ROUNDS):
+        if len(alive) <= 2:
+            return alive
+        drop = _chain_drops(labels, x, y, alive, lower)
+        if len(drop) == 0:
+            return alive
+        keep = np.ones(len(alive), dtype=bool)
+        keep[drop] = False
+        alive = alive[keep]
+
+    if len(alive) <= 2:
+        return alive
+    drop = _chain_drops(labels, x, y, alive, lower)
+    if len(drop) == 0:
+        return alive
+
+    # a long concave run loses only one point per round (O(n^2) in rounds):
+    # the labels that are still not convex finish with a per-group stack
+    lab = labels[alive]
+    starts = np.flatnonzero(np.r_[True, lab[1:] != lab[:-1]])
+    ends = np.r_[starts[1:], len(alive)]
+    keep = np.ones(len(alive), dtype=bool)
+    for g in np.unique(np.searchsorted(starts, drop, side="right") - 1):
+        s, e = starts[g], ends[g]
+        keep[s:e] = False
+        keep[s + _monotone_stack(x[alive[s:e]], y[alive[s:e]], lower)] = True
+    return alive[keep]
+
+
+def _group_points(x, y, labels, min_points):
+    """
+    Sort points by (label, x, y), drop labels with fewer than min_points points
+    and exact duplicate points. Returns the kept labels, the skipped labels and
+    the sorted group index / x / y of the remaining points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    labels = np.asarray(labels)
+
+    if len(labels) == 0:   # no segmented points: no hulls, nothing skipped
+        return labels[:0], labels[:0], np.empty(0, dtype=np.int64), x[:0], y[:0]
+
+    order = np.lexsort((y, x, labels))
+    lab, px, py = labels[order], x[order], y[order]
+
+    # group sizes on the raw points (same rule as the old per-group loop)
+    starts = np.flatnonzero(np.r_[True, lab[1:] != lab[:-1]])
+    uniq = lab[starts]
+    counts = np.diff(np.r_[starts, len(lab)])
+    valid = counts >= min_points
+
+    # keep valid labels only and drop exact duplicate points
+    keep = np.repeat(valid, counts)
+    keep[1:] &= (lab[1:] != lab[:-1]) | (px[1:] != px[:-1]) | (py[1:] != py[:-1])
+    lab, px, py = lab[keep], px[keep], py[keep]
+
+    # group index per point, 0..n_kept_labels-1
+    group = np.cumsum(np.r_[True, lab[1:] != lab[:-1]]) - 1
+
+    return uniq[valid], uniq[~valid], group, px, py
+
+
+def convex_hulls_by_label(x, y, labels, min_points=3):
+    """
+    Compute the 2D convex hull of every label in one vectorized pass.
+
+    Parameters:
+    - x, y (array-like): point coordinates
+    - labels (array-like): integer label (tree id) per point
+    - min_points (int): labels with fewer points are skipped
+
+    Returns:
+    - hull_labels (np.ndarray): sorted labels that received a hull
+    - hulls (np.ndarray): shapely geometries aligned with hull_labels. Polygons,
+      except for degenerate (collinear) labels, which get the same LineString
+      or Point that shapely's convex_hull would return.
+    - skipped_labels (np.ndarray): labels with fewer than min_points points
+    """
+    hull_labels, skipped_labels, group, px, py = _group_points(x, y, labels, min_points)
+
+    if len(hull_labels) == 0:
+        return hull_labels, np.empty(0, dtype=object), skipped_labels
+
+    lower = _prune_chain(group, px, py, lower=True)
+    upper = _prune_chain(group, px, py, lower=False)
+
+    # ring = lower chain left->right, then upper chain right->left without its end points
+    ug = group[upper]
+    new_group = ug[1:] != ug[:-1]
+    upper_inner = ~(np.r_[True, new_group] | np.r_[new_group, True])
+    upper = upper[upper_inner]
+
+    ring_pts = np.r_[lower, upper]
+    ring_grp = group[ring_pts]
+    ring_part = np.r_[np.zeros(len(lower), dtype=np.int8), np.ones(len(upper), dtype=np.int8)]
+    ring_pos = np.r_[np.arange(len(lower)), -np.arange(len(upper))]
+    ring_order = np.lexsort((ring_pos, ring_part, ring_grp))
+    ring_pts, ring_grp = ring_pts[ring_order], ring_grp[ring_order]
+
+    n_vertices = np.bincount(ring_grp, minlength=len(hull_labels))
+    is_polygon = n_vertices >= 3
+
+    hulls = np.empty(len(hull_labels), dtype=object)
+
+    if is_polygon.any():
+        on_ring = is_polygon[ring_grp]
+        coords = np.column_stack((px[ring_pts[on_ring]], py[ring_pts[on_ring]]))
+        ring_index = np.cumsum(is_polygon) - 1
+        rings = shapely.linearrings(coords, indices=ring_index[ring_grp[on_ring]])
+        hulls[is_polygon] = shapely.polygons(rings)
+
+    if not is_polygon.all():
+        # collinear / single-location labels: let shapely decide LineString vs Point
+        degenerate = ~is_polygon
+        on_deg = degenerate[group]
+        deg_index = np.cumsum(degenerate) - 1
+        mp = shapely.multipoints(np.column_stack((px[on_deg], py[on_deg])),
+                                 indices=deg_index[group[on_deg]])
+        hulls[degenerate] = shapely.convex_hull(mp)
+
+    return hull_labels, hulls, skipped_labels
+
+
+# ---------------------------------------------------------------------------
+# Batched concave crown outlines
+# ---------------------------------------------------------------------------
+# shapely's concave_hull is far more expensive than a convex hull, so every
+# tree is first decimated to at most max_points points (a regular stride over
+# its sorted points, always keeping the convex hull vertices so the outline
+# still reaches the crown extremes). The trees are then cut into chunks that
+# are handed to a process pool; inside a chunk the hulls are one vectorized
+# shapely call.
+
+
+def _concave_chunk(args):
+    """Concave hulls for one chunk of trees (runs in a worker process)."""
+    coords, sizes, ratio, allow_holes = args
+    mp = shapely.multipoints(coords, indices=np.repeat(np.arange(len(sizes)), sizes))
+    return shapely.concave_hull(mp, ratio=ratio, allow_holes=allow_holes)
+
+
+def concave_hulls_by_label(x, y, labels, ratio=0.3, max_points=2000, min_points=3,
+                           allow_holes=False, num_workers=1, chunk_size=500):
+    """
+    Compute a concave crown outline for every label.
+
+    Parameters:
+    - x, y (array-like): point coordinates
+    - labels (array-like): integer label (tree id) per point
+    - ratio (float): shapely concave_hull ratio, 1.0 gives the convex hull and
+      smaller values give tighter outlines
+    - max_points (int): trees with more points are decimated to about this many
+    - min_points (int): labels with fewer points are skipped
+    - allow_holes (bool): allow holes in the outlines
+    - num_workers (int): processes to use, 1 runs everything in-process
+    - chunk_size (int): number of trees handed to a worker at once
+
+    Returns:
+    - hull_labels, hulls, skipped_labels (same layout as convex_hulls_by_label)
+    """
+    hull_labels, skipped_labels, group, px, py = _group_points(x, y, labels, min_points)
+
+    if len(hull_labels) == 0:
+        return hull_labels, np.empty(0, dtype=object), skipped_labels
+
+    # ------------------ per-tree decimation ------------------
+    counts = np.bincount(group, minlength=len(hull_labels))
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    pos = np.arange(len(group)) - starts[group]
+    step = np.maximum(1, np.ceil(counts / max_points).astype(np.int64))
+
+    keep = pos % step[group] == 0
+    if (step > 1).any():
+        keep[_prune_chain(group, px, py, lower=True)] = True
+        keep[_prune_chain(group, px, py, lower=False)] = True
+    group, px, py = group[keep], px[keep], py[keep]
+
+    coords = np.column_stack((px, py))
+    sizes = np.bincount(group, minlength=len(hull_labels))
+    bounds = np.r_[0, np.cumsum(sizes)]
+
+    # ------------------ chunked concave hulls ------------------
+    chunks = []
+    for g0 in range(0, len(hull_labels), chunk_size):
+        g1 = min(g0 + chunk_size, len(hull_labels))
+        chunks.append((coords[bounds[g0]:bounds[g1]], sizes[g0:g1], ratio, allow_holes))
+
+    if num_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(chunks))) as pool:
+            parts = list(pool.map(_concave_chunk, chunks))
+    else:
+        parts = [_concave_chunk(c) for c in chunks]
+
+    hulls = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+    return hull_labels, hulls, skipped_labels
+
+
+# ---------------------------------------------------------------------------
+# Batched 3D crown hull metrics
+# ---------------------------------------------------------------------------
+# Qhull has no batched interface, so the per-tree work is kept small: points
+# are grouped by label once (a single stable argsort) and chunks of trees are
+# handed to a process pool. Large trees (> max_points) are reduced exactly
+# before the final hull: the tree is sorted by height and cut into blocks of
+# max_points points, and only the 3D hull vertices of every block are kept
+# (repeated until at most max_points remain). Every hull vertex of the tree is
+# a hull vertex of its own block, so volume, surface and projection area are
+# those of the full tree.
+
+
+def _hull_candidates(pts, max_points):
+    """Rows of pts that can be vertices of their 3D hull (all of them if len(pts) <= max_points)."""
+    while len(pts) > max_points:
+        pts = pts[np.argsort(pts[:, 2], kind="stable")]
+        parts = []
+        for b0 in range(0, len(pts), max_points):
+            block = pts[b0:b0 + max_points]
+            try:
+                parts.append(block[ConvexHull(block).vertices])
+            except (QhullError, ValueError):
+                # flat block: all its points stay candidates
+                parts.append(block)
+        reduced = np.concatenate(parts)
+        if len(reduced) == len(pts):
+            break
+        pts = reduced
+    return pts
+
+
+def _hull3d_chunk(args):
+    """3D hull volume / surface area and 2D hull area for one chunk of trees (runs in a worker process)."""
+    xyz, sizes, max_points = args
+    volume = np.zeros(len(sizes))
+    surface = np.zeros(len(sizes))
+    projection = np.zeros(len(sizes))
+    bounds = np.r_[0, np.cumsum(sizes)]
+
+    for i in range(len(sizes)):
+        pts = _hull_candidates(xyz[bounds[i]:bounds[i + 1]], max_points)
+        try:
+            projection[i] = ConvexHull(pts[:, :2]).volume  # 2D "volume" is the area
+            hull = ConvexHull(pts)
+        except (QhullError, ValueError):
+            # flat or collinear crown: no volume
+            continue
+        volume[i] = hull.volume
+        surface[i] = hull.area
+
+    return volume, surface, projection
+
+
+def crown_metrics_3d_by_label(x, y, z, labels, max_points=20000, min_points=3,
+                              num_workers=1, chunk_size=200):
+    """
+    3D convex-hull volume, surface area and crown projection area per label.
+
+    Parameters:
+    - x, y, z (array-like): point coordinates
+    - labels (array-like): integer label (tree id) per point
+    - max_points (int): trees with more points are reduced (exactly) in blocks of this size
+    - min_points (int): labels with fewer points are skipped
+    - num_workers (int): processes to use, 1 runs everything in-process
+    - chunk_size (int): number of trees handed to a worker at once
+
+    Returns:
+    - hull_labels (np.ndarray): sorted labels with metrics
+    - metrics (dict[str, np.ndarray]): crown_vol, crown_surf (3D hull) and
+      crown_proj (2D hull area); 0 for degenerate crowns
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    labels = np.asarray(labels)
+
+    # ------------------ group once ------------------
+    order = np.argsort(labels, kind="stable")
+    uniq, counts = np.unique(labels[order], return_counts=True)
+    valid = counts >= min_points
+    hull_labels = uniq[valid]
+
+    if len(hull_labels) == 0:
+        empty = np.empty(0)
+        return hull_labels, {"crown_vol": empty, "crown_surf": empty, "crown_proj": empty}
+
+    keep = np.repeat(valid, counts)
+    order = order[keep]
+    counts = counts[valid]
+
+    xyz = np.column_stack((x[order], y[order], z[order]))
+    bounds = np.r_[0, np.cumsum(counts)]
+
+    # ------------------ chunked Qhull ------------------
+    chunks = []
+    for g0 in range(0, len(hull_labels), chunk_size):
+        g1 = min(g0 + chunk_size, len(hull_labels))
+        chunks.append((xyz[bounds[g0]:bounds[g1]], counts[g0:g1], max_points))
+
+    if num_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(chunks))) as pool:
+            parts = list(pool.map(_hull3d_chunk, chunks))
+    else:
+        parts = [_hull3d_chunk(c) for c in chunks]
+
+    return hull_labels, {
+        "crown_vol": np.concatenate([p[0] for p in parts]),
+        "crown_surf": np.concatenate([p[1] for p in parts]),
+        "crown_proj": np.concatenate([p[2] for p in parts]),
+    }
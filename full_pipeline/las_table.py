@@ -0,0 +1,116 @@
+# las_table.py
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import laspy
+
+# ---------------------------------------------------------------------------
+# Columnar LAS tables
+# ---------------------------------------------------------------------------
+# A LAS/LAZ file is read into plain NumPy columns instead of a GeoDataFrame
+# with one shapely Point per point:
+#
+#   x, y, z     real coordinates (float64, header scale and offset applied)
+#   <dim>       the selected LAS dimensions (all if dims is None), as stored
+#
+# The file is decompressed in chunks of CHUNK_POINTS and only the selected
+# dimensions are kept, so reading three columns of a large cloud does not hold
+# all point records in memory. Point geometries are built only on request, in
+# one gpd.points_from_xy call. point_count reads the header only.
+#
+# The columns stay NumPy arrays rather than an Arrow table (pyarrow is
+# available, the hull store uses it): laspy decodes into NumPy, the hull
+# kernels and points_from_xy take NumPy, and an Arrow table would add a copy
+# per column on the way in and out. The layout matches the DataFrame columns
+# of point_sidecar.read_point_table.
+
+LAS_CRS = "EPSG:28992"
+CHUNK_POINTS = 5_000_000
+
+
+def point_count(las_path):
+    """Number of points from the LAS header (no point data is read)."""
+    with laspy.open(las_path) as f:
+        return int(f.header.point_count)
+
+
+class LasTable:
+    """
+    Columns of a LAS/LAZ point cloud (see read_las_table).
+
+    Attributes:
+    - columns (dict): column name -> np.ndarray, always with x, y, z
+    - crs (str): crs of the coordinates
+    """
+
+    def __init__(self, columns, crs=LAS_CRS):
+        self.columns = columns
+        self.crs = crs
+        self._geometry = None
+
+    def __len__(self):
+        return len(self.columns["x"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def x(self):
+        return self.columns["x"]
+
+    @property
+    def y(self):
+        return self.columns["y"]
+
+    @property
+    def z(self):
+        return self.columns["z"]
+
+    def geometry(self):
+        """Point geometries (x, y, z), built once in bulk."""
+        if self._geometry is None:
+            self._geometry = gpd.points_from_xy(self.x, self.y, self.z, crs=self.crs)
+        return self._geometry
+
+    def to_frame(self):
+        """pd.DataFrame of all columns (x, y, z included, no geometry)."""
+        return pd.DataFrame(self.columns)
+
+    def to_gdf(self, columns=None):
+        """GeoDataFrame of the given columns (all but x, y, z if None) with point geometries."""
+        if columns is None:
+            columns = [c for c in self.columns if c not in ("x", "y", "z")]
+        return gpd.GeoDataFrame({c: self.columns[c] for c in columns}, geometry=self.geometry(), crs=self.crs)
+
+
+def read_las_table(las_path, dims=None, chunk_points=CHUNK_POINTS):
+    """
+    Read a LAS/LAZ file as a LasTable.
+
+    Parameters:
+    - las_path (str): LAS/LAZ file
+    - dims (list[str] | None): LAS dimensions to include (all if None); real
+      coordinates are always included as x, y, z
+    - chunk_points (int): points decompressed at a time
+
+    Returns:
+    - LasTable with one row per point, in file order
+    """
+    with laspy.open(las_path) as reader:
+        n = int(reader.header.point_count)
+        names = list(reader.header.point_format.dimension_names) if dims is None else list(dims)
+        names = ["x", "y", "z"] + [d for d in names if d not in ("X", "Y", "Z", "x", "y", "z")]
+
+        columns = {}
+        start = 0
+        for chunk in reader.chunk_iterator(chunk_points):
+            for name in names:
+                values = np.asarray(getattr(chunk, name) if name in ("x", "y", "z") else chunk[name])
+                if name not in columns:
+                    columns[name] = np.empty(n, dtype=values.dtype)
+                columns[name][start:start + len(values)] = values
+            start += len(chunk)
+
+    if not columns:   # empty file
+        columns = {name: np.empty(0, dtype=np.float64) for name in names}
+    return LasTable(columns)
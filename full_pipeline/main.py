@@ -6,7 +6,7 @@ from shared_logging import setup_logging
 from preprocess_pointcloud import process_point_cloud
 from segmentation import run_segmentation, run_segmentation_sweep
 from merge_tree_ids import merge_tree_ids_into_las
-from tree_feature_extraction import run_feature_extraction_single_thread
+from tree_feature_extraction import run_feature_extraction
 from features import (
     height_features,
     intensity_features,
@@ -134,15 +134,15 @@ else:
 #===========================================================================
 logger.info("=== Merging tree IDs into LAS ===")
 
-merged_las = "forest_tid.laz"
+# tree_id is stored as a sidecar of forest.laz (forest.laz.attrs/tree_id.npy)
+merged_las = vegetation_las
 segmentation_to_use = "segmentation_0000.xyz"  # ← manually picked best result
 logger.info("Using segmentation file: %s", segmentation_to_use)
 
 merge_tree_ids_into_las(
     data_dir=data_dir,
     forest_las_name=vegetation_las,
-    segmentation_xyz=segmentation_to_use,
-    output_las_name=merged_las
+    segmentation_xyz=segmentation_to_use
 )
 logger.info("✓ Merging completed")
 
@@ -152,10 +152,11 @@ logger.info("✓ Merging completed")
 
 logger.info("=== Tree feature extraction started ===")
 
-tree_count = run_feature_extraction_single_thread(
+tree_count = run_feature_extraction(
     data_dir=data_dir,
     las_name=merged_las,
-    feature_funcs=height_features + intensity_features + crown_shape_features + density_features
+    feature_funcs=height_features + intensity_features + crown_shape_features + density_features,
+    cores=4
 )
 
 logger.info("✓ Tree feature extraction completed — %d trees processed", tree_count)
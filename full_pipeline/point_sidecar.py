@@ -0,0 +1,139 @@
+# point_sidecar.py
+import os
+import json
+import numpy as np
+import pandas as pd
+import laspy
+
+# ---------------------------------------------------------------------------
+# Per-point attribute sidecars
+# ---------------------------------------------------------------------------
+# Derived per-point labels (gtid, tree_id, ...) are stored next to a LAZ file
+# instead of being baked into it:
+#
+#   vegetation.LAZ
+#   vegetation.LAZ.attrs/
+#       meta.json        {"point_count": n, "columns": {"gtid": "int64", ...}}
+#       gtid.npy         n values, same order as the LAZ points
+#
+# Relabelling after a re-run is then one small .npy write instead of a full
+# LAZ decompress / recompress. read_point_table presents LAZ + sidecars as one
+# table, and bake_sidecars writes a LAZ with the columns as extra dimensions
+# for export.
+
+
+def sidecar_dir(laz_path):
+    return laz_path + ".attrs"
+
+
+def las_point_count(laz_path):
+    """Number of points from the LAS header (no point data is read)."""
+    with laspy.open(laz_path) as f:
+        return int(f.header.point_count)
+
+
+def _read_meta(laz_path):
+    meta_path = os.path.join(sidecar_dir(laz_path), "meta.json")
+    if not os.path.exists(meta_path):
+        return {"point_count": None, "columns": {}}
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def sidecar_columns(laz_path):
+    """Names of the sidecar columns stored for a LAZ file."""
+    return list(_read_meta(laz_path)["columns"])
+
+
+def write_sidecar(laz_path, name, values):
+    """Store one per-point column for laz_path (overwrites an existing column)."""
+    values = np.asarray(values)
+    point_count = las_point_count(laz_path)
+    if len(values) != point_count:
+        raise ValueError(f"Sidecar '{name}' has {len(values)} values, {laz_path} has {point_count} points")
+
+    out_dir = sidecar_dir(laz_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # the LAZ was rewritten with another point count: the stored columns no
+    # longer line up with its points, drop them
+    meta = _read_meta(laz_path)
+    if meta["point_count"] != point_count:
+        for old in meta["columns"]:
+            old_path = os.path.join(out_dir, f"{old}.npy")
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        meta = {"point_count": point_count, "columns": {}}
+
+    # write to a temp file first so a crash never leaves a truncated column
+    tmp_path = os.path.join(out_dir, f".{name}.tmp.npy")
+    np.save(tmp_path, values)
+    os.replace(tmp_path, os.path.join(out_dir, f"{name}.npy"))
+
+    meta["point_count"] = point_count
+    meta["columns"][name] = str(values.dtype)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_sidecar(laz_path, name, mmap=False):
+    """Load one sidecar column (optionally memory-mapped)."""
+    path = os.path.join(sidecar_dir(laz_path), f"{name}.npy")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No sidecar column '{name}' for {laz_path}")
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def has_sidecar(laz_path, name):
+    return os.path.exists(os.path.join(sidecar_dir(laz_path), f"{name}.npy"))
+
+
+def read_point_table(laz_path, dims=None, sidecars=None):
+    """
+    Read a LAZ file plus its sidecar columns as one DataFrame.
+
+    Parameters:
+    - laz_path (str): LAS/LAZ file
+    - dims (list[str] | None): LAS dimensions to include (all if None); real
+      coordinates are always included as x, y, z
+    - sidecars (list[str] | None): sidecar columns to include (all if None)
+
+    Returns:
+    - pd.DataFrame with one row per LAS point, in file order
+    """
+    las = laspy.read(laz_path)
+    table = {"x": np.asarray(las.x), "y": np.asarray(las.y), "z": np.asarray(las.z)}
+
+    names = list(las.point_format.dimension_names) if dims is None else dims
+    for dim in names:
+        if dim in ("X", "Y", "Z"):
+            continue
+        table[dim] = np.asarray(las[dim])
+
+    for name in (sidecar_columns(laz_path) if sidecars is None else sidecars):
+        values = read_sidecar(laz_path, name)
+        if len(values) != len(las.points):
+            raise ValueError(f"Sidecar '{name}' is out of date for {laz_path}")
+        table[name] = values
+
+    return pd.DataFrame(table)
+
+
+def bake_sidecars(laz_path, out_path, columns=None, keep_mask=None):
+    """
+    Export laz_path with sidecar columns added as extra dimensions.
+    keep_mask (bool array) optionally keeps only a subset of the points.
+    """
+    las = laspy.read(laz_path)
+
+    for name in (sidecar_columns(laz_path) if columns is None else columns):
+        values = read_sidecar(laz_path, name)
+        if name not in las.point_format.dimension_names:
+            las.add_extra_dim(laspy.ExtraBytesParams(name=name, type=values.dtype))
+        las[name] = values
+
+    if keep_mask is not None:
+        las.points = las.points[np.asarray(keep_mask, dtype=bool)]
+
+    las.write(out_path)
+    return len(las.points)
@@ -1,8 +1,5 @@
 import os
 import sys
-import subprocess
-import pandas as pd
-import time
 from itertools import product
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
@@ -10,56 +7,56 @@ from tqdm import tqdm
 
 import logging
 from shared_logging import setup_module_logger
+from results_store import RESULTS_DB, ResultsStore
+from run_meta import run_segmenter, output_stats
 
 logger = None  # will be initialized in each function
 
 # ------------------------------- helpers -----------------------------------
 
-def next_index(csv_path):
-    """Return the next index based on existing rows in the CSV (used for naming output files)."""
-    if os.path.exists(csv_path):
-        return len(pd.read_csv(csv_path))
-    return 0
+STATS_COLUMNS = ["File Name", "Radius", "Vertical Res", "Min Points", "Num Points", "Num Trees", "Runtime (s)"]
+
+def open_results_store(data_dir, exe):
+    """Results store of segmentation_stats for this data_dir / executable (imports an existing CSV once)."""
+    store = ResultsStore(os.path.join(data_dir, RESULTS_DB), "segmentation_stats",
+                         os.path.basename(os.path.normpath(data_dir)), os.path.basename(exe))
+    store.import_csv(os.path.join(data_dir, "segmentation_stats.csv"))
+    return store
+
+def next_index(store):
+    """Return the next free result index in the store (used for naming output files)."""
+    return store.next_index()
 
 def count_xyz_file_stats(path):
-    """Count total number of points and number of unique trees in an output .xyz file."""
-    df = pd.read_csv(path, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
-    return len(df), df["tree_id"].nunique()
-
-def create_or_update_csv(csv_path, new_rows):
-    """Append new segmentation results to the summary CSV."""
-    cols = ["File Name", "Radius", "Vertical Res", "Min Points", "Num Points", "Num Trees", "Runtime (s)"]
-    df = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame(columns=cols)
+    """Total number of points and number of unique trees of an output .xyz file (from its run record)."""
+    return output_stats(path)
+
+def file_index(file_name):
+    """Result index encoded in an output file name (segmentation_0007.xyz -> 7)."""
+    return int(os.path.splitext(file_name)[0].rsplit("_", 1)[1])
+
+def create_or_update_csv(store, csv_path, new_rows):
+    """Upsert new segmentation results into the store and export the summary CSV."""
     for row in new_rows:
-        df.loc[len(df)] = row
-    df.to_csv(csv_path, index=False)
-    logger.info("CSV updated → %s  (rows=%d)", csv_path, len(df))
+        store.upsert(row, idx=file_index(row["File Name"]))
+    n_rows = store.export_csv(csv_path, STATS_COLUMNS)
+    logger.info("CSV updated → %s  (rows=%d)", csv_path, n_rows)
 
-def is_duplicate_combo(csv_path, radius, vres, min_pts):
+def is_duplicate_combo(store, radius, vres, min_pts):
     """Check if the given parameter combination has already been processed and logged."""
-    if not os.path.exists(csv_path):
-        return False
-    df = pd.read_csv(csv_path)
-    return ((df["Radius"] == radius) &
-            (df["Vertical Res"] == vres) &
-            (df["Min Points"] == min_pts)).any()
+    return store.has(radius, vres, min_pts)
 
 # ------------------------------ runner -------------------------------------
 
 def run_cpp_segmenter(exe, input_path, output_path, radius, vres, min_pts):
-    """Run the C++ segmentation executable with given parameters."""
-    cmd = [exe, input_path, output_path, str(radius), str(vres), str(min_pts)]
-    logger.info("Running: %s", " ".join(cmd))
-    try:
-        start = time.time()
-        subprocess.run(cmd, check=True, text=True,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE)
-        runtime = time.time() - start
-        return True, runtime
-    except subprocess.CalledProcessError as e:
-        logger.error("C++ segmentation failed with return code %d", e.returncode)
+    """Run the C++ segmentation executable with given parameters (writes the run record of the output)."""
+    logger.info("Running: %s", " ".join([exe, input_path, output_path, str(radius), str(vres), str(min_pts)]))
+    success, runtime, meta = run_segmenter(exe, input_path, output_path, radius, vres, min_pts)
+    if not success:
+        logger.error("C++ segmentation failed with return code %d", meta["returncode"])
         return False, 0.0
+    logger.info("Peak memory %s MB, %d points in → %d out", meta["peak_rss_mb"], meta["input"]["points"], meta["points_out"])
+    return True, runtime
 
 # --------------------------- public API ------------------------------------
 
@@ -67,7 +64,7 @@ def run_segmentation(data_dir, exe, input_xyz, output_dir,
                      radius, vres, min_pts, overwrite=False):
     """
     Run a single segmentation using one parameter set.
-    Results are saved to a file and logged in a CSV.
+    Results are saved to a file and logged in the results store (exported to a CSV).
     """
     global logger
     if logger is None:
@@ -80,12 +77,13 @@ def run_segmentation(data_dir, exe, input_xyz, output_dir,
 
     os.makedirs(output_dir, exist_ok=True)
     csv_path = os.path.join(data_dir, "segmentation_stats.csv")
+    store = open_results_store(data_dir, exe)
 
-    if not overwrite and is_duplicate_combo(csv_path, radius, vres, min_pts):
+    if not overwrite and is_duplicate_combo(store, radius, vres, min_pts):
         logger.info("Skipping duplicate combination: r=%d, vres=%d, min=%d", radius, vres, min_pts)
         return
 
-    idx = next_index(csv_path)
+    idx = next_index(store)
     out_file = os.path.join(output_dir, f"segmentation_{idx:04d}.xyz")
 
     success, runtime = run_cpp_segmenter(exe, os.path.join(data_dir, input_xyz), out_file, radius, vres, min_pts)
@@ -97,7 +95,7 @@ def run_segmentation(data_dir, exe, input_xyz, output_dir,
         num_pts, num_trees = count_xyz_file_stats(out_file)
         logger.info("→ %d points, %d trees", num_pts, num_trees)
 
-        create_or_update_csv(csv_path, [{
+        create_or_update_csv(store, csv_path, [{
             "File Name": os.path.basename(out_file),
             "Radius": radius,
             "Vertical Res": vres,
@@ -112,8 +110,9 @@ def run_segmentation_sweep(data_dir, exe, input_xyz, output_dir,
                            overwrite=False, save_per_iteration=False):
     """
     Run segmentation for a sweep of parameter combinations in parallel.
-    Skips combinations already in the CSV unless overwrite=True.
-    If save_per_iteration=True, updates the CSV after every task.
+    Skips combinations already in the results store unless overwrite=True
+    (a rerun combination replaces its row).
+    If save_per_iteration=True, updates the store and CSV after every task.
     """
     global logger
     if logger is None:
@@ -123,12 +122,14 @@ def run_segmentation_sweep(data_dir, exe, input_xyz, output_dir,
 
     os.makedirs(output_dir, exist_ok=True)
     csv_path = os.path.join(data_dir, "segmentation_stats.csv")
+    store = open_results_store(data_dir, exe)
     combos = list(product(radius_vals, vres_vals, min_pts_vals))
-    start_idx = next_index(csv_path)
+    start_idx = next_index(store)
+    done = store.done()
     tasks = []
 
     for i, (r, v, m) in enumerate(combos):
-        if not overwrite and is_duplicate_combo(csv_path, r, v, m):
+        if not overwrite and (r, v, m) in done:
             logger.info("Skipping duplicate combination: r=%d, vres=%d, min=%d", r, v, m)
             continue
         out_file = os.path.join(output_dir, f"segmentation_{start_idx + len(tasks):04d}.xyz")
@@ -156,7 +157,7 @@ def run_segmentation_sweep(data_dir, exe, input_xyz, output_dir,
         with ThreadPoolExecutor(max_workers=cores) as pool:
             for row in tqdm(pool.map(process_task, tasks), total=len(tasks), desc="Segmenting", disable=not sys.stdout.isatty()):
                 if row:
-                    create_or_update_csv(csv_path, [row])
+                    create_or_update_csv(store, csv_path, [row])
     else:
         new_rows = []
         with ThreadPoolExecutor(max_workers=cores) as pool:
@@ -164,7 +165,7 @@ def run_segmentation_sweep(data_dir, exe, input_xyz, output_dir,
                 if row:
                     new_rows.append(row)
         if new_rows:
-            create_or_update_csv(csv_path, new_rows)
+            create_or_update_csv(store, csv_path, new_rows)
 
 
 # --------------------------- standalone CLI --------------------------------
@@ -3,11 +3,13 @@ import logging
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-import laspy
-from shapely.geometry import Point, box, Polygon
-from shapely.ops import unary_union
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label
+from point_sidecar import sidecar_columns, read_sidecar
+from muni_index import load_muni_index
+from las_table import read_las_table
+from hull_store import hull_path, write_hulls
 logger = None  # to be initialized when needed
 
 
@@ -16,33 +18,16 @@ logger = None  # to be initialized when needed
 #--------------------------------------------------
 
 def load_forest_gdf(laz_file_path):
-    with laspy.open(laz_file_path) as las:
-        points = las.read()
-        scale = las.header.scales
-        offset = las.header.offsets
-
-        X = points.X * scale[0] + offset[0]
-        Y = points.Y * scale[1] + offset[1]
-        Z = points.Z * scale[2] + offset[2]
-
-        attributes = {dim.name: np.array(getattr(points, dim.name)) for dim in points.point_format}
-        df = pd.DataFrame(attributes)
-        df['X'] = X
-        df['Y'] = Y
-        df['Z'] = Z
-
-        # df = df[['tree_id', 'X', 'Y', 'Z', 'red', 'green', 'blue', 'nir', 'ndvi', 'norm_g', 'mtvi2']]
-        df['geometry'] = df.apply(lambda row: Point(row['X'], row['Y'], row['Z']), axis=1)
-        df.drop(columns=['X', 'Y', 'Z'], inplace=True)
-
-        return gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:28992")
-
-def load_municipality_geojson(filename):
-    gdf = gpd.read_file(filename)
-    assert all(gdf.geometry.type == "Point"), "GeoJSON must contain Point geometries"
-    gdf = gdf[["OBJECTID", "BOOMSORTIMENT", "geometry"]]
-    gdf["BOOMSORTIMENT"] = gdf["BOOMSORTIMENT"].astype(pd.StringDtype())
-    return gdf.to_crs("EPSG:28992")
+    """Forest point cloud plus its sidecar columns (e.g. tree_id) as a GeoDataFrame (EPSG:28992)."""
+    table = read_las_table(laz_file_path)
+    for name in sidecar_columns(laz_file_path):
+        table.columns[name] = read_sidecar(laz_file_path, name)
+    return table.to_gdf()
+
+def load_municipality_geojson(filename, bbox=None):
+    """Municipality trees (OBJECTID, BOOMSORTIMENT, geometry) in EPSG:28992 from the cached index, optionally only inside bbox."""
+    index = load_muni_index(filename)
+    return index.to_gdf(None if bbox is None else index.query_bbox(bbox))
 
 #--------------------------------------------------
 # MATCHING
@@ -50,10 +35,8 @@ def load_municipality_geojson(filename):
 
 def compute_tree_convex_hulls(gdf):
     gdf = gdf[gdf["tree_id"] != -1]
-    hull_gdf = gdf.groupby("tree_id")["geometry"].apply(
-        lambda geom: Polygon(unary_union(geom).convex_hull.exterior)
-    ).reset_index()
-    return gpd.GeoDataFrame(hull_gdf, geometry="geometry", crs=gdf.crs)
+    tids, hulls, _ = convex_hulls_by_label(gdf.geometry.x.values, gdf.geometry.y.values, gdf["tree_id"].values)
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=gdf.crs)
 
 
 
@@ -118,13 +101,12 @@ def filter_consistent_species_matches(exploded_df, muni_gdf):
 # PUBLIC FUNCTION
 #--------------------------------------------------
 
-def export_tree_hulls(data_dir, laz_name, output_name="tree_convex_hulls.geojson"):
+def export_tree_hulls(data_dir, laz_name, output_name="tree_convex_hulls"):
     laz_path = os.path.join(data_dir, laz_name)
     forest_gdf = load_forest_gdf(laz_path)
     hull_gdf = compute_tree_convex_hulls(forest_gdf)
     
-    output_path = os.path.join(data_dir, output_name)
-    hull_gdf.to_file(output_path, driver="GeoJSON")
+    output_path = write_hulls(hull_gdf, hull_path(data_dir, output_name))
 
     logger.info("Exported %d convex hulls to %s", len(hull_gdf), output_path)
 
@@ -156,8 +138,9 @@ def extract_species_labels(data_dir, laz_name, municipality_geojson, export_tree
             logger.info("%s %s Min: %s Max: %s", col.ljust(col_width), str(dtype).ljust(col_width), str(min_val), str(max_val))
     
     logger.info("------------------------")
-    muni_gdf = load_municipality_geojson(muni_path)
-    logger.info("Municipality GeoJSON loaded: %d records", len(muni_gdf))
+    # only trees inside the point cloud extent can fall in a hull
+    muni_gdf = load_municipality_geojson(muni_path, forest_gdf.total_bounds)
+    logger.info("Municipality trees loaded: %d records inside the point cloud extent", len(muni_gdf))
     for col in ["OBJECTID", "BOOMSORTIMENT"]:
         dtype = muni_gdf[col].dtype
         unique_vals = muni_gdf[col].nunique()
@@ -177,9 +160,8 @@ def extract_species_labels(data_dir, laz_name, municipality_geojson, export_tree
 
     if export_tree_hull:
         hull_gdf = compute_tree_convex_hulls(forest_gdf)
-        hull_path = os.path.join(data_dir, "tree_convex_hulls.geojson")
-        hull_gdf.to_file(hull_path, driver="GeoJSON")
-        logger.info("✓ Exported %d convex hulls to %s", len(hull_gdf), hull_path)
+        hulls_file = write_hulls(hull_gdf, hull_path(data_dir, "tree_convex_hulls"))
+        logger.info("✓ Exported %d convex hulls to %s", len(hull_gdf), hulls_file)
     else:
         logger.info("✓ Skipped hull export")
 
@@ -1,74 +1,130 @@
 import os
 import sys
-import laspy
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 
 from shared_logging import setup_module_logger
+from point_sidecar import read_point_table
 logger = None  # to be initialized when needed
 
 from features import (height_features, intensity_features,
-                      crown_shape_features, density_features)
-
-
-def run_feature_extraction_single_thread(data_dir, las_name, feature_funcs):
+                      crown_shape_features, density_features,
+                      TreeGroups, GROUPED_FEATURES)
+
+TREE_COLUMNS = ["x", "y", "z", "intensity", "return_number", "number_of_returns", "ndvi", "norm_g", "mtvi2"]
+BLOCKS_PER_CORE = 4   # blocks of trees per worker process, for load balancing
+
+# ---------------------------------------------------------------------------
+# Feature extraction engine
+# ---------------------------------------------------------------------------
+# The points are sorted by tree once (features.TreeGroups). Features with a
+# grouped version (features.GROUPED_FEATURES) are computed for all trees at
+# once from segment reductions; the remaining per-tree functions (the crown
+# width features, or any other feature function) run in `cores` worker
+# processes, each on a contiguous block of trees with about the same number of
+# points. No per-tree mask over the full point array is built.
+
+
+def _per_tree_block(args):
+    """Per-tree features of a block of trees (worker process). Returns (rows, errors)."""
+    tree_ids, counts, columns, feature_funcs = args
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    rows, errors = [], []
+    for i, tid in enumerate(tree_ids):
+        df_tree = pd.DataFrame({c: v[bounds[i]:bounds[i + 1]] for c, v in columns.items()})
+        row = {"tree_id": tid}
+        for func in feature_funcs:
+            try:
+                row.update(func(df_tree))
+            except Exception as e:
+                errors.append((tid, func.__name__, str(e)))
+                row[func.__name__] = np.nan
+        rows.append(row)
+    return rows, errors
+
+
+def _tree_blocks(groups, n_blocks):
+    """(first tree, end tree) of n_blocks contiguous blocks with about equal point counts."""
+    cum = np.cumsum(groups.counts)
+    cuts = np.searchsorted(cum, np.linspace(0, cum[-1], n_blocks + 1)[1:-1], side="right")
+    bounds = np.unique(np.concatenate(([0], cuts, [len(groups)])))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def extract_tree_features(pts, feature_funcs, cores=4):
+    """
+    Features per tree of a point table.
+
+    Parameters:
+    - pts (pd.DataFrame): tree_id (-1 = no tree) and TREE_COLUMNS per point
+    - feature_funcs (list): feature functions (see features.py)
+    - cores (int): worker processes for the functions without a grouped version
+
+    Returns:
+    - pd.DataFrame: tree_id and one column per feature, one row per tree (ascending tree_id)
+    """
+    names = [func.__name__ for func in feature_funcs]
+    keep = pts["tree_id"].values != -1
+    if not keep.any():
+        return pd.DataFrame(columns=["tree_id"] + names)
+
+    groups = TreeGroups({c: pts[c].values[keep] for c in TREE_COLUMNS}, pts["tree_id"].values[keep])
+    table = {"tree_id": groups.tree_ids}
+    for func in feature_funcs:
+        if func in GROUPED_FEATURES:
+            table[func.__name__] = GROUPED_FEATURES[func](groups)
+    df_all = pd.DataFrame(table)
+
+    per_tree = [func for func in feature_funcs if func not in GROUPED_FEATURES]
+    if per_tree:
+        logger.info("Per-tree features (%s) in %d processes", ", ".join(f.__name__ for f in per_tree), cores)
+        tasks = []
+        for lo, hi in _tree_blocks(groups, min(len(groups), max(1, cores * BLOCKS_PER_CORE))):
+            p0, p1 = groups.starts[lo], groups.starts[hi - 1] + groups.counts[hi - 1]
+            tasks.append((groups.tree_ids[lo:hi], groups.counts[lo:hi],
+                          {c: v[p0:p1] for c, v in groups.columns.items()}, per_tree))
+
+        rows = []
+        with ProcessPoolExecutor(max_workers=cores) as pool:
+            for block_rows, errors in tqdm(pool.map(_per_tree_block, tasks), total=len(tasks),
+                                           desc="per-tree features", disable=not sys.stdout.isatty()):
+                rows.extend(block_rows)
+                for tid, name, message in errors:
+                    logger.error("Tree %s → Feature '%s' raised an error: %s", tid, name, message)
+        # blocks come back in order, so the rows line up with df_all
+        per_tree_df = pd.DataFrame(rows).drop(columns="tree_id")
+        df_all = pd.concat([df_all, per_tree_df], axis=1)
+
+    extra = [c for c in df_all.columns if c != "tree_id" and c not in names]
+    df_all = df_all[["tree_id"] + [n for n in names if n in df_all.columns] + extra]
+
+    for name in df_all.columns[1:]:
+        n_nan = int(pd.isna(df_all[name]).sum())
+        if n_nan:
+            logger.warning("Feature '%s' is NaN for %d trees", name, n_nan)
+    return df_all
+
+
+def run_feature_extraction(data_dir, las_name, feature_funcs, cores=4):
     global logger
     if logger is None:
         logger = setup_module_logger("4_tree_feature_extraction", data_dir)
 
     logger.info("=" * 60 + "Tree Feature Extraction")
-    logger.info("Parameters → data_dir: %s | las_name: %s", data_dir, las_name)
-    
-    logger.info("[tree_analysis] Feature extraction started as a single thread")
+    logger.info("Parameters → data_dir: %s | las_name: %s | cores: %d", data_dir, las_name, cores)
 
     las_path = os.path.join(data_dir, las_name)
-    logger.info("Reading LAS: %s", las_path)
-
-    las = laspy.read(las_path)
-    scale = las.header.scales
-    offset = las.header.offsets
-
-    tree_ids = np.unique(las.tree_id)
-    tree_ids = tree_ids[tree_ids != -1]
-
-    features = []
-
-    logger.info("Extracting features for %d trees", len(tree_ids))
-    for tid in tqdm(tree_ids, desc="processing trees", disable=not sys.stdout.isatty()):
-        mask = las.tree_id == tid
-        df_tree = pd.DataFrame({
-            "x": las.X[mask] * scale[0] + offset[0],
-            "y": las.Y[mask] * scale[1] + offset[1],
-            "z": las.Z[mask] * scale[2] + offset[2],
-            "intensity": np.array(las.intensity[mask]),
-            "return_number": np.array(las.return_number[mask]),
-            "number_of_returns": np.array(las.number_of_returns[mask]),
-            "ndvi": las.ndvi[mask] if hasattr(las, "ndvi") else np.repeat(np.nan, mask.sum()),
-            "norm_g": las.norm_g[mask] if hasattr(las, "norm_g") else np.repeat(np.nan, mask.sum()),
-            "mtvi2": las.mtvi2[mask] if hasattr(las, "mtvi2") else np.repeat(np.nan, mask.sum())
-        })
-
-        row = {"tree_id": tid}
-        for func in feature_funcs:
-            try:
-                result = func(df_tree)
-                row.update(result)
-
-                # Log if any feature value is NaN
-                for k, v in result.items():
-                    if isinstance(v, float) and np.isnan(v):
-                        logger.warning("Tree %s → Feature '%s' returned NaN", tid, k)
-
-            except Exception as e:
-                logger.error("Tree %s → Feature '%s' raised an error: %s", tid, func.__name__, str(e))
-                row[func.__name__] = np.nan
-
-        logger.info("✓ Tree %d features extracted", tid)
-        features.append(row)
+    logger.info("Reading LAS + sidecars: %s", las_path)
 
+    pts = read_point_table(las_path)
+    for col in ("ndvi", "norm_g", "mtvi2"):
+        if col not in pts.columns:
+            pts[col] = np.nan
 
-    df_all = pd.DataFrame(features)
+    df_all = extract_tree_features(pts, feature_funcs, cores)
+    logger.info("Extracted features for %d trees", len(df_all))
 
     output_csv = os.path.join(data_dir, "tree_features.csv")
     df_all.to_csv(output_csv, index=False)
@@ -87,15 +143,16 @@ def run_feature_extraction_single_thread(data_dir, las_name, feature_funcs):
 
 if __name__ == "__main__":
     data_dir = "whm_100"
-    las_name = "forest_tid.laz"
+    las_name = "forest.laz"
 
     logger = setup_module_logger("4_tree_feature_extraction", data_dir)
 
 
-    run_feature_extraction_single_thread(
+    run_feature_extraction(
         data_dir=data_dir,
         las_name=las_name,
-        feature_funcs=height_features + intensity_features + crown_shape_features + density_features
+        feature_funcs=height_features + intensity_features + crown_shape_features + density_features,
+        cores=4
     )
 
 
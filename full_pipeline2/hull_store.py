@@ -0,0 +1,231 @@
+# hull_store.py
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+# ---------------------------------------------------------------------------
+# Hull storage
+# ---------------------------------------------------------------------------
+# Hull layers are stored as GeoParquet: columnar, compressed, and with a bbox
+# covering column (xmin/ymin/xmax/ymax per row) so readers can skip row groups
+# outside a query window. Coordinates are snapped to HULL_PRECISION, which is
+# far below the point spacing of the cloud and keeps the files small. GeoJSON
+# is only written as an explicit export (QGIS handoff).
+#
+# Every hull reader/writer goes through write_hulls / read_hulls; both also
+# accept a .geojson path so older case folders can still be read.
+
+HULL_EXT = ".parquet"
+HULL_PRECISION = 0.01   # metres (EPSG:28992)
+HULL_CRS = "EPSG:28992"
+GEOMETRY_TYPES = {0: "Point", 1: "LineString", 3: "Polygon", 4: "MultiPoint",
+                  5: "MultiLineString", 6: "MultiPolygon", 7: "GeometryCollection"}
+
+
+def hull_path(directory, stem):
+    """Path of a hull layer in the store format, e.g. hull_path(tile_dir, "segmentation_hulls")."""
+    return os.path.join(directory, stem + HULL_EXT)
+
+
+def write_hulls(gdf, path, precision=HULL_PRECISION):
+    """Write a hull layer (GeoParquet with bbox covering; GeoJSON if path ends with .geojson)."""
+    gdf = gdf.copy()
+    if gdf.crs is None:
+        gdf = gdf.set_crs(HULL_CRS)
+    if precision and len(gdf):
+        gdf.geometry = shapely.set_precision(gdf.geometry.values, precision)
+
+    if path.endswith(".geojson"):
+        gdf.to_file(path, driver="GeoJSON")
+    else:
+        gdf.to_parquet(path, compression="zstd", write_covering_bbox=True)
+    return path
+
+
+def read_hulls(path, bbox=None, columns=None):
+    """
+    Read a hull layer.
+
+    Parameters:
+    - path (str): .parquet (store) or .geojson (legacy / export) file
+    - bbox (tuple | None): (minx, miny, maxx, maxy), only rows intersecting it are read
+    - columns (list[str] | None): attribute columns to read (geometry is always read)
+    """
+    if path.endswith(".geojson"):
+        gdf = gpd.read_file(path, bbox=bbox, columns=columns)
+    else:
+        if columns is not None and "geometry" not in columns:
+            columns = list(columns) + ["geometry"]
+        gdf = gpd.read_parquet(path, columns=columns, bbox=bbox)
+
+    if gdf.crs is None:
+        gdf = gdf.set_crs(HULL_CRS)
+    return gdf.to_crs(HULL_CRS)
+
+
+def find_hulls(directory, stem):
+    """Existing hull layer for a stem: the store file, else a legacy GeoJSON, else None."""
+    for path in (hull_path(directory, stem), os.path.join(directory, stem + ".geojson")):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def export_geojson(path, geojson_path=None):
+    """Export a stored hull layer to GeoJSON for QGIS; returns the GeoJSON path."""
+    if geojson_path is None:
+        geojson_path = os.path.splitext(path)[0] + ".geojson"
+    read_hulls(path).to_file(geojson_path, driver="GeoJSON")
+    return geojson_path
+
+
+# ---------------------------------------------------------------------------
+# Streaming layer writer
+# ---------------------------------------------------------------------------
+# City-wide layers are written tile by tile: every write() appends one row
+# group, so only the current tile is ever in memory. The GeoParquet "geo"
+# metadata (WKB encoding, PROJJSON crs, bbox covering, layer bbox) is added to
+# the file footer on close, when the full extent is known. The layer is written
+# to a temp file and moved into place on close, so readers never see a partial
+# layer. A layer without rows is still written (schema + geo metadata, no
+# bbox), so an empty layer replaces the old one and is not mistaken for a
+# missing one.
+
+BBOX_TYPE = pa.struct([(k, pa.float64()) for k in ("xmin", "ymin", "xmax", "ymax")])
+EMPTY_LAYER_SCHEMA = pa.schema([("geometry", pa.binary()), ("bbox", BBOX_TYPE)])
+
+
+class HullLayerWriter:
+    """Append hull GeoDataFrames to one GeoParquet layer, one row group per write()."""
+
+    def __init__(self, path, crs=HULL_CRS, precision=HULL_PRECISION):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.crs = CRS(crs)
+        self.precision = precision
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        self._bounds = [np.inf, np.inf, -np.inf, -np.inf]
+        self._types = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _to_table(self, gdf):
+        geoms = gdf.geometry.to_crs(self.crs).values if gdf.crs is not None else gdf.geometry.values
+        geoms = np.asarray(geoms)
+        if self.precision:
+            geoms = shapely.set_precision(geoms, self.precision)
+        b = shapely.bounds(geoms)
+
+        attrs = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        table = pa.Table.from_pandas(attrs, preserve_index=False)
+        table = table.append_column("geometry", pa.array(shapely.to_wkb(geoms).tolist(), pa.binary()))
+        table = table.append_column("bbox", pa.StructArray.from_arrays(
+            [pa.array(b[:, i], pa.float64()) for i in range(4)], fields=list(BBOX_TYPE)))
+
+        self._bounds = [min(self._bounds[0], np.nanmin(b[:, 0])), min(self._bounds[1], np.nanmin(b[:, 1])),
+                        max(self._bounds[2], np.nanmax(b[:, 2])), max(self._bounds[3], np.nanmax(b[:, 3]))]
+        self._types.update(GEOMETRY_TYPES[t] for t in set(shapely.get_type_id(geoms).tolist()) if t in GEOMETRY_TYPES)
+        return table
+
+    def _conform(self, table):
+        """Match the schema of the first write (missing columns -> nulls, extra columns dropped)."""
+        columns = []
+        for field in self._schema:
+            if field.name in table.column_names:
+                columns.append(table[field.name].cast(field.type))
+            else:
+                columns.append(pa.nulls(len(table), field.type))
+        return pa.Table.from_arrays(columns, schema=self._schema)
+
+    def write(self, gdf):
+        """Append one GeoDataFrame (e.g. one tile) as a row group."""
+        if gdf is None or gdf.empty:
+            return
+        self._append(self._to_table(gdf))
+
+    def write_table(self, table, geometry_types=()):
+        """
+        Append rows that are already in the layer format (WKB geometry + bbox
+        column, same crs and precision), e.g. row groups copied from an existing
+        layer. geometry_types are the GeoParquet type names of those rows.
+        """
+        if table.num_rows == 0:
+            if self._schema is None:   # keep the columns for an empty layer
+                self._schema = table.schema.remove_metadata()
+            return
+        bbox = table["bbox"].combine_chunks()
+        lo = [pc.min(pc.struct_field(bbox, [i])).as_py() for i in (0, 1)]
+        hi = [pc.max(pc.struct_field(bbox, [i])).as_py() for i in (2, 3)]
+        self._bounds = [min(self._bounds[0], lo[0]), min(self._bounds[1], lo[1]),
+                        max(self._bounds[2], hi[0]), max(self._bounds[3], hi[1])]
+        self._types.update(geometry_types)
+        self._append(table)
+
+    def _append(self, table):
+        if self._schema is None:
+            self._schema = table.schema.remove_metadata()
+        else:
+            table = self._conform(table)
+        if self._writer is None:
+            self._open()
+
+        self._writer.write_table(table)
+        self.rows += len(table)
+
+    def _open(self):
+        if self._schema is None:
+            self._schema = EMPTY_LAYER_SCHEMA
+        self._writer = pq.ParquetWriter(self.tmp_path, self._schema, compression="zstd", store_schema=False)
+
+    def close(self):
+        """Write the geo metadata and move the layer into place (also without rows). Returns the number of rows."""
+        if self._writer is None:
+            self._open()
+
+        column = {
+            "encoding": "WKB",
+            "geometry_types": sorted(self._types),
+            "crs": self.crs.to_json_dict(),
+            "covering": {"bbox": {k: ["bbox", k] for k in ("xmin", "ymin", "xmax", "ymax")}},
+        }
+        if self.rows:
+            column["bbox"] = [float(v) for v in self._bounds]
+        geo = {"version": "1.1.0", "primary_column": "geometry", "columns": {"geometry": column}}
+        self._writer.add_key_value_metadata({"geo": json.dumps(geo)})
+        self._writer.close()
+        self._writer = None
+        os.replace(self.tmp_path, self.path)
+        return self.rows
+
+    def abort(self):
+        """Drop a partially written layer."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def layer_geometry_types(path):
+    """GeoParquet geometry type names recorded in a stored layer's metadata."""
+    meta = pq.read_metadata(path).metadata or {}
+    if b"geo" not in meta:
+        return []
+    geo = json.loads(meta[b"geo"])
+    return geo["columns"][geo.get("primary_column", "geometry")].get("geometry_types", [])
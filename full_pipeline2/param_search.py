@@ -0,0 +1,188 @@
+# param_search.py
+import numpy as np
+from itertools import product
+
+# ---------------------------------------------------------------------------
+# Adaptive parameter search
+# ---------------------------------------------------------------------------
+# Instead of running the full radius x vres x min_pts grid, the search proposes
+# the next combination from the results that have finished so far:
+#
+#   1. a space-filling start: n_initial grid points picked by farthest-point
+#      sampling (in grid steps, so every axis weighs the same)
+#   2. then the candidate with the best acquisition score, an inverse-distance
+#      weighted estimate of the objective from the scored points plus an
+#      exploration bonus for the distance (in grid steps) to the nearest point
+#      that is finished or still running
+#
+# Points still running count as "known" for the distance, so parallel
+# proposals spread out instead of piling onto one spot. The search stops at
+# the run budget, or once the best point has not improved for `patience`
+# results while all its grid neighbours have been run. The objective is
+# maximized; failed runs (result None) are known but unscored.
+
+
+def farthest_point_order(points, n, start):
+    """Indices of n points picked greedily, each the farthest from the ones before (start first)."""
+    chosen = [start]
+    d = np.linalg.norm(points - points[start], axis=1)
+    while len(chosen) < min(n, len(points)):
+        nxt = int(np.argmax(d))
+        chosen.append(nxt)
+        d = np.minimum(d, np.linalg.norm(points - points[nxt], axis=1))
+    return chosen
+
+
+class AdaptiveGridSearch:
+    """
+    Adaptive search over the grid of parameter value lists.
+
+    Parameters:
+    - axes (list[list]): values per parameter, e.g. [radius_vals, vres_vals, min_pts_vals]
+    - objective (callable): result dict -> float, maximized
+    - budget (int | None): maximum number of runs proposed (None = the whole grid)
+    - n_initial (int | None): size of the space-filling start (None = about 2 per axis, at least 8)
+    - patience (int): finished runs without improvement before stopping (once the best point's neighbours are done)
+    - explore (float): weight of the exploration bonus, in objective std per grid step
+    - power (float): inverse-distance weighting power of the estimate
+    """
+
+    def __init__(self, axes, objective, budget=None, n_initial=None, patience=10, explore=0.5, power=2.0):
+        self.axes = [list(a) for a in axes]
+        self.objective = objective
+        self.combos = list(product(*self.axes))
+        self.index = {c: i for i, c in enumerate(self.combos)}
+
+        # grid coordinates in steps along each axis
+        self.points = np.array(list(product(*(range(len(a)) for a in self.axes))), dtype=float)
+        self.budget = len(self.combos) if budget is None else min(budget, len(self.combos))
+        self.n_initial = n_initial or max(8, 2 * len(self.axes) + 2)
+        self.patience = patience
+        self.explore = explore
+        self.power = power
+
+        self.scores = {}       # grid index -> objective (None = failed run)
+        self.pending = set()   # grid indices proposed, result not yet told
+        self.n_proposed = 0
+        self.best = None       # grid index of the best score
+        self.since_best = 0    # results told since the best improved
+
+        centre = int(np.argmin(np.linalg.norm(self.points - self.points.mean(axis=0), axis=1)))
+        self._initial = farthest_point_order(self.points, self.n_initial, centre)
+
+    # -------------------------------------------------------------------
+
+    def seed(self, combo, result):
+        """Register a result from an earlier run (not counted against the budget)."""
+        if combo in self.index:
+            self._record(self.index[combo], result)
+
+    def seed_rows(self, rows, key_columns):
+        """Register earlier results (e.g. ResultsStore.to_frame() records); key_columns name the parameters."""
+        for row in rows:
+            self.seed(tuple(row[c] for c in key_columns), row)
+
+    def tell(self, combo, result):
+        """Register the result (or None if the run failed) of a proposed combination."""
+        i = self.index[combo]
+        self.pending.discard(i)
+        self._record(i, result)
+
+    def _record(self, i, result):
+        score = None if result is None else float(self.objective(result))
+        if score is not None and not np.isfinite(score):
+            score = None
+        self.scores[i] = score
+        if score is not None and (self.best is None or score > self.scores[self.best]):
+            self.best, self.since_best = i, 0
+        else:
+            self.since_best += 1
+
+    def best_combo(self):
+        """(combo, score) of the best result so far, or (None, None)."""
+        if self.best is None:
+            return None, None
+        return self.combos[self.best], self.scores[self.best]
+
+    # -------------------------------------------------------------------
+
+    def _neighbours_done(self, i):
+        d = np.abs(self.points - self.points[i]).max(axis=1)
+        return all(j in self.scores for j in np.flatnonzero(d == 1))
+
+    def converged(self):
+        if self.best is None or self.since_best < self.patience:
+            return False
+        return self._neighbours_done(self.best)
+
+    def propose(self):
+        """Next combination to run, or None when the search is finished (or must wait for results)."""
+        if self.n_proposed >= self.budget or self.converged():
+            return None
+        known = set(self.scores) | self.pending
+        free = np.array([i for i in range(len(self.combos)) if i not in known], dtype=int)
+        if len(free) == 0:
+            return None
+
+        # space-filling start
+        i = next((j for j in self._initial if j not in known), None)
+        if i is None or self.n_proposed >= self.n_initial:
+            scored = np.array([j for j, s in self.scores.items() if s is not None], dtype=int)
+            if len(scored) == 0:
+                if self.pending:
+                    return None   # wait for the first scores
+                i = int(free[0])
+            else:
+                i = int(free[np.argmax(self._acquisition(free, scored, np.array(sorted(known), dtype=int)))])
+
+        self.pending.add(i)
+        self.n_proposed += 1
+        return self.combos[i]
+
+    def _acquisition(self, free, scored, known):
+        values = np.array([self.scores[j] for j in scored])
+        spread = values.std() or 1.0
+
+        # inverse-distance weighted estimate from the scored points
+        d = np.linalg.norm(self.points[free][:, None, :] - self.points[scored][None, :, :], axis=2)
+        w = 1.0 / np.maximum(d, 1e-9) ** self.power
+        estimate = (w @ values) / w.sum(axis=1)
+
+        # distance to the nearest finished or running point
+        d_known = np.linalg.norm(self.points[free][:, None, :] - self.points[known][None, :, :], axis=2).min(axis=1)
+        return (estimate - values.mean()) / spread + self.explore * d_known
+
+
+# ---------------------------------------------------------------------------
+# Multi-fidelity successive halving
+# ---------------------------------------------------------------------------
+# Every combination is first run on a thinned cloud (fidelities[0]); only the
+# best `keep` share is run again at the next fidelity, and so on up to full
+# density. A level costs roughly fidelity x combinations, so the broad part of
+# the sweep runs on a fraction of the points and only the candidates that
+# matter get full-resolution numbers.
+
+def successive_halving(combos, run_level, objective, fidelities=(0.15, 0.5, 1.0), keep=0.25):
+    """
+    Parameters:
+    - combos (list[tuple]): parameter combinations
+    - run_level (callable): run_level(fidelity, combos) -> {combo: result row} of the runs that succeeded
+    - objective (callable): result row -> float, maximized
+    - fidelities (tuple[float]): increasing point cloud shares, the last one normally 1.0
+    - keep (float): share of a level's combinations promoted to the next level (at least one)
+
+    Returns:
+    - list[(float, dict)]: (fidelity, {combo: result row}) per level
+    """
+    levels = []
+    candidates = list(combos)
+    for level, fidelity in enumerate(fidelities):
+        results = run_level(fidelity, candidates)
+        levels.append((fidelity, results))
+        if level == len(fidelities) - 1 or not results:
+            break
+
+        scores = {c: float(objective(r)) for c, r in results.items()}
+        ranked = sorted((c for c in scores if np.isfinite(scores[c])), key=scores.get, reverse=True)
+        candidates = ranked[:max(1, int(np.ceil(keep * len(candidates))))]
+    return levels
@@ -9,44 +9,26 @@ import numpy as np
 import laspy
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, box
-from shapely.ops import unary_union
+from shapely.geometry import box
 from tqdm import tqdm
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label
+from muni_index import load_muni_index
 
 logger = None
 # --------------------------------------------------------------------- helpers
-def load_forest_gdf(laz_file_path):
-    with laspy.open(laz_file_path) as las:
-        pts   = las.read()
-        scale = las.header.scales
-        off   = las.header.offsets
-
-        X = pts.X * scale[0] + off[0]
-        Y = pts.Y * scale[1] + off[1]
-        Z = pts.Z * scale[2] + off[2]
-
-        attrs = {d.name: np.asarray(getattr(pts, d.name)) for d in pts.point_format}
-        df    = pd.DataFrame(attrs)
-        df["geometry"] = [Point(x, y, z) for x, y, z in zip(X, Y, Z)]
-        return gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:28992")
-
-
 def get_bbox_from_las(las_path):
     with laspy.open(las_path) as f:
         mn, mx = f.header.min, f.header.max
     return box(mn[0], mn[1], mx[0], mx[1])
 
 
-def compute_tree_convex_hulls(gdf, idx=None):
-    hulls = []
-    for tid, grp in gdf.groupby("tree_id"):
-        if len(grp) < 3:
-            logger.warning("Iter %s: tree %s < 3 pts, skip", idx, tid)
-            continue
-        hulls.append({"tree_id": tid, "geometry": unary_union(grp.geometry).convex_hull})
-    return gpd.GeoDataFrame(hulls, crs=gdf.crs)
+def compute_tree_convex_hulls(seg_df, idx=None, crs="EPSG:28992"):
+    tids, hulls, skipped = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values)
+    for tid in skipped:
+        logger.warning("Iter %s: tree %s < 3 pts, skip", idx, tid)
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
 # --------------------------------------------------------------------- main
 def run_segmentation_public_matching(
     data_dir,
@@ -72,9 +54,9 @@ def run_segmentation_public_matching(
     csv_path = os.path.join(data_dir, csv_name)
 
     # ------------------------------------------------------------------ data
-    muni_gdf = gpd.read_file(municipality_geojson).to_crs("EPSG:28992")
+    muni_index = load_muni_index(municipality_geojson)
     forest_bbox = get_bbox_from_las(os.path.join(data_dir, forest_las_name))
-    public_trees_gdf = muni_gdf[muni_gdf.within(forest_bbox)].reset_index(drop=True)
+    public_trees_gdf = muni_index.to_gdf(muni_index.query_bbox(forest_bbox.bounds))
     total_public = len(public_trees_gdf)
     logger.info("Public trees inside bbox: %d", total_public)
 
@@ -120,12 +102,7 @@ def run_segmentation_public_matching(
         # ------------------- analyse
         seg_df  = pd.read_csv(out_xyz, sep=r"\s+", header=None,
                               names=["tree_id", "x", "y", "z"])
-        seg_gdf = gpd.GeoDataFrame(seg_df,
-                                   geometry=gpd.points_from_xy(seg_df.x,
-                                                               seg_df.y),
-                                   crs="EPSG:28992")
-
-        hulls_gdf = compute_tree_convex_hulls(seg_gdf, idx)
+        hulls_gdf = compute_tree_convex_hulls(seg_df, idx)
         if hulls_gdf.empty:
             logger.warning("No hulls iter %d", idx)
             return None
@@ -0,0 +1,299 @@
+# sweep_pool.py
+import sys
+import threading
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from tqdm import tqdm
+
+from run_meta import input_stats
+
+# ---------------------------------------------------------------------------
+# Process pool for parameter sweeps
+# ---------------------------------------------------------------------------
+# The analysis of a sweep combination (hull building, sjoin, overlap metrics)
+# is pandas / geopandas work that holds the GIL, so it runs in worker
+# processes instead of threads. Static data every task needs (public trees,
+# point count, bbox, sweep settings) is loaded once per worker by the pool
+# initializer; tasks read it through worker_state(). Task and loader functions
+# are pickled, so they have to be module-level functions.
+# run_adaptive_sweep takes its tasks from a search object (see param_search)
+# that proposes the next combination from the results finished so far.
+# Both can run on a SweepScheduler (pool=) shared by several sweeps instead of
+# their own pool, see the multi-sweep section below.
+
+_state = {}
+
+
+def _init_worker(loader, loader_args):
+    _state.clear()
+    _state.update(loader(*loader_args))
+
+
+def worker_state():
+    """Static sweep data of the current worker process (set by the loader)."""
+    return _state
+
+
+def _task_submitter(task, loader, loader_args, workers, pool, dedupe_key):
+    """(context manager, submit(arg) -> Future) on an own process pool or on a shared SweepSpec."""
+    if pool is not None:
+        state = pool.new_state()
+        return nullcontext(), lambda arg: pool.submit(task, arg, loader, loader_args, state,
+                                                      None if dedupe_key is None else dedupe_key(arg))
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(loader, loader_args))
+    return executor, lambda arg: executor.submit(task, arg)
+
+
+def run_sweep(task, tasks, loader, loader_args=(), workers=4, desc="Sweep", on_result=None,
+              pool=None, dedupe_key=None):
+    """
+    Run task(t) for every t in tasks in a process pool.
+
+    Parameters:
+    - task (callable): module-level function, returns a result or None
+    - tasks (list): task arguments
+    - loader (callable): module-level function, loader(*loader_args) -> dict of static data
+    - workers (int): number of worker processes
+    - on_result (callable | None): called in the parent for every non-None result, as it completes
+    - pool (SweepSpec | None): run on a shared SweepScheduler instead of an own pool of `workers`
+    - dedupe_key (callable | None): with pool, task argument -> key; tasks with the same key
+      (across all sweeps of the scheduler) run once (see dedupe_key_for)
+
+    Returns:
+    - int: number of non-None results
+    """
+    n_results = 0
+    context, submit = _task_submitter(task, loader, loader_args, workers, pool, dedupe_key)
+    with context:
+        futures = [submit(t) for t in tasks]
+        for fut in tqdm(as_completed(futures), total=len(futures), desc=desc, disable=not sys.stdout.isatty()):
+            res = fut.result()
+            if res is not None:
+                n_results += 1
+                if on_result is not None:
+                    on_result(res)
+    return n_results
+
+
+def run_adaptive_sweep(task, search, make_task, loader, loader_args=(), workers=4, desc="Adaptive sweep", on_result=None,
+                       pool=None, dedupe_key=None):
+    """
+    Run task(make_task(combo)) for the combinations a search proposes, keeping
+    up to `workers` runs in flight.
+
+    Parameters:
+    - search: object with propose() -> combo | None and tell(combo, result)
+    - make_task (callable): combo -> task argument
+    - other parameters as in run_sweep (with pool, workers only limits the runs in flight)
+
+    Returns:
+    - int: number of non-None results
+    """
+    n_results = 0
+    pending = {}
+    context, submit = _task_submitter(task, loader, loader_args, workers, pool, dedupe_key)
+    with context, tqdm(desc=desc, disable=not sys.stdout.isatty()) as bar:
+        while True:
+            while len(pending) < workers:
+                combo = search.propose()
+                if combo is None:
+                    break
+                pending[submit(make_task(combo))] = combo
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                combo = pending.pop(fut)
+                res = fut.result()
+                search.tell(combo, res)
+                bar.update()
+                if res is not None:
+                    n_results += 1
+                    if on_result is not None:
+                        on_result(res)
+    return n_results
+
+
+# ---------------------------------------------------------------------------
+# Multi-sweep scheduler
+# ---------------------------------------------------------------------------
+# Several sweeps (different datasets, filtered vs unfiltered input, ...) run
+# at once on one SweepScheduler instead of each on its own pool of `cores`:
+#
+#   budget    one process pool of `cores` workers; with mem_mb, a task is only
+#             started while the memory of the running tasks (mem_per_task_mb of
+#             their sweep, e.g. the peak_rss_mb of earlier run records) fits
+#   order     "fair": the next task comes from the waiting sweep with the
+#             fewest started tasks per unit of priority; "priority": from the
+#             waiting sweep with the highest priority
+#   dedupe    tasks with the same dedupe key (same task function, input file
+#             content, settings incl. output dirs and combination) run once and
+#             every sweep that asked for them gets the result; the result keeps
+#             the iteration id of the sweep that ran it, drivers set their own
+#
+# Each worker loads the static data of a sweep (its loader) the first time it
+# runs one of its tasks, and again when the sweep moves on to a new loader
+# payload (e.g. the next halving level). run_sweeps runs the sweep drivers in
+# threads of the parent process, each submitting to the shared scheduler.
+
+_spec_states = {}   # sweep name -> (state id, static data), per worker process
+
+
+def _run_spec_task(name, state_id, loader, loader_args, task, arg):
+    cached = _spec_states.get(name)
+    if cached is None or cached[0] != state_id:
+        cached = _spec_states[name] = (state_id, loader(*loader_args))
+    _state.clear()
+    _state.update(cached[1])
+    return task(arg)
+
+
+class SweepSpec:
+    """Handle of one sweep on a SweepScheduler; pass it as pool= to run_sweep / run_adaptive_sweep."""
+
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+        self._n_states = 0
+
+    def new_state(self):
+        """Id of a new loader payload of this sweep (workers reload the static data once)."""
+        self._n_states += 1
+        return self._n_states
+
+    def submit(self, task, arg, loader, loader_args, state, dedupe_key=None):
+        return self.scheduler._submit(self.name, (task, arg, loader, loader_args, state), dedupe_key)
+
+
+class SweepScheduler:
+    """
+    One process pool shared by several sweeps.
+
+    Parameters:
+    - cores (int): worker processes (global core budget)
+    - mem_mb (float | None): global memory budget of the running tasks (None = no limit)
+    - policy (str): "fair" or "priority"
+    """
+
+    def __init__(self, cores, mem_mb=None, policy="fair"):
+        if policy not in ("fair", "priority"):
+            raise ValueError(f"Unknown policy '{policy}'")
+        self.cores = cores
+        self.mem_mb = mem_mb
+        self.policy = policy
+        self.n_deduped = 0
+
+        self._executor = ProcessPoolExecutor(max_workers=cores)
+        self._lock = threading.RLock()
+        self._sweeps = {}     # name -> {"priority", "mem", "started", "queue"}
+        self._keys = {}       # dedupe key -> Future
+        self._running = 0
+        self._running_mem = 0.0
+
+    def spec(self, name, priority=1.0, mem_per_task_mb=0.0):
+        """Register a sweep and return its handle."""
+        with self._lock:
+            if name in self._sweeps:
+                raise ValueError(f"Sweep '{name}' is already registered")
+            self._sweeps[name] = {"priority": float(priority), "mem": float(mem_per_task_mb or 0.0),
+                                  "started": 0, "queue": deque()}
+        return SweepSpec(self, name)
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def _submit(self, name, item, dedupe_key):
+        with self._lock:
+            key = None if dedupe_key is None else (item[0].__module__, item[0].__qualname__, dedupe_key)
+            if key is not None and key in self._keys:
+                self.n_deduped += 1
+                return self._keys[key]
+            fut = Future()
+            if key is not None:
+                self._keys[key] = fut
+            self._sweeps[name]["queue"].append((item, fut))
+            self._dispatch()
+        return fut
+
+    def _next_sweep(self):
+        waiting = [n for n, sw in self._sweeps.items() if sw["queue"]]
+        if not waiting:
+            return None
+        if self.policy == "priority":
+            return max(waiting, key=lambda n: self._sweeps[n]["priority"])
+        return min(waiting, key=lambda n: self._sweeps[n]["started"] / self._sweeps[n]["priority"])
+
+    def _dispatch(self):
+        """Start waiting tasks while the budget allows (lock held)."""
+        while self._running < self.cores:
+            name = self._next_sweep()
+            if name is None:
+                return
+            sweep = self._sweeps[name]
+            if self.mem_mb is not None and self._running and self._running_mem + sweep["mem"] > self.mem_mb:
+                return
+            (task, arg, loader, loader_args, state), fut = sweep["queue"].popleft()
+            sweep["started"] += 1
+            self._running += 1
+            self._running_mem += sweep["mem"]
+            inner = self._executor.submit(_run_spec_task, name, state, loader, loader_args, task, arg)
+            inner.add_done_callback(partial(self._finished, name, fut))
+
+    def _finished(self, name, fut, inner):
+        with self._lock:
+            self._running -= 1
+            self._running_mem -= self._sweeps[name]["mem"]
+            self._dispatch()
+        if inner.exception() is not None:
+            fut.set_exception(inner.exception())
+        else:
+            fut.set_result(inner.result())
+
+
+def dedupe_key_for(input_path, settings, ignore=("data_dir", "input_xyz", "input_meta", "existing_combos",
+                                                 "overwrite_existing_combos")):
+    """
+    dedupe_key for run_sweep: the content hash of the input file, the settings
+    (all but the input path and bookkeeping in `ignore`, so output dirs and
+    keep/delete flags are part of the key) and the combination (first element
+    of the task argument). When the task keeps per-iteration files (no
+    delete_segmentation_after_processing, or save_geojsons) the iteration id
+    (second element) is part of the key too, so a shared run leaves exactly the
+    files both sweeps expect.
+    """
+    digest = input_stats(input_path)["blake2b"]
+    fixed = repr(sorted((k, repr(v)) for k, v in settings.items() if k not in ignore))
+    keeps_files = not settings.get("delete_segmentation_after_processing") or settings.get("save_geojsons")
+    if keeps_files:
+        return lambda arg: (digest, fixed, tuple(arg[0]), arg[1])
+    return lambda arg: (digest, fixed, tuple(arg[0]))
+
+
+def run_sweeps(specs, cores, mem_mb=None, policy="fair"):
+    """
+    Run several sweep drivers at once on one SweepScheduler.
+
+    Parameters:
+    - specs (list[dict]): per sweep "name", "run" (driver function with a pool=
+      parameter, e.g. run_segmentation_public_matching), "kwargs" (its arguments),
+      optional "priority" (1.0) and "mem_per_task_mb" (0)
+    - cores, mem_mb, policy: see SweepScheduler
+
+    Returns:
+    - dict: sweep name -> driver return value (the first driver error is raised
+      after all drivers finished)
+    """
+    scheduler = SweepScheduler(cores, mem_mb, policy)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(specs))) as threads:
+            futures = {}
+            for spec in specs:
+                handle = scheduler.spec(spec["name"], spec.get("priority", 1.0), spec.get("mem_per_task_mb", 0.0))
+                futures[spec["name"]] = threads.submit(spec["run"], **spec["kwargs"], pool=handle)
+            wait(list(futures.values()))
+    finally:
+        scheduler.shutdown()
+    return {name: fut.result() for name, fut in futures.items()}
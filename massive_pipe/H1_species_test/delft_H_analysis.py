@@ -1,65 +1,33 @@
+import os
+import sys
 import geopandas as gpd
-from shapely.geometry import Point
 
-# Load data
-polygons = gpd.read_file("filtered_renumbered_hulls.geojson")
-points = gpd.read_file("Bomen_light.geojson")
+# shared hull store and municipality tree index from the city pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gilfoyle_code"))
+from hull_store import find_hulls, read_hulls, write_hulls
+from muni_index import load_muni_index
+from hull_labelling import label_hulls
 
-# Ensure same CRS
-points = points.to_crs(polygons.crs)
+# Load data (GeoParquet from the pipeline, or a legacy GeoJSON copy)
+polygons = read_hulls(find_hulls(".", "filtered_renumbered_hulls"))
 
-# Track matches
-point_to_polygons = {}  # point index -> list of polygon indices
+# municipality trees from the cached index (EPSG:28992), only within the hull extent
+muni_index = load_muni_index("Bomen_light.geojson")
+points = muni_index.to_gdf(muni_index.query_bbox(polygons.total_bounds))
 
-# Spatial index for speed
-sindex = polygons.sindex
+# one STRtree query of all trees against all hulls (see hull_labelling.py)
+hull_table, hulls_per_point = label_hulls(polygons.geometry.values, points.geometry.values,
+                                          point_values=points["BOOMSORTIMENT"])
 
-for idx_point, point_geom in points.geometry.items():
-    possible_matches_index = list(sindex.intersection(point_geom.bounds))
-    for idx_poly in possible_matches_index:
-        if polygons.geometry[idx_poly].contains(point_geom):
-            point_to_polygons.setdefault(idx_point, []).append(idx_poly)
-
-# Initialize label column
-polygons["label"] = "H0"
-
-# Count points per polygon
-from collections import defaultdict
-polygon_counts = defaultdict(int)
-
-for point_idx, poly_list in point_to_polygons.items():
-    if len(poly_list) > 1:
-        for pid in poly_list:
-            polygons.at[pid, "label"] = "Hpartial"
-    else:
-        polygon_counts[poly_list[0]] += 1
-
-# Apply non-overlapping counts
-for pid, count in polygon_counts.items():
-    if polygons.at[pid, "label"] != "Hpartial":
-        if count == 1:
-            polygons.at[pid, "label"] = "H1"
-        elif count == 2:
-            polygons.at[pid, "label"] = "H2"
-        elif count == 3:
-            polygons.at[pid, "label"] = "H3"
-        elif count >= 4:
-            polygons.at[pid, "label"] = "H4+"
+# H0 .. H4+ by trees inside that lie in this hull only; Hpartial if a tree inside is shared
+polygons["label"] = hull_table["label"].values
 
 # Save to file
-polygons.to_file("hulls_with_labels.geojson", driver="GeoJSON")
-
+write_hulls(polygons, "hulls_with_labels.geojson")
 
-# Create new column for species
-polygons["species"] = None
 
-# Assign species to H1 polygons
-for point_idx, poly_list in point_to_polygons.items():
-    if len(poly_list) == 1:
-        pid = poly_list[0]
-        if polygons.at[pid, "label"] == "H1":
-            species = points.at[point_idx, "BOOMSORTIMENT"]
-            polygons.at[pid, "species"] = species
+# species of the one tree inside each H1 polygon
+polygons["species"] = hull_table["value"].values
 
 # Filter H1 polygons
 h1_polygons = polygons[polygons["label"] == "H1"]
@@ -68,6 +36,5 @@ h1_polygons = polygons[polygons["label"] == "H1"]
 
 
 # Save to new GeoJSON
-h1_polygons.to_file("hulls_H1_with_species.geojson", driver="GeoJSON")
+write_hulls(h1_polygons, "hulls_H1_with_species.geojson")
 h1_polygons["species"].value_counts().to_csv("species_counts_H1.csv")
-
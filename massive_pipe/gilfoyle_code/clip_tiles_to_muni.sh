@@ -37,6 +37,7 @@ process_tile_folder() {
     local tile_path="$1"
     local raw_file="$tile_path/raw.LAZ"
     local clipped_file="$tile_path/clipped.LAZ"
+    local stamp_file="$tile_path/clipped.LAZ.src"
     local tmp_pipeline="$TMP_DIR/$(basename "$tile_path").json"
 
     if [[ ! -f "$raw_file" ]]; then
@@ -44,6 +45,15 @@ process_tile_folder() {
         return
     fi
 
+    # Content digest of raw.LAZ + clip polygon; tiles whose clipped.LAZ was
+    # made from the same inputs are not clipped again
+    local stamp
+    stamp="$(b2sum "$raw_file" | cut -d' ' -f1) $(printf '%s' "$WKT_POLYGON" | b2sum | cut -d' ' -f1)"
+    if [[ -f "$clipped_file" && -f "$stamp_file" && "$(cat "$stamp_file")" == "$stamp" ]]; then
+        return
+    fi
+    rm -f "$clipped_file" "$stamp_file"
+
     # Build inline JSON pipeline
     cat > "$tmp_pipeline" <<EOF
 {
@@ -65,7 +75,7 @@ process_tile_folder() {
 EOF
 
     # echo "🟦 Clipping $(basename "$tile_path")..." >&2
-    pdal pipeline "$tmp_pipeline"
+    pdal pipeline "$tmp_pipeline" && echo "$stamp" > "$stamp_file"
 }
 
 export -f process_tile_folder
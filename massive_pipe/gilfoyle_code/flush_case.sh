@@ -34,6 +34,9 @@ for tile_path in "$TILES_DIR"/*; do
         # Delete all files except raw.LAZ
         find "$tile_path" -type f ! -name "raw.LAZ" -exec rm -f {} +
 
+        # Delete point attribute sidecar folders (<file>.attrs/)
+        find "$tile_path" -mindepth 1 -maxdepth 1 -type d -name "*.attrs" -exec rm -r {} +
+
         # Delete logs folder if present
         if [[ -d "$tile_path/logs" ]]; then
             rm -r "$tile_path/logs"
@@ -4,84 +4,248 @@ import geopandas as gpd
 import numpy as np
 import laspy
 import logging
-from shapely.geometry import Point
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from shapely.geometry import box
 from multiprocessing import Pool
 from tqdm import tqdm
 
-def build_gtid_map(data_dir):
-    tile_root = os.path.join(data_dir, "tiles")
-    tile_grid_path = os.path.join(data_dir, "tile_grid_core.geojson")
-    output_hulls = os.path.join(data_dir, "filtered_renumbered_hulls.geojson")
-    output_rejected = os.path.join(data_dir, "rejected_hulls.geojson")
+from coord_join import las_grid, coords_to_grid, join_on_grid
+from point_sidecar import write_sidecar, bake_sidecars
+from hull_store import hull_path, find_hulls, read_hulls, write_hulls, export_geojson, HullLayerWriter
+from hull_store import layer_geometry_types
 
-    gtid_map = {}
-    gtid_counter = 0
-    accepted_features = []
-    rejected_features = []
+# ---------------------------------------------------------------------------
+# Deterministic gtid ranges
+# ---------------------------------------------------------------------------
+# gtid = tile_index * GTID_BLOCK + local rank, where tile_index is the position
+# of the tile's core bbox in the RD New core grid (1000 x 1250 m) and the local
+# rank is the position of the tree among the accepted tids of that tile. The id
+# only depends on the tile itself, so every tile can be finalized right after
+# its segmentation and re-running one tile does not renumber the city.
+
+CORE_WIDTH = 1000
+CORE_HEIGHT = 1250
+GTID_GRID_COLS = 1024   # > 300 km / 1000 m, the x extent of RD New
+GTID_BLOCK = 1 << 20    # max accepted trees per tile
+
+def tile_gtid_base(core_bounds):
+    """First gtid of a tile, from its core bbox (minx, miny, maxx, maxy)."""
+    col = int(np.floor(core_bounds[0] / CORE_WIDTH))
+    row = int(np.floor(core_bounds[1] / CORE_HEIGHT))
+    return (row * GTID_GRID_COLS + col) * GTID_BLOCK
 
+def load_core_bounds(data_dir):
+    """{tile_id: core bbox} from tile_grid_core.geojson, or None if the grid is missing."""
+    tile_grid_path = os.path.join(data_dir, "tile_grid_core.geojson")
     if not os.path.exists(tile_grid_path):
         logging.error(f"Tile grid not found: {tile_grid_path}")
-        return {}, 0
+        return None
+    tile_grid = gpd.read_file(tile_grid_path).to_crs("EPSG:28992")
+    return {tid: geom.bounds for tid, geom in zip(tile_grid["tile_id"], tile_grid.geometry)}
 
-    tile_grid = gpd.read_file(tile_grid_path).set_index("tile_id").to_crs("EPSG:28992")
+def classify_tile(tile_id, data_dir, core_bounds):
+    """
+    Split the hulls of one tile into accepted (centroid inside the core) and
+    rejected trees and give the accepted trees their gtid. Writes per tile:
+    gtid_lut.npy (dense lookup, lut[tid] = gtid or -1), accepted_hulls and
+    rejected_hulls (hull store).
+    Returns the number of accepted trees, or None if the tile is skipped.
+    """
+    tile_path = os.path.join(data_dir, "tiles", tile_id)
+    seg_hulls = find_hulls(tile_path, "segmentation_hulls")
 
-    for tile_id in tqdm(os.listdir(tile_root), desc="Building gtid map"):
-        tile_path = os.path.join(tile_root, tile_id)
-        hull_path = os.path.join(tile_path, "segmentation_hulls.geojson")
+    if seg_hulls is None:
+        logging.warning(f"SKIP {tile_id}: Missing segmentation_hulls")
+        return None
 
-        if not os.path.exists(hull_path):
-            logging.warning(f"SKIP {tile_id}: Missing segmentation_hulls.geojson")
-            continue
+    try:
+        gdf = read_hulls(seg_hulls)
+
+        if "tid" not in gdf.columns:
+            logging.error(f"SKIP {tile_id}: 'tid' column not found")
+            return None
+
+        gdf["tid"] = gdf["tid"].astype(int)
+        # sorted by tid, so the local rank of a tree is its position in 'inside'
+        gdf = gdf.sort_values("tid", ignore_index=True)
+        gdf["tile"] = tile_id
+        is_inside = gdf.geometry.centroid.within(box(*core_bounds)).values
+
+        inside = gdf[is_inside].copy()
+        outside = gdf[~is_inside].copy()
+
+        if len(inside) > GTID_BLOCK:
+            logging.error(f"SKIP {tile_id}: {len(inside)} trees exceed the gtid block size")
+            return None
 
-        if tile_id not in tile_grid.index:
+        inside["gtid"] = tile_gtid_base(core_bounds) + np.arange(len(inside), dtype=np.int64)
+
+        lut = np.full(int(gdf["tid"].max()) + 1 if len(gdf) else 0, -1, dtype=np.int64)
+        lut[inside["tid"].values] = inside["gtid"].values
+        np.save(os.path.join(tile_path, "gtid_lut.npy"), lut)
+        write_hulls(inside, hull_path(tile_path, "accepted_hulls"))
+        write_hulls(outside, hull_path(tile_path, "rejected_hulls"))
+
+        return len(inside)
+
+    except Exception as e:
+        logging.error(f"Failed processing {tile_id}: {e}")
+        return None
+
+def finalize_tile(tile_id, data_dir, core_bounds, bake=False):
+    """Assign the gtids of one tile and write its gtid sidecar (no global state needed)."""
+    n_accepted = classify_tile(tile_id, data_dir, core_bounds)
+    if n_accepted is None:
+        return None
+    process_tile(tile_id, data_dir, bake)
+    return n_accepted
+
+def _classify_task(args):
+    tile_id = args[0]
+    return tile_id, classify_tile(*args)
+
+def build_gtid_map(data_dir, num_cores=1, geojson_export=False):
+    """
+    Assign gtids for all tiles in a process pool (for tiles that were not
+    finalized in the tile pipeline). Each tile's hulls are streamed into the
+    city-wide layers as soon as it is classified.
+    Returns ({tile_id: n_accepted}, total count).
+    """
+    core_bounds = load_core_bounds(data_dir)
+    if core_bounds is None:
+        return {}, 0
+
+    tiles = []
+    for tile_id in sorted(os.listdir(os.path.join(data_dir, "tiles"))):
+        if tile_id not in core_bounds:
             logging.warning(f"SKIP {tile_id}: Not found in tile_grid_core.geojson")
             continue
+        tiles.append(tile_id)
 
-        try:
-            core_poly = tile_grid.loc[tile_id].geometry
-            gdf = gpd.read_file(hull_path).to_crs("EPSG:28992")
+    gtid_map = {}
+    layers = open_city_layers(data_dir)
+    try:
+        args = [(tile_id, data_dir, core_bounds[tile_id]) for tile_id in tiles]
+        with Pool(processes=num_cores) as pool:
+            for tile_id, n in tqdm(pool.imap_unordered(_classify_task, args), total=len(args), desc="Assigning gtids"):
+                if n is not None:
+                    gtid_map[tile_id] = n
+                    append_tile_hulls(layers, data_dir, tile_id)
+    except Exception:
+        abort_city_layers(layers)
+        raise
+    close_city_layers(layers, geojson_export)
 
-            if "tid" not in gdf.columns:
-                logging.error(f"SKIP {tile_id}: 'tid' column not found")
-                continue
+    return gtid_map, sum(gtid_map.values())
 
-            gdf["centroid"] = gdf.geometry.centroid
-            inside = gdf[gdf["centroid"].within(core_poly)].copy()
-            outside = gdf[~gdf["centroid"].within(core_poly)].copy()
+# ---------------------------------------------------------------------------
+# City-wide hull layers (streamed, one row group per tile)
+# ---------------------------------------------------------------------------
 
-            inside["gtid"] = range(gtid_counter, gtid_counter + len(inside))
-            inside["tile"] = tile_id
-            accepted_features.append(inside.drop(columns=["centroid"]))
+CITY_LAYERS = {"accepted_hulls": "filtered_renumbered_hulls", "rejected_hulls": "rejected_hulls"}
 
-            for _, row in inside.iterrows():
-                gtid_map[(tile_id, row["tid"])] = row["gtid"]
+def open_city_layers(data_dir):
+    """Streaming writers for the merged layers, keyed by the per-tile layer they collect."""
+    return {stem: HullLayerWriter(hull_path(data_dir, city_stem)) for stem, city_stem in CITY_LAYERS.items()}
 
-            gtid_counter += len(inside)
+def city_layers_exist(data_dir):
+    return all(os.path.exists(hull_path(data_dir, city_stem)) for city_stem in CITY_LAYERS.values())
 
-            if not outside.empty:
-                outside["tile"] = tile_id
-                rejected_features.append(outside.drop(columns=["centroid"]))
+def append_tile_hulls(layers, data_dir, tile_id):
+    """Append one tile's accepted / rejected hulls to the open city layers."""
+    tile_path = os.path.join(data_dir, "tiles", tile_id)
+    for stem, writer in layers.items():
+        path = find_hulls(tile_path, stem)
+        if path is not None:
+            writer.write(read_hulls(path))
 
-        except Exception as e:
-            logging.error(f"Failed processing {tile_id}: {e}")
+def close_city_layers(layers, geojson_export=False):
+    """Finish the city layers; geojson_export=True also writes .geojson copies for QGIS."""
+    for writer in layers.values():
+        rows = writer.close()
+        logging.info(f"Saved {rows} trees to {writer.path}")
+        if geojson_export and rows:
+            logging.info(f"Exported {export_geojson(writer.path)}")
 
-    if accepted_features:
-        accepted = gpd.GeoDataFrame(pd.concat(accepted_features, ignore_index=True), crs="EPSG:28992")
-        accepted.to_file(output_hulls, driver="GeoJSON")
-        logging.info(f"Saved {len(accepted)} accepted trees to {output_hulls}")
+def abort_city_layers(layers):
+    for writer in layers.values():
+        writer.abort()
 
-    if rejected_features:
-        rejected = gpd.GeoDataFrame(pd.concat(rejected_features, ignore_index=True), crs="EPSG:28992")
-        rejected.to_file(output_rejected, driver="GeoJSON")
-        logging.info(f"Saved {len(rejected)} rejected trees to {output_rejected}")
+def merge_tile_hulls(data_dir, geojson_export=False):
+    """
+    Merge the per-tile accepted / rejected hulls into the city-wide layers
+    (filtered_renumbered_hulls / rejected_hulls in the hull store), one tile at a time.
+    """
+    layers = open_city_layers(data_dir)
+    try:
+        for tile_id in sorted(os.listdir(os.path.join(data_dir, "tiles"))):
+            append_tile_hulls(layers, data_dir, tile_id)
+    except Exception:
+        abort_city_layers(layers)
+        raise
+    close_city_layers(layers, geojson_export)
 
-    return gtid_map, gtid_counter
+def patch_city_layers(data_dir, changed_tiles, geojson_export=False):
+    """
+    Update existing city layers in place of a rebuild: rows of changed tiles
+    (and of tiles no longer in the case) are dropped, unchanged rows are copied
+    over row group by row group without decoding, and the changed tiles are
+    appended from their tile folders. Returns the number of replaced tiles.
+    """
+    tile_root = os.path.join(data_dir, "tiles")
+    present = set(t for t in os.listdir(tile_root) if os.path.isdir(os.path.join(tile_root, t)))
+    sources = {stem: hull_path(data_dir, city_stem) for stem, city_stem in CITY_LAYERS.items()}
+    stored = set()
+    for path in sources.values():
+        if "tile" in pq.read_schema(path).names:   # an empty layer may have no columns yet
+            stored.update(pq.read_table(path, columns=["tile"])["tile"].unique().to_pylist())
+
+    # tiles with hulls that are not in the layers yet (e.g. a failed earlier merge) count as changed
+    missing = set()
+    for tile_id in present - stored:
+        for stem in CITY_LAYERS:
+            path = hull_path(os.path.join(tile_root, tile_id), stem)
+            if os.path.exists(path) and pq.read_metadata(path).num_rows:
+                missing.add(tile_id)
+    changed = sorted((set(changed_tiles) & present) | missing)
+    drop = sorted(set(changed) | (stored - present))
+    if not drop:
+        logging.info("City layers up to date")
+        return 0
+
+    layers = open_city_layers(data_dir)
+    try:
+        for stem, writer in layers.items():
+            source = pq.ParquetFile(sources[stem])
+            geometry_types = layer_geometry_types(sources[stem])
+            drop_set = pa.array(drop, pa.string())
+            for i in range(source.num_row_groups):
+                table = source.read_row_group(i)
+                table = table.filter(pc.invert(pc.is_in(table["tile"], value_set=drop_set)))
+                writer.write_table(table, geometry_types)
+        for tile_id in changed:
+            append_tile_hulls(layers, data_dir, tile_id)
+    except Exception:
+        abort_city_layers(layers)
+        raise
+    close_city_layers(layers, geojson_export)
 
-def process_tile(tile_id, data_dir, gtid_map):
+    logging.info(f"Patched city layers: {len(changed)} tiles replaced, {len(drop) - len(changed)} removed")
+    return len(changed)
+
+def process_tile(tile_id, data_dir, bake=False):
+    """
+    Label the points of vegetation.LAZ with their gtid (-1 = not an accepted tree).
+    The labels go to the vegetation.LAZ.attrs/gtid.npy sidecar; bake=True also
+    exports forest.laz with only the labelled points and a gtid dimension.
+    """
     tile_path = os.path.join(data_dir, "tiles", tile_id)
     seg_path = os.path.join(tile_path, "segmentation.XYZ")
     laz_path = os.path.join(tile_path, "vegetation.LAZ")
     out_path = os.path.join(tile_path, "forest.laz")
+    lut_path = os.path.join(tile_path, "gtid_lut.npy")
 
     if not os.path.exists(seg_path):
         logging.warning(f"SKIP {tile_id}: Missing segmentation.XYZ")
@@ -89,43 +253,55 @@ def process_tile(tile_id, data_dir, gtid_map):
     if not os.path.exists(laz_path):
         logging.warning(f"SKIP {tile_id}: Missing vegetation.LAZ")
         return
+    if not os.path.exists(lut_path):
+        logging.warning(f"SKIP {tile_id}: Missing gtid_lut.npy")
+        return
 
     try:
-        df = pd.read_csv(seg_path, delim_whitespace=True, header=None, names=["tid", "x", "y", "z"])
-        df["tid"] = df["tid"].astype(int)
-        df["gtid"] = df["tid"].apply(lambda tid: gtid_map.get((tile_id, tid), -1))
-        valid_points = df[df["gtid"] != -1].copy()
-        coord_to_gtid = {tuple(row[1:4]): row[4] for row in valid_points.itertuples(index=False)}
+        df = pd.read_csv(seg_path, sep=r"\s+", header=None, names=["tid", "x", "y", "z"])
+        lut = np.load(lut_path)
+        tid = df["tid"].values.astype(np.int64)
+        in_lut = (tid >= 0) & (tid < len(lut))
+        gtid = np.full(len(tid), -1, dtype=np.int64)
+        gtid[in_lut] = np.take(lut, tid[in_lut])
+        df["gtid"] = gtid
+        valid_points = df[df["gtid"] != -1]
 
         las = laspy.read(laz_path)
-        coords = np.vstack((las.x, las.y, las.z)).T
-        matched_gtid = np.array([coord_to_gtid.get(tuple(c), -1) for c in coords], dtype=np.int32)
+        seg_grid = coords_to_grid(valid_points[["x", "y", "z"]].values, las.header.scales, las.header.offsets)
+        matched_gtid, stats = join_on_grid(las_grid(las), seg_grid, valid_points["gtid"].values.astype(np.int64))
         mask = matched_gtid != -1
+        if stats["ref_unmatched"]:
+            logging.warning(f"{tile_id}: {stats['ref_unmatched']} segmented points not found in vegetation.LAZ")
 
-        if "gtid" not in las.point_format.extra_dimension_names:
-            las.add_extra_dim(laspy.ExtraBytesParams(name="gtid", type=np.int32))
-        las["gtid"] = matched_gtid
-        las.points = las.points[mask]
-        las.write(out_path)
-        logging.info(f"Written forest.laz for {tile_id} with {mask.sum()} points")
+        write_sidecar(laz_path, "gtid", matched_gtid)
+        logging.info(f"Written gtid sidecar for {tile_id} with {mask.sum()} labelled points")
+
+        if bake:
+            bake_sidecars(laz_path, out_path, ["gtid"], keep_mask=mask)
+            logging.info(f"Written forest.laz for {tile_id} with {mask.sum()} points")
 
     except Exception as e:
         logging.error(f"Error processing {tile_id}: {e}")
 
-def process_all_tiles(data_dir, gtid_map, num_cores):
-    tiles = sorted(set(tile for tile, _ in gtid_map.keys()))
-    args = [(tile, data_dir, gtid_map) for tile in tiles]
+def process_all_tiles(data_dir, num_cores, bake=False):
+    """Relabel every tile that has a gtid_lut.npy; workers only load their own tile's table."""
+    tile_root = os.path.join(data_dir, "tiles")
+    tiles = sorted(t for t in os.listdir(tile_root)
+                   if os.path.exists(os.path.join(tile_root, t, "gtid_lut.npy")))
+    args = [(tile, data_dir, bake) for tile in tiles]
     with Pool(processes=num_cores) as pool:
-        list(tqdm(pool.starmap(process_tile, args), total=len(args), desc="Writing forest.laz"))
+        list(tqdm(pool.starmap(process_tile, args), total=len(args), desc="Writing gtid sidecars"))
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python generalize_tid.py <data_dir> <num_cores>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python generalize_tid.py <data_dir> <num_cores> [--bake]")
         sys.exit(1)
 
     data_dir = sys.argv[1]
     num_cores = int(sys.argv[2])
+    bake = len(sys.argv) == 4 and sys.argv[3] == "--bake"
 
     log_dir = os.path.join(data_dir, "logs")
     os.makedirs(log_dir, exist_ok=True)
@@ -140,7 +316,7 @@ if __name__ == "__main__":
         ]
     )
 
-    gtid_map, gtid_count = build_gtid_map(data_dir)
+    gtid_map, gtid_count = build_gtid_map(data_dir, num_cores)
     logging.info(f"Assigned {gtid_count} global tree IDs")
-    process_all_tiles(data_dir, gtid_map, num_cores)
+    process_all_tiles(data_dir, num_cores, bake)
     logging.info("[DONE] All tiles processed.")
\ No newline at end of file
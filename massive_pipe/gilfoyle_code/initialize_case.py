@@ -4,6 +4,7 @@ import subprocess
 import logging
 
 from shared_logging import setup_logging
+from muni_index import build_muni_index
 
 
 def check_case_structure(case_dir):
@@ -39,6 +40,11 @@ def run_preprocessing(case_dir, cores):
         logging.error("[ERROR] preprocess_municipality_trees.py failed")
         return False
 
+    # projected municipality tree index (numpy + grid), loaded by all matching / analysis code
+    for name in ["Bomen_in_beheer_door_gemeente_Delft.geojson", "Bomen_light.geojson"]:
+        index_path = build_muni_index(os.path.join(case_dir, name))
+        logging.info(f"[INFO] Built municipality tree index {index_path}")
+
     logging.info("[INFO] Running clip_tiles_to_muni.sh")
     result = subprocess.run(["./clip_tiles_to_muni.sh", case_dir, str(cores)])
     if result.returncode != 0:
@@ -2,15 +2,20 @@
 import os
 import sys
 import time
+import shutil
 import logging
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import set_start_method
 
 from luna import send_email_notification
 from filter_vegetation import process_tile as vegetation_filter
-from segmentation_tiles import segment_tile_fixed
-from generalize_tid import build_gtid_map
-from generalize_tid import process_all_tiles as run_gtid_for_all_tiles
+from segmentation_tiles import segment_tile_fixed, crown_outlines_tile, crown_metrics_tile
+from generalize_tid import load_core_bounds, finalize_tile, GTID_BLOCK
+from generalize_tid import open_city_layers, append_tile_hulls, close_city_layers, abort_city_layers
+from generalize_tid import city_layers_exist, patch_city_layers
+from point_sidecar import sidecar_dir
+from hull_store import hull_path
+from manifest import TileManifest
 
 from shared_logging import setup_logging
 
@@ -37,52 +42,139 @@ segmentation_params_dict = {
     'vres': 4.0,
     'min_pts': 5
 }
+# concave crown outlines; tiles already run in parallel, so one worker per tile
+concave_params_dict = {
+    'ratio': 0.3,
+    'max_points': 2000,
+    'num_workers': 1
+}
+# 3D crown hull metrics on the hull layer (volume, surface, projection area)
+crown_params_dict = {
+    'max_points': 20000,
+    'num_workers': 1
+}
+# gtids are written as a vegetation.LAZ sidecar; set True to also export forest.laz
+bake_forest_laz = False
+# merged hull layers are GeoParquet; set True to also write GeoJSON copies for QGIS
+export_geojson_layers = False
+
+core_bounds = None  # tile_id -> core bbox, loaded once per worker
+
+def run_stage(manifest, tile_name, stage, inputs, params, outputs, run, adopt=True, clear=True):
+    """
+    Run one tile stage unless the manifest says it is current (outputs exist,
+    same input content and params). Stale outputs are removed first (clear=False
+    for stages that update their output in place). Returns True if the stage ran.
+    """
+    logger = logging.getLogger("pipeline")
+    reason = manifest.stale_reason(stage, inputs, params, outputs, adopt=adopt)
+    if reason is None:
+        logger.info(f"[{tile_name}] SKIP {stage} (up to date)")
+        return False
+
+    logger.info(f"[{tile_name}] START {stage} ({reason})")
+    if clear:
+        manifest.invalidate(stage, outputs)
+    run()
+    if manifest.record(stage, inputs, params, outputs):
+        logger.info(f"[{tile_name}] DONE {stage}")
+    else:
+        logger.warning(f"[{tile_name}] {stage} left no outputs, will rerun next time")
+    return True
 
 def process_tile(tile_name: str):
+    """
+    Run the tile stages whose inputs or parameters changed since the last run.
+    Returns True if the tile's gtid assignment (and so its city-layer rows) changed.
+    """
+    global core_bounds
     setup_logging(os.path.join(log_dir, "pipeline.log")) #logs from all workers go here
     logger = logging.getLogger("pipeline")
 
     start_time = time.time()
     tile_path = os.path.join(tiles_dir, tile_name)
+    manifest = TileManifest(tile_path)
 
     clipped_las = os.path.join(tile_path, "clipped.LAZ")
     vegetation_las = os.path.join(tile_path, "vegetation.LAZ")
     vegetation_xyz = os.path.join(tile_path, "vegetation.XYZ")
     segmentation_xyz = os.path.join(tile_path, "segmentation.XYZ")
-    tree_hulls_geojson = os.path.join(tile_path, "segmentation_hulls.geojson")
+    tree_hulls = hull_path(tile_path, "segmentation_hulls")
+    crown_outlines = hull_path(tile_path, "segmentation_hulls_concave")
+    gtid_lut_npy = os.path.join(tile_path, "gtid_lut.npy")
+    gtid_sidecar = os.path.join(sidecar_dir(vegetation_las), "gtid.npy")
 
     logger.info(f"[{tile_name}] START tile processing")
 
     # Step 1: Vegetation Filtering
-    if not (os.path.exists(vegetation_las) and os.path.exists(vegetation_xyz)):
-        logger.info(f"[{tile_name}] START vegetation filter")
+    def filter_tile():
+        shutil.rmtree(sidecar_dir(vegetation_las), ignore_errors=True)  # point labels of the old cloud
         vegetation_filter(
             input_las=clipped_las,
             output_las=vegetation_las,
             output_xyz=vegetation_xyz
         )
-        logger.info(f"[{tile_name}] DONE vegetation filter")
+
+    run_stage(manifest, tile_name, "vegetation filter",
+              inputs=[clipped_las], params={}, outputs=[vegetation_las, vegetation_xyz],
+              run=filter_tile)
+
+    # Step 2: Segmentation (writes the hulls with crown metrics)
+    segmented = run_stage(manifest, tile_name, "segmentation",
+                          inputs=[vegetation_xyz, segmentation_exe], params=segmentation_params_dict,
+                          outputs=[segmentation_xyz, tree_hulls],
+                          run=lambda: segment_tile_fixed(
+                              input_xyz_path=vegetation_xyz,
+                              output_xyz_path=segmentation_xyz,
+                              output_hulls_path=tree_hulls,
+                              exe_path=segmentation_exe,
+                              segmentation_params=segmentation_params_dict,
+                              crown_params=crown_params_dict
+                          ))
+
+    # 3D crown metrics on the hull layer; fresh segmentations already have them,
+    # older hull layers are backfilled and a crown_params change recomputes them
+    if segmented:
+        manifest.record("crown metrics", [segmentation_xyz], crown_params_dict, [tree_hulls])
     else:
-        logger.info(f"[{tile_name}] SKIP vegetation filter (already exists)")
-
-    # Step 2: Segmentation
-    if not (os.path.exists(segmentation_xyz) and os.path.exists(tree_hulls_geojson)):
-        logger.info(f"[{tile_name}] START segmentation")
-        segment_tile_fixed(
-            input_xyz_path=vegetation_xyz,
-            output_xyz_path=segmentation_xyz,
-            output_geojson_path=tree_hulls_geojson,
-            exe_path=segmentation_exe,
-            segmentation_params=segmentation_params_dict
-        )
-        logger.info(f"[{tile_name}] DONE segmentation")
+        run_stage(manifest, tile_name, "crown metrics",
+                  inputs=[segmentation_xyz], params=crown_params_dict, outputs=[tree_hulls],
+                  run=lambda: crown_metrics_tile(
+                      segmentation_xyz_path=segmentation_xyz,
+                      hulls_path=tree_hulls,
+                      crown_params=crown_params_dict,
+                      force=manifest.has_record("crown metrics")
+                  ), adopt=False, clear=False)
+
+    # Step 3: Concave crown outlines
+    run_stage(manifest, tile_name, "crown outlines",
+              inputs=[segmentation_xyz], params=concave_params_dict, outputs=[crown_outlines],
+              run=lambda: crown_outlines_tile(
+                  segmentation_xyz_path=segmentation_xyz,
+                  output_hulls_path=crown_outlines,
+                  concave_params=concave_params_dict
+              ))
+
+    # Step 4: Global tree IDs (gtids only depend on the tile's grid position)
+    if core_bounds is None:
+        core_bounds = load_core_bounds(case_dir) or {}
+    gtid_changed = False
+    if tile_name in core_bounds:
+        gtid_outputs = [gtid_lut_npy, hull_path(tile_path, "accepted_hulls"),
+                        hull_path(tile_path, "rejected_hulls"), gtid_sidecar]
+        if bake_forest_laz:
+            gtid_outputs.append(os.path.join(tile_path, "forest.laz"))
+        gtid_params = {"core_bounds": core_bounds[tile_name], "gtid_block": GTID_BLOCK, "bake": bake_forest_laz}
+        gtid_changed = run_stage(manifest, tile_name, "gtid assignment",
+                                 inputs=[tree_hulls, segmentation_xyz, vegetation_las],
+                                 params=gtid_params, outputs=gtid_outputs,
+                                 run=lambda: finalize_tile(tile_name, case_dir, core_bounds[tile_name], bake_forest_laz))
     else:
-        logger.info(f"[{tile_name}] SKIP segmentation (already exists)")
+        logger.warning(f"[{tile_name}] SKIP gtid assignment (not in tile_grid_core.geojson)")
 
     total_time = time.time() - start_time
     logger.info(f"[{tile_name}] FINISHED in {total_time:.2f}s\n")
-
-    
+    return gtid_changed
 
 
 # --- Tile processing ---
@@ -92,19 +184,40 @@ if __name__ == "__main__":
     tile_folders = [f for f in os.listdir(tiles_dir)
                     if os.path.isdir(os.path.join(tiles_dir, f))]
 
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        executor.map(process_tile, tile_folders)
-
-    # --- Global Tree ID Assignment ---
     setup_logging(os.path.join(log_dir, "gtid.log"))
     gtid_logger = logging.getLogger("gtid")
-    gtid_logger.info("START global tree ID assignment")
 
-    # Run both steps
-    gtid_map, gtid_count = build_gtid_map(case_dir)
-    gtid_logger.info(f"Assigned {gtid_count} global tree IDs")
-    run_gtid_for_all_tiles(case_dir, gtid_map, num_workers)
-    gtid_logger.info("DONE global tree ID assignment")
+    # first run: the city-wide hull layers are streamed, each tile is appended
+    # as soon as it is done; later runs only patch the rows of changed tiles
+    patch_layers = city_layers_exist(case_dir)
+    layers = None if patch_layers else open_city_layers(case_dir)
+    changed_tiles = []
+
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(process_tile, tile): tile for tile in tile_folders}
+            for fut in as_completed(futures):
+                tile = futures[fut]
+                try:
+                    gtid_changed = fut.result()
+                except Exception:
+                    gtid_logger.exception(f"[{tile}] tile processing failed")
+                    continue
+                if patch_layers:
+                    if gtid_changed:
+                        changed_tiles.append(tile)
+                else:
+                    append_tile_hulls(layers, case_dir, tile)
+    except BaseException:
+        if layers is not None:
+            abort_city_layers(layers)
+        raise
+
+    if patch_layers:
+        patch_city_layers(case_dir, changed_tiles, export_geojson_layers)
+    else:
+        close_city_layers(layers, export_geojson_layers)
+    gtid_logger.info("DONE city hull layers")
     
 
     # --- end of main ---
@@ -0,0 +1,137 @@
+# manifest.py
+import os
+import json
+import hashlib
+
+# ---------------------------------------------------------------------------
+# Per-tile stage manifest
+# ---------------------------------------------------------------------------
+# tiles/<tile>/manifest.json records, for every stage of the tile pipeline, the
+# content digest of each input file and the parameters the stage ran with:
+#
+#   {"stages": {"segmentation": {"inputs": {"vegetation.XYZ": "<blake2b>", ...},
+#                                "params": {"radius": 2.5, ...},
+#                                "outputs": ["segmentation.XYZ", ...]}},
+#    "files":  {"vegetation.XYZ": [size, mtime_ns, "<blake2b>"], ...}}
+#
+# A stage is current when its outputs exist and its input digests and params
+# match the record. A stage that reruns rewrites its outputs, which are the
+# inputs of the next stage, so changes cascade down the pipeline by content
+# and nothing else is recomputed. Digests are cached by (size, mtime_ns): an
+# unchanged tile costs one stat per file, not a re-read.
+
+MANIFEST_NAME = "manifest.json"
+HASH_CHUNK = 8 << 20   # bytes read per hash update
+
+
+def file_digest(path):
+    """blake2b content digest of a file."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _normalize(params):
+    """Params as they compare after a JSON round trip (tuples -> lists, sorted keys)."""
+    return json.loads(json.dumps(params or {}, sort_keys=True))
+
+
+class TileManifest:
+    """
+    Stage records of one tile folder. Files are passed as paths; files inside
+    the tile folder are recorded by their name relative to it, so a case folder
+    can be moved without invalidating its manifests.
+    """
+
+    def __init__(self, tile_path):
+        self.tile_path = tile_path
+        self.path = os.path.join(tile_path, MANIFEST_NAME)
+        self.data = {"stages": {}, "files": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def _key(self, path):
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.tile_path))
+        return os.path.abspath(path) if rel.startswith("..") else rel
+
+    def digest(self, path):
+        """Content digest of a file, recomputed only if its size or mtime changed."""
+        st = os.stat(path)
+        key = self._key(path)
+        cached = self.data["files"].get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = file_digest(path)
+        self.data["files"][key] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def has_record(self, stage):
+        return stage in self.data["stages"]
+
+    def stale_reason(self, stage, inputs, params, outputs, adopt=False):
+        """
+        Why a stage has to (re)run, or None if it is current.
+
+        Parameters:
+        - stage (str): stage name
+        - inputs (list[str]): files the stage reads
+        - params (dict): parameters the stage runs with
+        - outputs (list[str]): files the stage writes
+        - adopt (bool): a stage without a record whose outputs exist is recorded
+          as current (case folders from before the manifest)
+
+        Returns:
+        - str | None
+        """
+        missing = [path for path in outputs if not os.path.exists(path)]
+        if missing:
+            return f"missing output {self._key(missing[0])}"
+
+        record = self.data["stages"].get(stage)
+        if record is None:
+            if adopt and self.record(stage, inputs, params, outputs):
+                return None
+            return "no record"
+
+        if record["params"] != _normalize(params):
+            return "parameters changed"
+        if set(record["inputs"]) != set(self._key(path) for path in inputs):
+            return "input set changed"
+        for path in inputs:
+            if not os.path.exists(path):
+                return f"missing input {self._key(path)}"
+            if record["inputs"][self._key(path)] != self.digest(path):
+                return f"input changed: {self._key(path)}"
+        return None
+
+    def record(self, stage, inputs, params, outputs):
+        """Record a finished stage. Returns False (nothing recorded) if an input or output is missing."""
+        if not all(os.path.exists(path) for path in list(inputs) + list(outputs)):
+            return False
+        self.data["stages"][stage] = {
+            "inputs": {self._key(path): self.digest(path) for path in inputs},
+            "params": _normalize(params),
+            "outputs": [self._key(path) for path in outputs],
+        }
+        for path in outputs:
+            self.digest(path)
+        self.save()
+        return True
+
+    def invalidate(self, stage, outputs):
+        """Drop a stage record and its outputs before a rerun, so a failed rerun never looks current."""
+        self.data["stages"].pop(stage, None)
+        for path in outputs:
+            self.data["files"].pop(self._key(path), None)
+            if os.path.exists(path):
+                os.remove(path)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,354 @@
+# segmentation_diff.py
+import os
+import sys
+import logging
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import laspy
+import shapely
+from shapely import STRtree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from coord_join import las_grid, coords_to_grid, join_on_grid
+from point_sidecar import read_sidecar, has_sidecar
+from hull_store import find_hulls, read_hulls, write_hulls, hull_path, HullLayerWriter
+from hull_kernel import convex_hulls_by_label
+
+# ---------------------------------------------------------------------------
+# Segmentation diff
+# ---------------------------------------------------------------------------
+# Compares two segmentations A and B of the same points (two runs, two
+# parameter sets, or two case folders) or two hull layers:
+#
+#   points  the contingency table of (label A, label B) pairs is one np.unique
+#           over packed label pairs; overlap = shared points
+#   hulls   intersecting hull pairs come from one STRtree query; overlap =
+#           intersection area
+#
+# Per tree, on both sides: its best match on the other side (highest IoU),
+# that IoU, how many trees of the other side cover at least PART_SHARE of it,
+# and a status:
+#
+#   A: lost (< PART_SHARE covered by B trees) | split (>= 2 parts in B)
+#      | merge (its best B holds >= 2 A trees) | match | changed
+#   B: new | merge (>= 2 A parts) | split (its best A is split) | match | changed
+#
+# (first that applies; match = best IoU >= MATCH_IOU).
+#
+# Labels < 0 are noise (not a tree); they only count in the tree sizes.
+
+MATCH_IOU = 0.5    # IoU of a one-to-one match
+PART_SHARE = 0.2   # share of a tree another tree must cover to count as a part of it
+DIFF_COLUMNS = ["best_match", "overlap", "iou", "covered", "n_parts", "status"]
+
+
+# ---------------------------------------------------------------------------
+# Core
+# ---------------------------------------------------------------------------
+
+def _factorize(labels):
+    """(ids, index per point); integer labels in a compact range skip the sort."""
+    if np.issubdtype(labels.dtype, np.integer) and len(labels):
+        lo, hi = int(labels.min()), int(labels.max())
+        if hi - lo <= 4 * len(labels):
+            return np.arange(lo, hi + 1, dtype=labels.dtype), (labels - lo).astype(np.int64)
+    return np.unique(labels, return_inverse=True)
+
+
+def contingency(labels_a, labels_b):
+    """
+    Point-level contingency table of two label arrays over the same points.
+
+    Returns:
+    - ids_a, ids_b (np.ndarray): label pair per table entry
+    - counts (np.ndarray): shared points per pair (only pairs that occur)
+    """
+    labels_a = np.asarray(labels_a)
+    labels_b = np.asarray(labels_b)
+    if len(labels_a) != len(labels_b):
+        raise ValueError(f"Label arrays differ in length: {len(labels_a)} vs {len(labels_b)}")
+
+    ua, ia = _factorize(labels_a)
+    ub, ib = _factorize(labels_b)
+    pairs, counts = np.unique(ia.astype(np.int64) * len(ub) + ib, return_counts=True)
+    return ua[pairs // len(ub)], ub[pairs % len(ub)], counts
+
+
+def _side(i_self, i_other, overlap, iou, size_self, part_share):
+    """Best match, coverage and part count per tree of one side (pair arrays indexed into that side)."""
+    n = len(size_self)
+    best = np.full(n, -1, dtype=np.int64)
+    best_overlap = np.zeros(n)
+    best_iou = np.zeros(n)
+    if len(i_self):
+        order = np.lexsort((-iou, i_self))
+        first = order[np.r_[True, i_self[order][1:] != i_self[order][:-1]]]
+        best[i_self[first]] = i_other[first]
+        best_overlap[i_self[first]] = overlap[first]
+        best_iou[i_self[first]] = iou[first]
+
+    covered = np.bincount(i_self, weights=overlap, minlength=n) / np.maximum(size_self, 1e-12)
+    is_part = overlap >= part_share * size_self[i_self]
+    n_parts = np.bincount(i_self[is_part], minlength=n)
+    return {"best": best, "overlap": best_overlap, "iou": best_iou, "covered": covered, "n_parts": n_parts}
+
+
+def diff_overlaps(ia, ib, overlap, size_a, size_b, match_iou=MATCH_IOU, part_share=PART_SHARE):
+    """
+    Match and classify the trees of A and B from their pairwise overlaps.
+
+    Parameters:
+    - ia, ib (np.ndarray): tree indices (into size_a / size_b) of every overlapping pair
+    - overlap (np.ndarray): shared points or intersection area per pair
+    - size_a, size_b (np.ndarray): point count or area per tree
+
+    Returns:
+    - (dict, dict): per side arrays best (index on the other side, -1 = none),
+      overlap, iou, covered (share of the tree covered by the other side),
+      n_parts and status
+    """
+    ia, ib = np.asarray(ia, dtype=np.int64), np.asarray(ib, dtype=np.int64)
+    overlap = np.asarray(overlap, dtype=np.float64)
+    size_a, size_b = np.asarray(size_a, dtype=np.float64), np.asarray(size_b, dtype=np.float64)
+    iou = overlap / np.maximum(size_a[ia] + size_b[ib] - overlap, 1e-12)
+
+    a = _side(ia, ib, overlap, iou, size_a, part_share)
+    b = _side(ib, ia, overlap, iou, size_b, part_share)
+
+    for side, other, labels in ((a, b, ("lost", "split", "merge")), (b, a, ("new", "merge", "split"))):
+        empty, own_parts, partner_parts = labels
+        has_best = side["best"] >= 0
+        partner_multi = np.zeros(len(side["best"]), dtype=bool)
+        partner_multi[has_best] = other["n_parts"][side["best"][has_best]] >= 2
+
+        side["status"] = np.select(
+            [side["covered"] < part_share, side["n_parts"] >= 2, partner_multi, side["iou"] >= match_iou],
+            [empty, own_parts, partner_parts, "match"], default="changed")
+    return a, b
+
+
+def _tables(ids_a, ids_b, a, b):
+    """Per-tree DataFrames (tree_id + DIFF_COLUMNS) of both sides."""
+    tables = []
+    for ids, side, other_ids in ((ids_a, a, ids_b), (ids_b, b, ids_a)):
+        best = np.where(side["best"] >= 0, other_ids[np.maximum(side["best"], 0)] if len(other_ids) else -1, -1)
+        tables.append(pd.DataFrame({
+            "tree_id": ids, "best_match": best, "overlap": side["overlap"], "iou": side["iou"],
+            "covered": side["covered"], "n_parts": side["n_parts"], "status": side["status"],
+        }))
+    return tables
+
+
+def diff_labels(labels_a, labels_b, match_iou=MATCH_IOU, part_share=PART_SHARE):
+    """
+    Diff two label arrays over the same points (labels < 0 = noise).
+
+    Returns:
+    - (pd.DataFrame, pd.DataFrame): one row per tree of A / B with tree_id,
+      n_points and DIFF_COLUMNS
+    """
+    ids_a, ids_b, counts = contingency(labels_a, labels_b)
+
+    # tree sizes from the table (noise pairs included)
+    trees_a, inv_a = np.unique(ids_a, return_inverse=True)
+    trees_b, inv_b = np.unique(ids_b, return_inverse=True)
+    size_a = np.bincount(inv_a, weights=counts)[trees_a >= 0]
+    size_b = np.bincount(inv_b, weights=counts)[trees_b >= 0]
+    trees_a, trees_b = trees_a[trees_a >= 0], trees_b[trees_b >= 0]
+
+    tree_pair = (ids_a >= 0) & (ids_b >= 0)
+    ia = np.searchsorted(trees_a, ids_a[tree_pair])
+    ib = np.searchsorted(trees_b, ids_b[tree_pair])
+
+    a, b = diff_overlaps(ia, ib, counts[tree_pair], size_a, size_b, match_iou, part_share)
+    table_a, table_b = _tables(trees_a, trees_b, a, b)
+    table_a.insert(1, "n_points", size_a.astype(np.int64))
+    table_b.insert(1, "n_points", size_b.astype(np.int64))
+    return table_a, table_b
+
+
+def diff_hulls(hulls_a, hulls_b, id_col_a="tree_id", id_col_b="tree_id", match_iou=MATCH_IOU, part_share=PART_SHARE):
+    """
+    Diff two hull layers by intersection area (one STRtree query).
+
+    Returns:
+    - (pd.DataFrame, pd.DataFrame): one row per hull of A / B with tree_id,
+      area and DIFF_COLUMNS
+    """
+    geoms_a = np.asarray(hulls_a.geometry.values, dtype=object)
+    geoms_b = np.asarray(hulls_b.geometry.values, dtype=object)
+    if len(geoms_a) and len(geoms_b):
+        ia, ib = STRtree(geoms_b).query(geoms_a, predicate="intersects")
+    else:
+        ia = ib = np.empty(0, dtype=np.intp)
+    overlap = shapely.area(shapely.intersection(geoms_a[ia], geoms_b[ib])) if len(ia) else np.empty(0)
+    size_a, size_b = shapely.area(geoms_a), shapely.area(geoms_b)
+
+    a, b = diff_overlaps(ia, ib, overlap, size_a, size_b, match_iou, part_share)
+    table_a, table_b = _tables(hulls_a[id_col_a].to_numpy(), hulls_b[id_col_b].to_numpy(), a, b)
+    table_a.insert(1, "area", size_a)
+    table_b.insert(1, "area", size_b)
+    return table_a, table_b
+
+
+def annotate_hulls(hulls_gdf, table, id_col="tree_id"):
+    """hulls_gdf with the diff columns of table joined on the tree id (replacing those of an earlier diff)."""
+    diff = table.set_index("tree_id")[DIFF_COLUMNS]
+    return hulls_gdf.drop(columns=DIFF_COLUMNS, errors="ignore").join(diff, on=id_col)
+
+
+def summarize(table_a, table_b):
+    """Status counts of both sides as one DataFrame (rows = status, columns = A / B)."""
+    return pd.concat({"A": table_a["status"].value_counts(), "B": table_b["status"].value_counts()},
+                     axis=1).fillna(0).astype(int)
+
+
+# ---------------------------------------------------------------------------
+# Point alignment
+# ---------------------------------------------------------------------------
+
+def align_labels(grid_a, labels_a, grid_b, labels_b):
+    """
+    Labels of A and B over the union of two point sets (integer grid
+    coordinates); points that only one side has are noise (-1) on the other.
+    """
+    grid_a, grid_b = np.asarray(grid_a), np.asarray(grid_b)
+    if grid_a.shape == grid_b.shape and np.array_equal(grid_a, grid_b):
+        return np.asarray(labels_a), np.asarray(labels_b)
+
+    b_on_a, _ = join_on_grid(grid_a, grid_b, np.asarray(labels_b), fill=-1)
+    a_index, _ = join_on_grid(grid_b, grid_a, np.arange(len(grid_a)), fill=-1)
+    b_only = a_index == -1
+    return (np.concatenate([labels_a, np.full(int(b_only.sum()), -1, dtype=np.asarray(labels_a).dtype)]),
+            np.concatenate([b_on_a, np.asarray(labels_b)[b_only]]))
+
+
+def read_xyz_labels(xyz_path):
+    """(tree_id, x, y, z) of a segmentation output as (labels, xyz)."""
+    df = pd.read_csv(xyz_path, sep=r"\s+", header=None, usecols=[0, 1, 2, 3], names=["tree_id", "x", "y", "z"])
+    return df["tree_id"].to_numpy(np.int64), df[["x", "y", "z"]].to_numpy()
+
+
+# ---------------------------------------------------------------------------
+# Drivers
+# ---------------------------------------------------------------------------
+
+def write_diff(out_dir, table_a, table_b, hulls_a=None, hulls_b=None, id_col_a="tree_id", id_col_b="tree_id"):
+    """Write trees_a.csv / trees_b.csv and, if hulls are given, annotated diff_hulls_a / _b layers."""
+    os.makedirs(out_dir, exist_ok=True)
+    table_a.to_csv(os.path.join(out_dir, "trees_a.csv"), index=False)
+    table_b.to_csv(os.path.join(out_dir, "trees_b.csv"), index=False)
+    if hulls_a is not None:
+        write_hulls(annotate_hulls(hulls_a, table_a, id_col_a), hull_path(out_dir, "diff_hulls_a"))
+    if hulls_b is not None:
+        write_hulls(annotate_hulls(hulls_b, table_b, id_col_b), hull_path(out_dir, "diff_hulls_b"))
+
+
+def diff_xyz(xyz_a, xyz_b, out_dir, grid_scale=0.001):
+    """Diff two segmentation outputs (.xyz with tree_id x y z), e.g. a sweep's best vs runner-up."""
+    labels_a, pts_a = read_xyz_labels(xyz_a)
+    labels_b, pts_b = read_xyz_labels(xyz_b)
+    offset = np.minimum(pts_a.min(axis=0), pts_b.min(axis=0))
+    scales = [grid_scale] * 3
+    la, lb = align_labels(coords_to_grid(pts_a, scales, offset), labels_a,
+                          coords_to_grid(pts_b, scales, offset), labels_b)
+    table_a, table_b = diff_labels(la, lb)
+
+    hulls = []
+    for labels, pts in ((labels_a, pts_a), (labels_b, pts_b)):
+        tree = labels >= 0
+        tids, geoms, _ = convex_hulls_by_label(pts[tree, 0], pts[tree, 1], labels[tree])
+        hulls.append(gpd.GeoDataFrame({"tree_id": tids}, geometry=geoms, crs="EPSG:28992"))
+    write_diff(out_dir, table_a, table_b, hulls[0], hulls[1])
+    return table_a, table_b
+
+
+def diff_hull_layers(path_a, path_b, out_dir, id_col="tree_id"):
+    """Diff two hull layers (hull store or GeoJSON)."""
+    hulls_a, hulls_b = read_hulls(path_a), read_hulls(path_b)
+    table_a, table_b = diff_hulls(hulls_a, hulls_b, id_col, id_col)
+    write_diff(out_dir, table_a, table_b, hulls_a, hulls_b, id_col, id_col)
+    return table_a, table_b
+
+
+def diff_tile(tile_id, case_a, case_b, label="gtid"):
+    """
+    Diff one tile of two case folders by the per-point label sidecar of
+    vegetation.LAZ (gtid by default). Returns (tile_id, trees_a, trees_b,
+    annotated accepted hulls of A, of B), or None if the tile is incomplete.
+    """
+    paths = [os.path.join(case, "tiles", tile_id, "vegetation.LAZ") for case in (case_a, case_b)]
+    if not all(os.path.exists(p) and has_sidecar(p, label) for p in paths):
+        logging.warning(f"SKIP {tile_id}: missing vegetation.LAZ or '{label}' sidecar")
+        return None
+
+    grids = [las_grid(laspy.read(p)) for p in paths]
+    la, lb = align_labels(grids[0], read_sidecar(paths[0], label), grids[1], read_sidecar(paths[1], label))
+    table_a, table_b = diff_labels(la, lb)
+
+    out = [tile_id]
+    for table in (table_a, table_b):
+        table.insert(0, "tile", tile_id)
+        out.append(table)
+    for case, table in ((case_a, table_a), (case_b, table_b)):
+        path = find_hulls(os.path.join(case, "tiles", tile_id), "accepted_hulls")
+        out.append(annotate_hulls(read_hulls(path), table, label) if path and label == "gtid" else None)
+    return tuple(out)
+
+
+def _diff_tile_task(args):
+    return diff_tile(*args)
+
+
+def diff_city(case_a, case_b, out_dir, num_workers=4, label="gtid"):
+    """
+    Diff all tiles two case folders have in common, in a process pool. Writes
+    trees_a.csv / trees_b.csv (with a tile column) and the annotated accepted
+    hulls of both cases (diff_hulls_a / _b, streamed one tile at a time).
+    Returns the status summary.
+    """
+    tiles = sorted(set(os.listdir(os.path.join(case_a, "tiles"))) & set(os.listdir(os.path.join(case_b, "tiles"))))
+    os.makedirs(out_dir, exist_ok=True)
+
+    tables_a, tables_b = [], []
+    with HullLayerWriter(hull_path(out_dir, "diff_hulls_a")) as writer_a, \
+            HullLayerWriter(hull_path(out_dir, "diff_hulls_b")) as writer_b, \
+            ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(_diff_tile_task, (tile, case_a, case_b, label)) for tile in tiles]
+        for fut in tqdm(as_completed(futures), total=len(futures), desc="Diffing tiles",
+                        disable=not sys.stdout.isatty()):
+            res = fut.result()
+            if res is None:
+                continue
+            _, table_a, table_b, hulls_a, hulls_b = res
+            tables_a.append(table_a)
+            tables_b.append(table_b)
+            writer_a.write(hulls_a)
+            writer_b.write(hulls_b)
+
+    table_a = pd.concat(tables_a, ignore_index=True) if tables_a else pd.DataFrame(columns=["tile", "tree_id"])
+    table_b = pd.concat(tables_b, ignore_index=True) if tables_b else pd.DataFrame(columns=["tile", "tree_id"])
+    table_a.to_csv(os.path.join(out_dir, "trees_a.csv"), index=False)
+    table_b.to_csv(os.path.join(out_dir, "trees_b.csv"), index=False)
+    return summarize(table_a, table_b) if len(table_a) or len(table_b) else None
+
+
+if __name__ == "__main__":
+    usage = ("Usage: python segmentation_diff.py city <case_a> <case_b> <out_dir> <num_workers>\n"
+             "       python segmentation_diff.py xyz <a.xyz> <b.xyz> <out_dir>\n"
+             "       python segmentation_diff.py hulls <layer_a> <layer_b> <out_dir> [id_column]")
+    if len(sys.argv) < 5 or sys.argv[1] not in ("city", "xyz", "hulls"):
+        print(usage)
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    mode, a, b, out_dir = sys.argv[1:5]
+    if mode == "city":
+        summary = diff_city(a, b, out_dir, int(sys.argv[5]) if len(sys.argv) > 5 else 4)
+    elif mode == "xyz":
+        summary = summarize(*diff_xyz(a, b, out_dir))
+    else:
+        summary = summarize(*diff_hull_layers(a, b, out_dir, sys.argv[5] if len(sys.argv) > 5 else "tree_id"))
+    logging.info(f"Diff written to {out_dir}\n{summary}")
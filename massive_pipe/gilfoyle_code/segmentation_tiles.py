@@ -3,15 +3,32 @@ import os
 import subprocess
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import MultiPoint
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label, concave_hulls_by_label, crown_metrics_3d_by_label
+from hull_store import write_hulls, read_hulls
+
+CROWN_METRIC_COLUMNS = ["crown_vol", "crown_surf", "crown_proj"]
+
+
+def add_crown_metrics(hulls_gdf, seg_df, crown_params=None):
+    """Add 3D crown hull volume / surface and projection area columns to a tid hull layer."""
+    tids, metrics = crown_metrics_3d_by_label(
+        seg_df["x"].values, seg_df["y"].values, seg_df["z"].values, seg_df["tid"].values,
+        **(crown_params or {})
+    )
+    metrics_df = pd.DataFrame(metrics, index=tids)
+    for col in CROWN_METRIC_COLUMNS:
+        hulls_gdf[col] = hulls_gdf["tid"].map(metrics_df[col]).fillna(0.0).values
+    return hulls_gdf
+
 
 def segment_tile_fixed(
     input_xyz_path: str,
     output_xyz_path: str,
-    output_geojson_path: str,
+    output_hulls_path: str,
     exe_path: str,
-    segmentation_params: dict[str, float]
+    segmentation_params: dict[str, float],
+    crown_params: dict[str, float] | None = None
 ):
     if not os.path.exists(input_xyz_path):
         print(f"[segment_tile_fixed] Skipping: missing input {input_xyz_path}")
@@ -37,17 +54,71 @@ def segment_tile_fixed(
         return
 
     seg_df = pd.read_csv(output_xyz_path, sep=r"\s+", header=None, names=["tid", "x", "y", "z"])
-    seg_gdf = gpd.GeoDataFrame(seg_df, geometry=gpd.points_from_xy(seg_df.x, seg_df.y), crs="EPSG:28992")
 
-    hulls = []
-    for tid, group in seg_gdf.groupby("tid"):
-        if len(group) >= 3:
-            hull_geom = MultiPoint(group.geometry.values).convex_hull
-            hulls.append({"tid": tid, "geometry": hull_geom})
-        else:
-            logger.warning("tid %s has fewer than 3 points — skipped", tid)
+    tids, hulls, skipped = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tid"].values)
+    for tid in skipped:
+        logger.warning("tid %s has fewer than 3 points — skipped", tid)
+
+    hulls_gdf = gpd.GeoDataFrame({"tid": tids}, geometry=hulls, crs="EPSG:28992")
+    hulls_gdf = add_crown_metrics(hulls_gdf, seg_df, crown_params)
+    write_hulls(hulls_gdf, output_hulls_path)
+
+    logger.info("Segmentation and hull export complete: %s", output_hulls_path)
+
+
+def crown_metrics_tile(
+    segmentation_xyz_path: str,
+    hulls_path: str,
+    crown_params: dict[str, float] | None = None,
+    force: bool = False
+):
+    """Backfill the 3D crown metric columns on an existing hull layer (no-op if present, unless force)."""
+    if not (os.path.exists(segmentation_xyz_path) and os.path.exists(hulls_path)):
+        print(f"[crown_metrics_tile] Skipping: missing input for {hulls_path}")
+        return
+
+    logger = setup_module_logger("segmentation", "logs/segmentation.log")
+
+    hulls_gdf = read_hulls(hulls_path)
+    if not force and all(col in hulls_gdf.columns for col in CROWN_METRIC_COLUMNS):
+        return
+
+    seg_df = pd.read_csv(segmentation_xyz_path, sep=r"\s+", header=None, names=["tid", "x", "y", "z"])
+    hulls_gdf["tid"] = hulls_gdf["tid"].astype(int)
+    hulls_gdf = add_crown_metrics(hulls_gdf, seg_df, crown_params)
+    write_hulls(hulls_gdf, hulls_path)
+
+    logger.info("Crown metrics added: %s", hulls_path)
+
+
+def crown_outlines_tile(
+    segmentation_xyz_path: str,
+    output_hulls_path: str,
+    concave_params: dict[str, float]
+):
+    """
+    Write concave crown outlines for a segmented tile next to its convex hulls.
+    concave_params: ratio, max_points and optionally num_workers / allow_holes.
+    """
+    if not os.path.exists(segmentation_xyz_path):
+        print(f"[crown_outlines_tile] Skipping: missing input {segmentation_xyz_path}")
+        return
+
+    logger = setup_module_logger("segmentation", "logs/segmentation.log")
+    logger.info(f"Computing concave crown outlines for {segmentation_xyz_path}")
+
+    seg_df = pd.read_csv(segmentation_xyz_path, sep=r"\s+", header=None, names=["tid", "x", "y", "z"])
+
+    tids, hulls, skipped = concave_hulls_by_label(
+        seg_df["x"].values, seg_df["y"].values, seg_df["tid"].values,
+        ratio=concave_params["ratio"],
+        max_points=int(concave_params["max_points"]),
+        allow_holes=bool(concave_params.get("allow_holes", False)),
+        num_workers=int(concave_params.get("num_workers", 1))
+    )
+    logger.info("%d tids with fewer than 3 points skipped for crown outlines", len(skipped))
 
-    hulls_gdf = gpd.GeoDataFrame(hulls, crs="EPSG:28992")
-    hulls_gdf.to_file(output_geojson_path, driver="GeoJSON")
+    hulls_gdf = gpd.GeoDataFrame({"tid": tids}, geometry=hulls, crs="EPSG:28992")
+    write_hulls(hulls_gdf, output_hulls_path)
 
-    logger.info("Segmentation and hull export complete: %s", output_geojson_path)
+    logger.info("Crown outline export complete: %s", output_hulls_path)
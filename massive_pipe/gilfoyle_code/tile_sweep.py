@@ -0,0 +1,304 @@
+# tile_sweep.py
+import os
+import sys
+import logging
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import set_start_method
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import box
+
+from shared_logging import setup_logging
+from generalize_tid import load_core_bounds
+from point_sidecar import las_point_count
+from hull_kernel import convex_hulls_by_label
+from hull_labelling import label_hulls
+from muni_index import load_muni_index
+from run_meta import run_segmenter, record_output, input_stats
+
+# ---------------------------------------------------------------------------
+# Parameter sweep over a sample of city tiles
+# ---------------------------------------------------------------------------
+# Runs radius x vres x min_pts combinations directly on the tiles of a case
+# (after the vegetation filter stage) instead of on a hand-cut study area:
+#
+#   sample     tiles are put in n_strata canopy-density strata (vegetation
+#              points per m2 of tile core, from the vegetation.LAZ header) and
+#              n_tiles are drawn at random, spread evenly over the strata;
+#              each sampled tile weighs (tiles in its stratum / sampled in it)
+#   tasks      every tile x combination is one task on one process pool,
+#              largest tiles first; a task segments the tile's vegetation.XYZ,
+#              keeps the trees whose hull centroid lies in the tile core (the
+#              gtid rule) and matches them with the municipality trees of the core
+#   results    one row per tile x combination in tile_results.csv (appended
+#              as tasks finish, done rows are skipped on a rerun); tasks whose
+#              segmentation failed or came out empty get a row with status
+#              "failed" / "empty" (failed ones are retried on a rerun) and are
+#              left out of the estimates; per combination the weighted
+#              city-wide estimates in combo_results.csv
+#              and the per-tile one-to-one shares in tile_breakdown.csv
+#
+# Everything goes to <case_dir>/sweeps/<sweep_name>; the tile sample is kept
+# there, so a rerun with a larger grid reuses the same tiles. Every run writes
+# its run_meta record next to its (possibly deleted) output .XYZ.
+
+MUNI_GEOJSON = "Bomen_in_beheer_door_gemeente_Delft.geojson"
+SAMPLE_CSV = "tile_sample.csv"
+TILE_RESULTS_CSV = "tile_results.csv"
+COMBO_RESULTS_CSV = "combo_results.csv"
+TILE_BREAKDOWN_CSV = "tile_breakdown.csv"
+KEY_COLUMNS = ["tile_id", "R", "Vres", "minP"]
+TILE_COLUMNS = KEY_COLUMNS + ["status", "runtime", "seg_points", "N_hulls", "H0", "H1", "H2", "H3", "H4+",
+                              "N_muni", "muni_skip", "muni_one_to_one", "muni_shared"]
+
+# --- Parameters ---
+segmentation_exe = "./segmentation_code/build/segmentation"
+sweep_grid = {
+    'radius': [1.5, 2.0, 2.5, 3.0, 3.5],
+    'vres': [2.0, 3.0, 4.0, 5.0],
+    'min_pts': [3, 5, 8]
+}
+n_strata = 4
+keep_outputs = False   # keep the per-task segmentation .XYZ files
+
+muni_index = None  # municipality tree index, loaded once per worker
+
+
+def tile_densities(case_dir, core_bounds):
+    """DataFrame (tile_id, veg_points, density, cx, cy) of the tiles with a vegetation filter output."""
+    rows = []
+    for tile_id, bounds in core_bounds.items():
+        tile_path = os.path.join(case_dir, "tiles", tile_id)
+        vegetation_las = os.path.join(tile_path, "vegetation.LAZ")
+        if not (os.path.exists(vegetation_las) and os.path.exists(os.path.join(tile_path, "vegetation.XYZ"))):
+            continue
+        n = las_point_count(vegetation_las)
+        area = (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+        rows.append({"tile_id": tile_id, "veg_points": n, "density": n / area,
+                     "cx": (bounds[0] + bounds[2]) / 2, "cy": (bounds[1] + bounds[3]) / 2})
+    return pd.DataFrame(rows, columns=["tile_id", "veg_points", "density", "cx", "cy"])
+
+
+def sample_tiles(densities, n_tiles, n_strata=4, seed=0):
+    """
+    Stratified random sample of tiles by canopy density.
+
+    Returns:
+    - pd.DataFrame: the sampled rows of densities with stratum and weight
+      (tiles in the stratum / tiles sampled from it)
+    """
+    df = densities.sort_values("density", ignore_index=True)
+    n_strata = max(1, min(n_strata, len(df)))
+    df["stratum"] = np.arange(len(df)) * n_strata // max(len(df), 1)
+
+    rng = np.random.default_rng(seed)
+    per_stratum = np.full(n_strata, n_tiles // n_strata)
+    per_stratum[:n_tiles % n_strata] += 1
+
+    picked = []
+    for stratum, group in df.groupby("stratum"):
+        n = min(len(group), max(1, per_stratum[stratum]))
+        chosen = group.iloc[rng.choice(len(group), size=n, replace=False)].copy()
+        chosen["weight"] = len(group) / n
+        picked.append(chosen)
+    return pd.concat(picked, ignore_index=True).sort_values("tile_id", ignore_index=True)
+
+
+def _tile_task(args):
+    """Segment one tile with one combination and match its core trees (worker process)."""
+    global muni_index
+    tile_id, combo_idx, (r, v, m), core, case_dir, sweep_dir, input_meta = args
+    setup_logging(os.path.join(case_dir, "logs", "tile_sweep.log"))
+    logger = logging.getLogger("tile_sweep")
+
+    if muni_index is None:
+        muni_index = load_muni_index(os.path.join(case_dir, MUNI_GEOJSON))
+
+    input_xyz = os.path.join(case_dir, "tiles", tile_id, "vegetation.XYZ")
+    out_dir = os.path.join(sweep_dir, "tiles", tile_id)
+    os.makedirs(out_dir, exist_ok=True)
+    output_xyz = os.path.join(out_dir, f"segmentation_{combo_idx:04d}.XYZ")
+
+    # the run record <output_xyz>.meta.json is completed from the loaded output below
+    success, runtime, meta = run_segmenter(segmentation_exe, input_xyz, output_xyz, r, v, m,
+                                           input_meta=input_meta, scan=False)
+    if not success:
+        logger.error(f"[{tile_id}] Segmentation failed for R={r} Vres={v} minP={m}: return code {meta['returncode']}")
+        return failed_row(tile_id, (r, v, m), "failed", runtime)
+
+    seg_df = pd.read_csv(output_xyz, sep=r"\s+", header=None, names=["tid", "x", "y", "z"])
+    record_output(output_xyz, meta, seg_df["tid"].to_numpy())
+    if not keep_outputs:
+        os.remove(output_xyz)
+    if seg_df.empty:
+        logger.warning(f"[{tile_id}] Empty segmentation for R={r} Vres={v} minP={m}")
+        return failed_row(tile_id, (r, v, m), "empty", runtime)
+
+    # trees of the tile core (centroid rule of the gtid assignment)
+    _, hulls, _ = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tid"].values)
+    hulls = hulls[shapely.contains(box(*core), shapely.centroid(hulls))] if len(hulls) else hulls
+
+    # municipality trees of the core against those hulls
+    trees = muni_index.query_geometry(box(*core))
+    hull_table, hulls_per_tree = label_hulls(hulls, shapely.points(muni_index.x[trees], muni_index.y[trees]))
+    classes = hull_table["muni_class"].value_counts()
+
+    row = {
+        "tile_id": tile_id, "R": r, "Vres": v, "minP": m, "status": "ok",
+        "runtime": round(runtime, 2),
+        "seg_points": len(seg_df),
+        "N_hulls": len(hulls),
+        **{h: int(classes.get(h, 0)) for h in ("H0", "H1", "H2", "H3", "H4+")},
+        "N_muni": len(trees),
+        "muni_skip": int((hulls_per_tree == 0).sum()),      # trees in no hull
+        "muni_one_to_one": int((hulls_per_tree == 1).sum()),   # trees in exactly one hull
+        "muni_shared": int((hulls_per_tree > 1).sum()),    # trees in several hulls
+    }
+    logger.info(f"[{tile_id}] R={r} Vres={v} minP={m}: {len(hulls)} trees, "
+                f"{row['muni_one_to_one']}/{len(trees)} municipality trees one-to-one ({runtime:.1f}s)")
+    return row
+
+
+def failed_row(tile_id, combo, status, runtime=np.nan):
+    """Tile result row of a task without a segmentation to analyse ("failed" / "empty")."""
+    r, v, m = combo
+    return {"tile_id": tile_id, "R": r, "Vres": v, "minP": m, "status": status, "runtime": round(runtime, 2)}
+
+
+def read_tile_results(results_path):
+    """Tile rows of earlier runs, the last row per tile x combination (rows from before the status column count as ok)."""
+    df = pd.read_csv(results_path, dtype={"tile_id": str})
+    if "status" not in df.columns:
+        df.insert(len(KEY_COLUMNS), "status", "ok")
+    return df.reindex(columns=TILE_COLUMNS).drop_duplicates(KEY_COLUMNS, keep="last")
+
+
+def aggregate(tile_results, sample):
+    """
+    City-wide estimates per combination from the tile rows (tile weights from
+    the sample): weighted counts, shares of the weighted totals, and the spread
+    of the per-tile one-to-one share.
+    """
+    df = tile_results[tile_results["status"] == "ok"].merge(sample[["tile_id", "veg_points", "weight"]], on="tile_id")
+    count_columns = ["seg_points", "N_hulls", "H0", "H1", "H2", "H3", "H4+",
+                     "N_muni", "muni_skip", "muni_one_to_one", "muni_shared", "veg_points"]
+    weighted = df[count_columns].mul(df["weight"], axis=0)
+    weighted[["R", "Vres", "minP"]] = df[["R", "Vres", "minP"]]
+    totals = weighted.groupby(["R", "Vres", "minP"]).sum()
+
+    tile_share = df["muni_one_to_one"] / df["N_muni"].where(df["N_muni"] > 0)
+    spread = tile_share.groupby([df["R"], df["Vres"], df["minP"]]).agg(["min", "median", "max"])
+
+    out = pd.DataFrame({
+        "n_tiles": df.groupby(["R", "Vres", "minP"]).size(),
+        "est_trees": totals["N_hulls"].round(0),
+        "one_to_one": 100 * totals["muni_one_to_one"] / totals["N_muni"],   # % of municipality trees
+        "muni_skip": 100 * totals["muni_skip"] / totals["N_muni"],
+        "muni_shared": 100 * totals["muni_shared"] / totals["N_muni"],
+        "h1_share": 100 * totals["H1"] / totals["N_hulls"],                 # % of trees holding one municipality tree
+        "pcd_kept": 100 * totals["seg_points"] / totals["veg_points"],
+        "tile_one_to_one_min": 100 * spread["min"],
+        "tile_one_to_one_median": 100 * spread["median"],
+        "tile_one_to_one_max": 100 * spread["max"],
+    })
+    return out.reset_index().sort_values("one_to_one", ascending=False, ignore_index=True)
+
+
+def run_tile_sweep(case_dir, num_workers, n_tiles=12, sweep_name="tile_sweep", seed=0):
+    """Sweep sweep_grid over a density-stratified sample of n_tiles tiles of a case."""
+    setup_logging(os.path.join(case_dir, "logs", "tile_sweep.log"))
+    logger = logging.getLogger("tile_sweep")
+
+    sweep_dir = os.path.join(case_dir, "sweeps", sweep_name)
+    os.makedirs(sweep_dir, exist_ok=True)
+    core_bounds = load_core_bounds(case_dir)
+    if not core_bounds:
+        return None
+
+    # tile sample (reused on a rerun)
+    sample_path = os.path.join(sweep_dir, SAMPLE_CSV)
+    if os.path.exists(sample_path):
+        sample = pd.read_csv(sample_path, dtype={"tile_id": str})
+        logger.info(f"Reusing the tile sample of {sample_path} ({len(sample)} tiles)")
+    else:
+        densities = tile_densities(case_dir, core_bounds)
+        if densities.empty:
+            logger.error("No tiles with a vegetation filter output, run the vegetation stage first")
+            return None
+        sample = sample_tiles(densities, n_tiles, n_strata, seed)
+        sample.to_csv(sample_path, index=False)
+        logger.info(f"Sampled {len(sample)} of {len(densities)} tiles over {n_strata} density strata")
+
+    # tile x combination tasks, skipping rows of an earlier run
+    combos = list(product(sweep_grid["radius"], sweep_grid["vres"], sweep_grid["min_pts"]))
+    results_path = os.path.join(sweep_dir, TILE_RESULTS_CSV)
+    done = set()
+    if os.path.exists(results_path):
+        existing = read_tile_results(results_path)
+        if list(pd.read_csv(results_path, nrows=0).columns) != TILE_COLUMNS:
+            existing.to_csv(results_path, index=False)   # file of before the status column
+        done = set(existing.loc[existing["status"] != "failed", KEY_COLUMNS].itertuples(index=False, name=None))
+
+    todo = [(tile.tile_id, idx, combo)
+            for tile in sample.sort_values("veg_points", ascending=False).itertuples()
+            for idx, combo in enumerate(combos)
+            if (tile.tile_id, *combo) not in done]
+    # input hash / point count once per tile, not once per run
+    inputs = {tile_id: input_stats(os.path.join(case_dir, "tiles", tile_id, "vegetation.XYZ"))
+              for tile_id in dict.fromkeys(tile_id for tile_id, _, _ in todo)}
+    tasks = [(tile_id, idx, combo, core_bounds[tile_id], case_dir, sweep_dir, inputs[tile_id])
+             for tile_id, idx, combo in todo]
+    logger.info(f"{len(tasks)} tile x combination tasks ({len(done)} done before)")
+
+    # rows are appended as they finish, so an interrupted sweep keeps its results
+    # (a task that raises only fails its own row)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_tile_task, task): task for task in tasks}
+        for fut in as_completed(futures):
+            try:
+                row = fut.result()
+            except Exception:
+                tile_id, _, combo = futures[fut][:3]
+                logger.exception(f"[{tile_id}] Task failed for R={combo[0]} Vres={combo[1]} minP={combo[2]}")
+                row = failed_row(tile_id, combo, "failed")
+            pd.DataFrame([row]).reindex(columns=TILE_COLUMNS).to_csv(results_path, mode="a", index=False,
+                                                                     header=not os.path.exists(results_path))
+
+    if not os.path.exists(results_path):
+        logger.error("No tile results")
+        return None
+
+    tile_results = read_tile_results(results_path)
+    ok = tile_results[tile_results["status"] == "ok"]
+    if ok.empty:
+        logger.error("No tile results")
+        return None
+    combo_results = aggregate(tile_results, sample)
+    combo_results.to_csv(os.path.join(sweep_dir, COMBO_RESULTS_CSV), index=False)
+
+    breakdown = ok.assign(one_to_one=100 * ok["muni_one_to_one"] / ok["N_muni"])
+    breakdown.pivot_table(index=["R", "Vres", "minP"], columns="tile_id", values="one_to_one").to_csv(
+        os.path.join(sweep_dir, TILE_BREAKDOWN_CSV))
+
+    best = combo_results.iloc[0]
+    logger.info(f"Best combination: R={best['R']} Vres={best['Vres']} minP={best['minP']} "
+                f"({best['one_to_one']:.1f}% one-to-one, tiles {best['tile_one_to_one_min']:.1f}-"
+                f"{best['tile_one_to_one_max']:.1f}%)")
+    return combo_results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python tile_sweep.py <case_dir> <num_workers> [n_tiles] [sweep_name]")
+        sys.exit(1)
+
+    set_start_method("spawn")
+    run_tile_sweep(
+        case_dir=sys.argv[1],
+        num_workers=int(sys.argv[2]),
+        n_tiles=int(sys.argv[3]) if len(sys.argv) > 3 else 12,
+        sweep_name=sys.argv[4] if len(sys.argv) > 4 else "tile_sweep",
+    )
@@ -0,0 +1,94 @@
+# hull_overlap.py
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# ---------------------------------------------------------------------------
+# Hull overlap engine
+# ---------------------------------------------------------------------------
+# Over-segmentation metrics compare every H1/H2/H3/H4+ hull (hulls holding 1,
+# 2, 3, 4+ municipality trees) with the H0 hulls (no municipality tree). The
+# H0 hulls go into one STRtree and all other hulls are queried in one call, so
+# the candidate pairs come back as two index arrays. Counts are bincounts over
+# those arrays and intersection areas are computed vectorized over the pairs.
+
+OS_CLASSES = [("OS1", 1), ("OS2", 2), ("OS3", 3), ("OS4p", 4)]   # (metric prefix, muni points per hull; 4 = 4 or more)
+
+
+def overlap_pairs(geoms_a, geoms_b, with_area=False):
+    """
+    All intersecting pairs between two hull arrays.
+
+    Parameters:
+    - geoms_a, geoms_b (array-like of shapely geometries)
+    - with_area (bool): also return the intersection area per pair
+
+    Returns:
+    - ia, ib (np.ndarray): indices into geoms_a / geoms_b, one entry per pair
+    - area (np.ndarray, only if with_area)
+    """
+    geoms_a = np.asarray(geoms_a, dtype=object)
+    geoms_b = np.asarray(geoms_b, dtype=object)
+    if len(geoms_a) == 0 or len(geoms_b) == 0:
+        ia = ib = np.empty(0, dtype=np.intp)
+    else:
+        ia, ib = STRtree(geoms_b).query(geoms_a, predicate="intersects")
+
+    if not with_area:
+        return ia, ib
+    return ia, ib, shapely.area(shapely.intersection(geoms_a[ia], geoms_b[ib]))
+
+
+def overlaps_by_index(hulls_a, hulls_b):
+    """{index in hulls_a: [indices in hulls_b it intersects]} for two GeoDataFrames."""
+    ia, ib = overlap_pairs(hulls_a.geometry.values, hulls_b.geometry.values)
+    if len(ia) == 0:
+        return {}
+    order = np.lexsort((ib, ia))
+    keys, starts = np.unique(ia[order], return_index=True)
+    groups = np.split(hulls_b.index.values[ib[order]], starts[1:])
+    return {hulls_a.index.values[k]: list(g) for k, g in zip(keys, groups)}
+
+
+def oversegmentation_metrics(hulls_gdf, points_per_hull):
+    """
+    OS1 .. OS4p metrics of one segmentation.
+
+    Parameters:
+    - hulls_gdf (GeoDataFrame): all hulls
+    - points_per_hull (array-like): municipality trees inside each hull (same order)
+
+    Returns:
+    - dict with, per class k in OS1, OS2, OS3, OS4p: "<k>" (hulls of the class
+      overlapping at least one H0) and "<k>_avg_count" (mean number of H0s per
+      overlapping hull), plus "OS_H1H0_overlap_ratio_mean" (mean share of the H0
+      area covered, over all H1-H0 pairs)
+    """
+    geoms = np.asarray(hulls_gdf.geometry.values, dtype=object)
+    n_points = np.asarray(points_per_hull)
+
+    h0 = np.flatnonzero(n_points == 0)
+    hx = np.flatnonzero(n_points > 0)
+    ia, ib = overlap_pairs(geoms[hx], geoms[h0])
+
+    # H0 overlaps per hull, then per class among the hulls with any overlap
+    n_overlaps = np.bincount(ia, minlength=len(hx))
+    hx_class = np.minimum(n_points[hx], 4)
+
+    metrics = {}
+    for name, k in OS_CLASSES:
+        counts = n_overlaps[(hx_class == k) & (n_overlaps > 0)]
+        metrics[name] = int(len(counts))
+        metrics[f"{name}_avg_count"] = float(counts.mean()) if len(counts) else 0.0
+
+    # share of each H0 covered by the H1 it overlaps
+    is_h1 = hx_class[ia] == 1
+    h1_geoms, h0_geoms = geoms[hx[ia[is_h1]]], geoms[h0[ib[is_h1]]]
+    h0_area = shapely.area(h0_geoms)
+    valid = h0_area > 0
+    if valid.any():
+        inter = shapely.area(shapely.intersection(h1_geoms[valid], h0_geoms[valid]))
+        metrics["OS_H1H0_overlap_ratio_mean"] = float(np.mean(inter / h0_area[valid]))
+    else:
+        metrics["OS_H1H0_overlap_ratio_mean"] = 0.0
+    return metrics
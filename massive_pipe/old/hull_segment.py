@@ -1,19 +1,28 @@
 import os
 import sys
-import subprocess
-import time
 from itertools import product
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 import laspy
+import shapely
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, box
-from shapely.ops import unary_union
+from shapely.geometry import box
 from tqdm import tqdm
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label, concave_hulls_by_label
+from muni_index import load_muni_index
+from hull_store import hull_path, find_hulls, read_hulls, write_hulls
+from hull_overlap import overlap_pairs, overlaps_by_index, oversegmentation_metrics
+from hull_labelling import label_hulls
+from sampled_metrics import StratifiedSample, escalation_candidates
+from sweep_pool import run_sweep, run_adaptive_sweep, worker_state, dedupe_key_for
+from param_search import AdaptiveGridSearch, successive_halving
+from thinning import thinned_xyz
+from run_meta import run_segmenter, record_output, input_stats, meta_path
+from las_table import point_count
+from results_store import RESULTS_DB, ResultsStore
 
 logger = None
 
@@ -21,57 +30,332 @@ logger = None
 # Helper functions
 # ---------------------------------------------------------------------------
 
-def load_forest_gdf(laz_file_path):
-    """Load entire forest LAS/LAZ into a GeoDataFrame (EPSG:28992)."""
-    with laspy.open(laz_file_path) as las:
-        pts   = las.read()
-        scale = las.header.scales
-        off   = las.header.offsets
-        X = pts.X * scale[0] + off[0]
-        Y = pts.Y * scale[1] + off[1]
-        Z = pts.Z * scale[2] + off[2]
-        attrs = {d.name: np.asarray(getattr(pts, d.name)) for d in pts.point_format}
-        df = pd.DataFrame(attrs)
-        df["geometry"] = [Point(x, y, z) for x, y, z in zip(X, Y, Z)]
-        return gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:28992")
-
 def get_bbox_from_las(las_path):
     with laspy.open(las_path) as f:
         mn, mx = f.header.min, f.header.max
     return box(mn[0], mn[1], mx[0], mx[1])
 
-def compute_tree_convex_hulls(gdf, idx=None):
+def compute_tree_convex_hulls(seg_df, idx=None, crs="EPSG:28992"):
     """Convex hull per tree_id (skip groups with <3 pts)."""
-    hulls = []
-    for tid, grp in gdf.groupby("tree_id"):
-        if len(grp) < 3:
-            logger.warning("Iter %s: tree %s < 3 pts, skip", idx, tid)
-            continue
-        hulls.append({"tree_id": tid, "geometry": unary_union(grp.geometry).convex_hull})
-    return gpd.GeoDataFrame(hulls, crs=gdf.crs)
+    tids, hulls, skipped = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values)
+    for tid in skipped:
+        logger.warning("Iter %s: tree %s < 3 pts, skip", idx, tid)
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
+
+def compute_tree_concave_hulls(seg_df, idx=None, crs="EPSG:28992", concave_params=None):
+    """Concave crown outline per tree_id (skip groups with <3 pts)."""
+    params = {"ratio": 0.3, "max_points": 2000, **(concave_params or {})}
+    tids, hulls, skipped = concave_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values, **params)
+    for tid in skipped:
+        logger.warning("Iter %s: tree %s < 3 pts, skip", idx, tid)
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
 
 def compute_overlaps_with_H0s(hulls_HX, hulls_H0):
     """Returns: dict of HX_idx : list of overlapping H0 indices"""
-    result = {}
-    for hx_idx, hx_geom in hulls_HX.geometry.items():
-        overlaps = hulls_H0[hulls_H0.geometry.intersects(hx_geom)]
-        if not overlaps.empty:
-            result[hx_idx] = list(overlaps.index)
+    return overlaps_by_index(hulls_HX, hulls_H0)
+
+# ---------------------------------------------------------------------------
+# Hull metrics (exact / sampled)
+# ---------------------------------------------------------------------------
+
+def hull_metrics(hulls_gdf, public_trees, add_attr_to_geojson=False):
+    """Exact muni, H-class and over-segmentation metrics of one hull layer."""
+    # one STRtree query of all muni points against all hulls (see hull_labelling.py)
+    hull_table, hulls_per_point = label_hulls(hulls_gdf.geometry.values, public_trees.geometry.values)
+    points_per_hull = hull_table["n_points"].to_numpy()
+    class_counts = hull_table["muni_class"].value_counts()
+
+    if add_attr_to_geojson:
+        hulls_gdf["muni_class"] = hull_table["muni_class"].values
+        hulls_gdf["multi"] = points_per_hull > 1
+
+    # all HX-H0 overlaps in one STRtree query (OS1..OS4p, H1-H0 overlap ratio)
+    os_metrics = oversegmentation_metrics(hulls_gdf, points_per_hull)
+
+    return {
+        "muni_skip": int((hulls_per_point == 0).sum()),   # public trees that were not matched
+
+        # Hull classification counts
+        "H0": int(class_counts.get("H0", 0)),     # no muni point
+        "H1": int(class_counts.get("H1", 0)),     # 1 muni point
+        "H2": int(class_counts.get("H2", 0)),     # 2 muni points
+        "H3": int(class_counts.get("H3", 0)),     # 3 muni points
+        "H4+": int(class_counts.get("H4+", 0)),   # 4 or more muni points
+        "Hmulti": int((points_per_hull > 1).sum()),   # >1 muni point (H2, H3, H4+)
+
+        # Oversegmentation indicators
+        "OS1": os_metrics["OS1"],                         # H1 hulls overlapping with H0s
+        "OS1_avg_count": os_metrics["OS1_avg_count"],     # avg # of H0s per overlapping H1
+        "OS2": os_metrics["OS2"],                         # H2 hulls overlapping with H0s
+        "OS2_avg_count": os_metrics["OS2_avg_count"],     # avg # of H0s per overlapping H2
+        "OS3": os_metrics["OS3"],                         # H3 hulls overlapping with H0s
+        "OS3_avg_count": os_metrics["OS3_avg_count"],     # avg # of H0s per overlapping H3
+        "OS4p": os_metrics["OS4p"],                       # H4+ hulls overlapping with H0s
+        "OS4p_avg_count": os_metrics["OS4p_avg_count"],   # avg # of H0s per overlapping H4+
+
+        "OS_shared_match": int((hulls_per_point > 1).sum()),   # muni points matched by multiple hulls
+        "OS_H1H0_overlap_ratio_mean": os_metrics["OS_H1H0_overlap_ratio_mean"],  # mean percentage of the H0 area that overlaps with H1's
+
+        "evaluation": "exact",
+        "sample_size": len(hulls_gdf),
+        "objective_ci": 0.0,
+    }
+
+
+def sampled_hull_metrics(hulls_gdf, public_trees, fraction, cell, unit_score):
+    """
+    H-class and OS counts of one hull layer estimated on a stratified sample
+    of hulls (see sampled_metrics.py), each with a 95% half-width (<metric>_ci).
+    Only the sampled hulls and the hulls they overlap are labelled. Metrics
+    that need every hull or tree (muni_skip, OS_shared_match, OS averages,
+    H1-H0 overlap ratio) are left empty until the exact evaluation.
+    """
+    geoms = np.asarray(hulls_gdf.geometry.values, dtype=object)
+    centroids = shapely.centroid(geoms)
+    sample = StratifiedSample(shapely.get_x(centroids), shapely.get_y(centroids), fraction, cell)
+
+    # muni points in the sampled hulls and their neighbours (pairs include the hull itself)
+    ia, ib = overlap_pairs(geoms[sample.index], geoms)
+    labelled = np.unique(ib)
+    n_points = np.full(len(geoms), -1, dtype=np.int64)
+    n_points[labelled] = label_hulls(geoms[labelled], public_trees.geometry.values)[0]["n_points"].to_numpy()
+
+    n = n_points[sample.index]
+    overlaps_h0 = (np.bincount(ia, weights=n_points[ib] == 0, minlength=sample.size) > 0) & (n > 0)
+    n_hulls = len(geoms)
+
+    metrics = {}
+    indicators = {"H0": n == 0, "H1": n == 1, "H2": n == 2, "H3": n == 3, "H4+": n >= 4, "Hmulti": n > 1,
+                  "OS1": overlaps_h0 & (n == 1), "OS2": overlaps_h0 & (n == 2),
+                  "OS3": overlaps_h0 & (n == 3), "OS4p": overlaps_h0 & (n >= 4)}
+    for name, flag in indicators.items():
+        share, half_width = sample.estimate(flag)
+        metrics[name] = round(share * n_hulls, 1)
+        metrics[f"{name}_ci"] = round(half_width * n_hulls, 1)
+
+    for name in ("muni_skip", "OS1_avg_count", "OS2_avg_count", "OS3_avg_count", "OS4p_avg_count",
+                 "OS_shared_match", "OS_H1H0_overlap_ratio_mean"):
+        metrics[name] = np.nan
+
+    _, objective_ci = sample.estimate(unit_score(n, overlaps_h0, n_hulls))
+    metrics.update(evaluation="sampled", sample_size=sample.size, objective_ci=objective_ci)
+    return metrics
+
+# ---------------------------------------------------------------------------
+# Sweep task (worker process)
+# ---------------------------------------------------------------------------
+
+def _load_hull_sweep_static(settings):
+    """Pool initializer payload: sweep settings + public trees inside the forest bbox, loaded once per worker."""
+    global logger
+    logger = setup_module_logger("2_hull_analysis", settings["data_dir"])
+
+    muni_index = load_muni_index(settings["municipality_geojson"])
+    public_trees = muni_index.to_gdf(muni_index.query_bbox(settings["forest_bounds"]))
+    return {**settings, "public_trees": public_trees}
+
+def _hull_task(args):
+    """One sweep combination (segmentation unless use_existing_geojsons + hull analysis), run in a worker process."""
+    s = worker_state()
+    data_dir, exe, input_xyz, output_dir = s["data_dir"], s["exe"], s["input_xyz"], s["output_dir"]
+    existing_combos, public_trees = s["existing_combos"], s["public_trees"]
+    total_public, total_points = s["total_public"], s["total_points"]
+    hull_type, hull_suffix, concave_params = s["hull_type"], s["hull_suffix"], s["concave_params"]
+    overwrite_existing_combos = s["overwrite_existing_combos"]
+    delete_segmentation_after_processing = s["delete_segmentation_after_processing"]
+    save_geojsons, use_existing_geojsons = s["save_geojsons"], s["use_existing_geojsons"]
+    add_attr_to_geojson = s["add_attr_to_geojson"]
+
+    # ------------------ Actual Segmentation ----------------------
+    (r, v, m), idx = args
+
+    if not overwrite_existing_combos and (r, v, m) in existing_combos:
+        return None
+
+    out_xyz = os.path.join(output_dir, f"segmentation_{idx:04d}.xyz")
+    hull_stem = f"segmentation_hulls{hull_suffix}_{idx}"
+    out_hulls = hull_path(output_dir, hull_stem)
+
+    # on a thinned cloud min_pts is scaled with the point density (scale_min_pts)
+    m_run = max(1, int(round(m * s["min_pts_scale"])))
+
+    if not use_existing_geojsons:
+        # the run record <out_xyz>.meta.json is completed from the loaded output below
+        success, runtime, meta = run_segmenter(exe, os.path.join(data_dir, input_xyz), out_xyz, r, v, m_run,
+                                               input_meta=s["input_meta"], scan=False)
+        if not success:
+            logger.error("Segmentation failed iter %d: return code %d", idx, meta["returncode"])
+            return None
+    else:
+        runtime = 0.0
+        logger.info("Using existing hulls for iteration %d", idx)
+
+        existing_hulls = find_hulls(output_dir, hull_stem)
+        if existing_hulls is None:
+            logger.error("Existing hulls not found for iteration %d", idx)
+            return None
+
+
+    # ------------------ Unpack xyz to geopandas ---------------------------
+    if not use_existing_geojsons:
+        seg_df = pd.read_csv(out_xyz, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
+        record_output(out_xyz, meta, seg_df["tree_id"].to_numpy())
+        if hull_type == "concave":
+            hulls_gdf = compute_tree_concave_hulls(seg_df, idx, concave_params=concave_params)
+        else:
+            hulls_gdf = compute_tree_convex_hulls(seg_df, idx)
+        pointcloud_loss_pct = 100 * (1 - len(seg_df) / total_points)
+
+        if hulls_gdf.empty:
+            os.remove(out_xyz)
+            return None
+    else:
+        hulls_gdf = read_hulls(existing_hulls)
+        hulls_gdf["tree_id"] = hulls_gdf["tree_id"].astype(int)
+        pointcloud_loss_pct = np.nan
+
+
+    # Muni point features / hull classes / over-segmentation ------------
+    if s["evaluation"] == "sampled":
+        metrics = sampled_hull_metrics(hulls_gdf, public_trees, s["sample_fraction"], s["sample_cell"],
+                                       HULL_UNIT_SCORES[s["objective"]])
+    else:
+        metrics = hull_metrics(hulls_gdf, public_trees, add_attr_to_geojson)
+
+    # writing and saving/deleting -----------------------
+    result = {
+        # Run identification
+        "it_id": idx,
+        "R": r,
+        "Vres": v,
+        "minP": m,
+        "fidelity": s["fidelity"],   # share of the point cloud segmented
+        "runtime": round(runtime, 2),
+        "Pcd_loss": round(pointcloud_loss_pct, 2),
+
+        # Tree counts
+        "N_muni": total_public,           # known public trees in area
+        "N_hulls": len(hulls_gdf),        # total hulls generated
+        **metrics,
+    }
+
+
+    # save geojsons if requested (sampled runs keep them for the exact evaluation)
+    if save_geojsons or (s["evaluation"] == "sampled" and not use_existing_geojsons):
+        write_hulls(hulls_gdf, out_hulls)
+
+    # clean up .xyz if requested
+    if delete_segmentation_after_processing:
+        try:
+            os.remove(out_xyz)
+        except OSError:
+            pass
+
     return result
 
+def _escalate_task(args):
+    """Exact metrics of one combination evaluated on a sample, from the hulls it kept (worker process)."""
+    s = worker_state()
+    (r, v, m), idx = args
+    hulls_file = find_hulls(s["output_dir"], f"segmentation_hulls{s['hull_suffix']}_{idx}")
+    if hulls_file is None:
+        logger.error("Hulls of iteration %d not found, cannot evaluate it exactly", idx)
+        return None
+
+    hulls_gdf = read_hulls(hulls_file)
+    metrics = hull_metrics(hulls_gdf, s["public_trees"], s["add_attr_to_geojson"])
+    if s["save_geojsons"]:
+        write_hulls(hulls_gdf, hulls_file)
+    elif not s["use_existing_geojsons"]:
+        os.remove(hulls_file)
+    return {"R": r, "Vres": v, "minP": m, **metrics}
+
+def _clean_level_dir(level_dir, stems, keep_hulls, keep_runs):
+    """
+    Remove the files a finished lower fidelity level left for the given
+    iteration stems: the hulls kept by sampled evaluation (only full-density
+    combinations are escalated) unless keep_hulls, and the run records unless
+    keep_runs. The level dir itself is removed once it is empty.
+    """
+    for hull_stem, xyz_name in stems:
+        paths = []
+        if not keep_hulls:
+            paths.append(find_hulls(level_dir, hull_stem))
+        if not keep_runs:
+            paths.append(meta_path(os.path.join(level_dir, xyz_name)))
+        for path in paths:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+    try:
+        os.rmdir(level_dir)
+    except OSError:   # kept segmentations / hulls (or another sweep's files)
+        pass
+
 # ---------------------------------------------------------------------------
 # Main sweep
 # ---------------------------------------------------------------------------
 
+# objectives for search="adaptive" (maximized, computed from a result row)
+HULL_OBJECTIVES = {
+    "h1_minus_overseg": lambda row: row["H1"] - (row["OS1"] + row["OS2"] + row["OS3"] + row["OS4p"]),
+    "h1": lambda row: row["H1"],
+    "h1_share": lambda row: row["H1"] / max(row["N_hulls"], 1),
+}
+
+# the same objectives as per-hull scores whose mean is the objective, for the
+# confidence interval of evaluation="sampled" (n: muni points in the hull,
+# overlaps_h0: the hull holds muni points and overlaps an H0, n_hulls: N_hulls)
+HULL_UNIT_SCORES = {
+    "h1_minus_overseg": lambda n, overlaps_h0, n_hulls: n_hulls * ((n == 1).astype(float) - overlaps_h0),
+    "h1": lambda n, overlaps_h0, n_hulls: n_hulls * (n == 1).astype(float),
+    "h1_share": lambda n, overlaps_h0, n_hulls: (n == 1).astype(float),
+}
+
 def run_hull_analysis(data_dir, exe, input_xyz, output_dir,
                 radius_vals, vres_vals, min_pts_vals, municipality_geojson,
                 forest_las_name, csv_name="hull_analysis.csv", cores=4,
                 overwrite_existing_combos=False,
                 delete_segmentation_after_processing=False,
                 save_geojsons=False,
-                use_existing_geojsons=False, add_attr_to_geojson=False):
-
-    """Run segmentation parameter sweep in parallel and log per‑iteration stats."""
+                use_existing_geojsons=False, add_attr_to_geojson=False,
+                hull_type="convex", concave_params=None,
+                search="grid", objective="h1_minus_overseg", search_budget=None,
+                fidelities=(0.15, 0.5, 1.0), halving_keep=0.25, thin_method="voxel", scale_min_pts=True,
+                evaluation="exact", sample_fraction=0.1, sample_cell=50.0, pool=None):
+
+    """
+    Run segmentation parameter sweep in parallel and log per‑iteration stats.
+    hull_type: "convex" or "concave" (crown outlines, see concave_params:
+    ratio / max_points / num_workers); concave hull files get a _concave suffix.
+    Per-iteration hulls (save_geojsons / use_existing_geojsons) go through the
+    hull store (GeoParquet); existing .geojson iterations are still read.
+    Combinations run in `cores` worker processes (also for use_existing_geojsons).
+    Results go to the sweep results store (data_dir/sweep_results.sqlite, one
+    row per combination, rerun combinations replace their row); csv_name is
+    exported from it when the sweep ends.
+    search: "grid" runs every combination; "adaptive" proposes the next
+    combinations from the finished results (param_search.AdaptiveGridSearch)
+    to maximize objective (a HULL_OBJECTIVES name or a row -> float callable),
+    with at most search_budget segmentation runs; "halving" runs every
+    combination on a thinned input (fidelities[0], thinning.thinned_xyz with
+    thin_method) and only the best halving_keep share at each next fidelity
+    (param_search.successive_halving). With scale_min_pts, min_pts is scaled
+    with the fidelity on thinned levels. Results are stored per fidelity; lower
+    levels go to <csv stem>_f<fidelity>.csv and their files to
+    output_dir/fidelity_<fidelity>.
+    evaluation: "exact" computes the metrics from all hulls; "sampled"
+    estimates the H-class and OS counts on a stratified sample of
+    sample_fraction of the hulls (sample_cell m grid strata, see
+    sampled_metrics.py) with 95% half-widths (<metric>_ci, objective_ci), and
+    when the sweep ends evaluates exactly only the full-density combinations
+    whose objective interval overlaps the best one (their hulls are kept until
+    then). Sampled evaluation needs a named objective.
+    pool: a sweep_pool.SweepSpec to run the combinations on a scheduler shared
+    with other sweeps (sweep_pool.run_sweeps) instead of an own pool of
+    `cores`; combinations that another sweep of the scheduler segments from
+    the same input with the same settings and output dir are then run only
+    once (exact evaluation only).
+    """
 
     # ----------------------- logging / paths -------------------
     global logger
@@ -82,273 +366,168 @@ def run_hull_analysis(data_dir, exe, input_xyz, output_dir,
     logger.info("=" * 60 + "Hull Analysis")
     logger.info("[run_hull_analysis] Preprocessing function called")
 
+    if hull_type not in ("convex", "concave"):
+        raise ValueError(f"Unknown hull_type '{hull_type}'")
+    if search not in ("grid", "adaptive", "halving"):
+        raise ValueError(f"Unknown search '{search}'")
+    if search == "halving" and use_existing_geojsons:
+        raise ValueError("search='halving' segments thinned clouds, it cannot use existing hulls")
+    if evaluation not in ("exact", "sampled"):
+        raise ValueError(f"Unknown evaluation '{evaluation}'")
+    if evaluation == "sampled" and objective not in HULL_UNIT_SCORES:
+        raise ValueError("evaluation='sampled' needs one of the objectives " + ", ".join(HULL_UNIT_SCORES))
+    hull_suffix = "" if hull_type == "convex" else "_concave"
+
     os.makedirs(output_dir, exist_ok=True)
     csv_path = os.path.join(data_dir, csv_name)
 
     # ----------------------- Muni data (static) ----------------------
-    muni_gdf = gpd.read_file(municipality_geojson).to_crs("EPSG:28992")
+    muni_index = load_muni_index(municipality_geojson)
     forest_bbox = get_bbox_from_las(os.path.join(data_dir, forest_las_name))
-    public_trees = muni_gdf[muni_gdf.within(forest_bbox)].reset_index(drop=True)
+    public_trees = muni_index.to_gdf(muni_index.query_bbox(forest_bbox.bounds))
 
     total_public = len(public_trees)
-    total_points = load_forest_gdf(os.path.join(data_dir, forest_las_name)).shape[0]
+    total_points = point_count(os.path.join(data_dir, forest_las_name))   # LAS header only
 
     logger.info("Public trees inside bbox: %d", total_public)
 
     combos = list(product(radius_vals, vres_vals, min_pts_vals))
 
-    # ----------------------- CSV init -------------------------
+    # ----------------------- results store -------------------------
     header = [
         "it_id", "R", "Vres", "minP", "runtime",
         "Pcd_loss", "N_muni", "muni_skip", "N_hulls",
         "H0", "H1", "H2", "H3", "H4+", "Hmulti",
         "OS1", "OS1_avg_count", "OS2", "OS2_avg_count",
         "OS3", "OS3_avg_count", "OS4p", "OS4p_avg_count",
-        "OS_shared_match","OS_H1H0_overlap_ratio_mean"
+        "OS_shared_match","OS_H1H0_overlap_ratio_mean",
+        "evaluation", "sample_size", "objective_ci",
+        "H0_ci", "H1_ci", "H2_ci", "H3_ci", "H4+_ci", "Hmulti_ci",
+        "OS1_ci", "OS2_ci", "OS3_ci", "OS4p_ci",
     ]
 
-    if not os.path.exists(csv_path):
-        pd.DataFrame(columns=header).to_csv(csv_path, index=False)
-
-    try:
-        df_existing = pd.read_csv(csv_path)
-        existing_combos = set(zip(df_existing["R"], df_existing["Vres"], df_existing["minP"]))
-
-    except Exception:
-        existing_combos = set()
-
-    # ----------------------- Running a single task-----------------------
-    def run_task(args):
-        # ------------------ Actual Segmentation ----------------------
-        (r, v, m), idx = args
-
-        if not overwrite_existing_combos and (r, v, m) in existing_combos:
+    store = ResultsStore(
+        os.path.join(data_dir, RESULTS_DB),
+        table=os.path.splitext(csv_name)[0],
+        dataset=os.path.basename(os.path.normpath(data_dir)),
+        engine=os.path.basename(exe),
+        key_columns=("R", "Vres", "minP"),
+    )
+    imported = store.import_csv(csv_path)   # results of runs from before the store
+    if imported:
+        logger.info("Imported %d rows from %s into the results store", imported, csv_path)
+    existing_combos = store.done()
+
+
+    # ----------------------- run workers ----------------------
+    # analysis runs in worker processes; each worker loads the static data once
+    settings = {
+        "data_dir": data_dir, "exe": exe, "input_xyz": input_xyz, "output_dir": output_dir,
+        # hashed once, not in every run (none needed for existing hulls)
+        "input_meta": None if use_existing_geojsons else input_stats(os.path.join(data_dir, input_xyz)),
+        "existing_combos": existing_combos,
+        "municipality_geojson": municipality_geojson, "forest_bounds": forest_bbox.bounds,
+        "total_public": total_public, "total_points": total_points,
+        "hull_type": hull_type, "hull_suffix": hull_suffix, "concave_params": concave_params,
+        "overwrite_existing_combos": overwrite_existing_combos,
+        "delete_segmentation_after_processing": delete_segmentation_after_processing,
+        "save_geojsons": save_geojsons, "use_existing_geojsons": use_existing_geojsons,
+        "add_attr_to_geojson": add_attr_to_geojson, "fidelity": 1.0, "min_pts_scale": 1.0,
+        "evaluation": evaluation, "sample_fraction": sample_fraction, "sample_cell": sample_cell,
+        "objective": objective if isinstance(objective, str) else None,
+    }
+    desc = "geojson analysis" if use_existing_geojsons else "Segment + Analysis"
+
+    # iteration ids are the grid position in every search mode
+    grid_index = {combo: idx for idx, combo in enumerate(combos)}
+
+    def dedupe_key(task_settings):
+        # only segmentation runs are shared between sweeps; sampled runs keep
+        # their hulls for the escalation, which every sweep runs (and cleans up)
+        # on its own, so only exact runs are shared
+        if pool is None or use_existing_geojsons or evaluation == "sampled":
             return None
+        return dedupe_key_for(os.path.join(data_dir, task_settings["input_xyz"]), task_settings)
 
-        out_xyz = os.path.join(output_dir, f"segmentation_{idx:04d}.xyz")
-        out_geojson = os.path.join(output_dir, f"segmentation_hulls_{idx}.geojson")
-
-        cmd = [exe, os.path.join(data_dir, input_xyz), out_xyz, str(r), str(v), str(m)]
+    def own_id(upsert):
+        # a result shared with another sweep (dedupe) carries that sweep's iteration id
+        return lambda res: upsert({**res, "it_id": grid_index[(res["R"], res["Vres"], res["minP"])]})
 
-        if not use_existing_geojsons:
-            start = time.time()
-            try:
-                subprocess.run(cmd, check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            except subprocess.CalledProcessError as e:
-                logger.error("Segmentation failed iter %d: %s", idx, e)
-                return None
-            runtime = time.time() - start
-        else:
-            runtime = 0.0
-            logger.info("Using existing geojson for iteration %d", idx)
-
-            if not os.path.exists(out_geojson):
-                logger.error("Existing geojson not found for iteration %d", idx)
-                return None
-
-
-        # ------------------ Unpack xyz to geopandas ---------------------------
-        if not use_existing_geojsons:
-            seg_df = pd.read_csv(out_xyz, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
-            seg_gdf = gpd.GeoDataFrame(seg_df, geometry=gpd.points_from_xy(seg_df.x, seg_df.y), crs="EPSG:28992")
-            hulls_gdf = compute_tree_convex_hulls(seg_gdf, idx)
-            pointcloud_loss_pct = 100 * (1 - len(seg_df) / total_points)
-
-            if hulls_gdf.empty:
-                os.remove(out_xyz)
-                return None
-        else:
-            hulls_gdf = gpd.read_file(out_geojson)
-            hulls_gdf = hulls_gdf.to_crs("EPSG:28992")
-            hulls_gdf["tree_id"] = hulls_gdf["tree_id"].astype(int)
-            pointcloud_loss_pct = np.nan
-
-
-        # Muni point features --------------------------------
-        muni_in_hull = gpd.sjoin(hulls_gdf, public_trees[["geometry"]], predicate="contains", how="left")
-        muni_in_hull = muni_in_hull[~muni_in_hull["index_right"].isna()]
-
-        
-        # Keep NaNs so we can count hulls with 0 muni points
-        points_per_hull = muni_in_hull.groupby(level=0).size()
-        points_per_hull = points_per_hull.reindex(hulls_gdf.index, fill_value=0)
-
-
-        # Muni points not in any hull
-        all_muni_idxs = set(public_trees.index)
-        matched_muni_idxs = set(muni_in_hull["index_right"].dropna().astype(int))
-        
-        p_skip = len(all_muni_idxs - matched_muni_idxs)
-
-
-
-        # Convex hull features -------------------------------
-
-        # hulls class separation
-        H0 = hulls_gdf.loc[points_per_hull[points_per_hull == 0].index]
-        H1 = hulls_gdf.loc[points_per_hull[points_per_hull == 1].index]
-        H2 = hulls_gdf.loc[points_per_hull[points_per_hull == 2].index]
-        H3 = hulls_gdf.loc[points_per_hull[points_per_hull == 3].index]
-        H4plus = hulls_gdf.loc[points_per_hull[points_per_hull >= 4].index]
-
-        Hmulti = hulls_gdf.loc[points_per_hull[points_per_hull > 1].index]
-
-        if add_attr_to_geojson:
-            # Default to H0 (no muni points inside)
-            hulls_gdf["muni_class"] = ""
-            hulls_gdf["multi"] = False
-
-            # Set H0 where no muni points are inside
-            class_map = {
-                "H0": H0.index,
-                "H1": H1.index,
-                "H2": H2.index,
-                "H3": H3.index,
-                "H4+": H4plus.index,
-            }
-            for label, idxs in class_map.items():
-                hulls_gdf.loc[idxs, "muni_class"] = label
-
-            # Set multi where more than one muni point is inside
-            hulls_gdf.loc[Hmulti.index, "multi"] = True
-
-
-        # over-segmentation
-        
-        # hulls with exactly 1 muni point and overlap with empty hulls
-
-        # Compute and log overlaps for each class
-        H1H0_intersection_dict = compute_overlaps_with_H0s(H1, H0) # {H1_idx: [H0_idx,...], ...}
-        H2H0_intersection_dict = compute_overlaps_with_H0s(H2, H0)
-        H3H0_intersection_dict = compute_overlaps_with_H0s(H3, H0)
-        H4pH0_intersection_dict = compute_overlaps_with_H0s(H4plus, H0)
-
-
-        OS1_tree = len(H1H0_intersection_dict)
-        vals1 = [len(v) for v in H1H0_intersection_dict.values()]
-        OS1_per_tree_avg = np.mean(vals1) if vals1 else 0.0
-
-        OS1_per_tree_avg = np.mean([len(v) for v in H1H0_intersection_dict.values()])
-
-        OS2_tree = len(H2H0_intersection_dict)
-        vals2 = [len(v) for v in H2H0_intersection_dict.values()]
-        OS2_per_tree_avg = np.mean(vals2) if vals2 else 0.0
-
-        OS3_tree = len(H3H0_intersection_dict)
-        vals3 = [len(v) for v in H3H0_intersection_dict.values()]
-        OS3_per_tree_avg = np.mean(vals3) if vals3 else 0.0
-
-        OS4p_tree = len(H4pH0_intersection_dict)
-        vals4 = [len(v) for v in H4pH0_intersection_dict.values()]
-        OS4p_per_tree_avg = np.mean(vals4) if vals4 else 0.0
-
-
-
-        # Hulls that share muni point
-        overseg_by_shared_point = muni_in_hull["index_right"].value_counts()
-        shared_muni_matches = (overseg_by_shared_point > 1).sum()
-
-        # Compute overlap % of H0 area for each H1-H0 overlap
-        overlap_ratios = []
-        for h1_idx, h0_indices in H1H0_intersection_dict.items():
-            h1_geom = H1.loc[h1_idx].geometry
-            for h0_idx in h0_indices:
-                h0_geom = H0.loc[h0_idx].geometry
-                intersection_area = h1_geom.intersection(h0_geom).area
-                h0_area = h0_geom.area
-                if h0_area > 0:
-                    overlap_ratios.append(intersection_area / h0_area)
-
-        # Aggregate overlap ratios (only if any were computed)
-        if overlap_ratios:
-            OS_H1H0_overlap_ratio_mean = float(np.mean(overlap_ratios))
+    # every result is committed to the store as it completes; the CSV is exported
+    # at the end, also when the sweep is interrupted
+    try:
+        if search == "grid":
+            tasks = [((r, v, m), idx) for idx, (r, v, m) in enumerate(combos)]
+            run_sweep(_hull_task, tasks, _load_hull_sweep_static, (settings,), workers=cores,
+                      desc=desc, on_result=own_id(store.upsert), pool=pool, dedupe_key=dedupe_key(settings))
+        elif search == "halving":
+            score = HULL_OBJECTIVES[objective] if isinstance(objective, str) else objective
+
+            def run_level(fidelity, level_combos):
+                level_store = store.at_fidelity(fidelity)
+                level_settings = {**settings, "fidelity": fidelity, "existing_combos": level_store.done()}
+                if fidelity < 1.0:
+                    level_xyz, level_points = thinned_xyz(data_dir, input_xyz, fidelity, thin_method)
+                    level_dir = os.path.join(output_dir, f"fidelity_{fidelity:g}")
+                    os.makedirs(level_dir, exist_ok=True)
+                    level_settings.update(input_xyz=level_xyz, total_points=level_points, output_dir=level_dir,
+                                          input_meta=input_stats(os.path.join(data_dir, level_xyz)),
+                                          min_pts_scale=fidelity if scale_min_pts else 1.0)
+
+                tasks = [(combo, grid_index[combo]) for combo in level_combos]
+                run_sweep(_hull_task, tasks, _load_hull_sweep_static, (level_settings,), workers=cores,
+                          desc=f"{desc} @ {fidelity:g}", on_result=own_id(level_store.upsert),
+                          pool=pool, dedupe_key=dedupe_key(level_settings))
+                if fidelity < 1.0:
+                    level_store.export_csv(os.path.join(data_dir, f"{os.path.splitext(csv_name)[0]}_f{fidelity:g}.csv"),
+                                           header + ["fidelity"])
+                    stems = [(f"segmentation_hulls{hull_suffix}_{idx}", f"segmentation_{idx:04d}.xyz") for _, idx in tasks]
+                    _clean_level_dir(level_settings["output_dir"], stems, keep_hulls=save_geojsons,
+                                     keep_runs=not delete_segmentation_after_processing)
+
+                wanted = set(level_combos)
+                rows = level_store.to_frame().to_dict("records")
+                return {key: row for row in rows if (key := (row["R"], row["Vres"], row["minP"])) in wanted}
+
+            for fidelity, results in successive_halving(combos, run_level, score, fidelities, halving_keep):
+                logger.info("Fidelity %g: %d combinations", fidelity, len(results))
         else:
-            OS_H1H0_overlap_ratio_mean = 0.0
-
-
-
-        # writing and saving/deleting -----------------------
-        result = {
-            # Run identification
-            "it_id": idx,
-            "R": r,
-            "Vres": v,
-            "minP": m,
-            "runtime": round(runtime, 2),
-            "Pcd_loss": round(pointcloud_loss_pct, 2),
-
-            # Tree counts
-            "N_muni": total_public,           # known public trees in area
-            "muni_skip": int(p_skip),         # public trees that were not matched
-            "N_hulls": len(hulls_gdf),        # total hulls generated
-
-            # Hull classification counts
-            "H0": len(H0),               # no muni point
-            "H1": len(H1),               # 1 muni point
-            "H2": len(H2),               # 2 muni points
-            "H3": len(H3),               # 3 muni points
-            "H4+": len(H4plus),          # 4 or more muni points
-            "Hmulti": len(Hmulti),       # >1 muni point (H2, H3, H4+)
-
-            # Oversegmentation indicators
-            "OS1": OS1_tree,                        # H1 hulls overlapping with H0s
-            "OS1_avg_count": OS1_per_tree_avg,      # avg # of H0s per overlapping H1
-            "OS2": OS2_tree,                        # H2 hulls overlapping with H0s
-            "OS2_avg_count": OS2_per_tree_avg,      # avg # of H0s per overlapping H2
-            "OS3": OS3_tree,                        # H3 hulls overlapping with H0s
-            "OS3_avg_count": OS3_per_tree_avg,      # avg # of H0s per overlapping H3
-            "OS4p": OS4p_tree,                      # H4+ hulls overlapping with H0s
-            "OS4p_avg_count": OS4p_per_tree_avg,    # avg # of H0s per overlapping H4+
-
-            "OS_shared_match": shared_muni_matches, # muni points matched by multiple hulls
-            "OS_H1H0_overlap_ratio_mean": OS_H1H0_overlap_ratio_mean # mean percentage of the H0 area that overlaps with H1's
-        }
-
-
-        # save geojsons if requested
-        if save_geojsons:
-            hulls_gdf.to_file(os.path.join(output_dir, f"segmentation_hulls_{idx}.geojson"), driver="GeoJSON")
-
-        # clean up .xyz if requested
-        if delete_segmentation_after_processing:
-            try:
-                os.remove(out_xyz)
-            except OSError:
-                pass
-
-        if overwrite_existing_combos:
-            # Remove any existing rows for this parameter combo
-            df_existing = pd.read_csv(csv_path)
-            mask = (df_existing["R"] == r) & (df_existing["Vres"] == v) & (df_existing["minP"] == m)
-            df_existing = df_existing[~mask]
-            df_existing.to_csv(csv_path, index=False)  # overwrite cleaned file
-
-        return result
-
-    # ----------------------- run threads ----------------------
-    tasks = [((r, v, m), idx) for idx, (r, v, m) in enumerate(combos)]
-
-    if use_existing_geojsons:
-        # Run in parallel for feature-only runs, using 1/4 of available cores
-        quarter_cores = max(1, cores // 4)  # At least 1 core
-        with ThreadPoolExecutor(max_workers=quarter_cores) as pool:
-            futures = [pool.submit(run_task, t) for t in tasks]
-            with tqdm(total=len(tasks), desc="geojson analysis", disable=not sys.stdout.isatty()) as bar:
-                for fut in as_completed(futures):
-                    res = fut.result()
-                    if res is not None:
-                        pd.DataFrame([res]).to_csv(csv_path, mode="a", index=False, header=False)
-                    bar.update(1)
-    else:
-        # Run in parallel for segmentation-intensive runs
-        with ThreadPoolExecutor(max_workers=cores) as pool:
-            futures = [pool.submit(run_task, t) for t in tasks]
-            with tqdm(total=len(tasks), desc="Segment + Analysis", disable=not sys.stdout.isatty()) as bar:
-                for fut in as_completed(futures):
-                    res = fut.result()
-                    if res is not None:
-                        pd.DataFrame([res]).to_csv(csv_path, mode="a", index=False, header=False)
-                    bar.update(1)
+            score = HULL_OBJECTIVES[objective] if isinstance(objective, str) else objective
+            searcher = AdaptiveGridSearch([radius_vals, vres_vals, min_pts_vals], score, budget=search_budget)
+            if not overwrite_existing_combos:
+                searcher.seed_rows(store.to_frame().to_dict("records"), ("R", "Vres", "minP"))
+            # iteration ids stay the grid position, as in the grid sweep
+            run_adaptive_sweep(_hull_task, searcher, lambda combo: (combo, searcher.index[combo]),
+                               _load_hull_sweep_static, (settings,), workers=cores,
+                               desc=desc, on_result=own_id(store.upsert), pool=pool, dedupe_key=dedupe_key(settings))
+            best, best_score = searcher.best_combo()
+            logger.info("Adaptive search: %d of %d combinations run, best %s (objective %s)",
+                        searcher.n_proposed, len(combos), best, best_score)
+
+        if evaluation == "sampled":
+            # exact metrics only for the combinations that may still be the best
+            score = HULL_OBJECTIVES[objective]
+            rows = {(row["R"], row["Vres"], row["minP"]): row for row in store.to_frame().to_dict("records")}
+            intervals = {key: (score(row), row["objective_ci"] if row.get("evaluation") == "sampled" else 0.0)
+                         for key, row in rows.items()}
+            escalate = [key for key in escalation_candidates(intervals) if rows[key].get("evaluation") == "sampled"]
+            logger.info("Sampled evaluation: %d of %d combinations overlap the best, evaluating them exactly",
+                        len(escalate), len(rows))
+
+            def on_exact(res):
+                row = {k: val for k, val in rows[(res["R"], res["Vres"], res["minP"])].items() if not k.endswith("_ci")}
+                store.upsert({**row, **res})
+
+            tasks = [(key, int(rows[key]["it_id"])) for key in escalate]
+            run_sweep(_escalate_task, tasks, _load_hull_sweep_static, (settings,), workers=cores,
+                      desc="Exact evaluation", on_result=on_exact, pool=pool)
+            if not save_geojsons and not use_existing_geojsons:
+                for key, row in rows.items():   # hulls kept by the combinations that stay sampled
+                    hulls_file = find_hulls(output_dir, f"segmentation_hulls{hull_suffix}_{int(row['it_id'])}")
+                    if key not in escalate and hulls_file is not None:
+                        os.remove(hulls_file)
+    finally:
+        store.export_csv(csv_path, header)
 
 
     logger.info("✅ Hull analysis finished — results written to %s", csv_path)
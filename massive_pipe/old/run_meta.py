@@ -0,0 +1,151 @@
+# run_meta.py
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+import numpy as np
+import pandas as pd
+
+# ---------------------------------------------------------------------------
+# Segmentation run metadata
+# ---------------------------------------------------------------------------
+# Every segmentation run writes <output>.xyz.meta.json next to its output:
+#
+#   {"params": {"radius": .., "vres": .., "min_pts": ..}, "exe": ..,
+#    "input": {"path": .., "blake2b": .., "points": ..},
+#    "runtime_s": .., "peak_rss_mb": .., "returncode": ..,
+#    "points_out": .., "clusters": ..,
+#    "cluster_sizes": {"edges": [1, 2, 4, ..], "counts": [..]}}
+#
+# Diagnostics and summaries read this record instead of parsing the
+# (multi-GB) text output. The input hash and point count are cached per input
+# file in <input>.meta.json, keyed by size / mtime, so they are computed once
+# per input and not once per run; sweeps compute them once in the parent and
+# pass them to every run (input_meta). Callers that load the output anyway
+# (hull sweeps) skip the scan of run_segmenter and complete the record from the
+# tree ids they loaded (record_output), so each output is parsed once. Outputs
+# without a record (older runs) are scanned once and get one written.
+
+META_SUFFIX = ".meta.json"
+READ_CHUNK = 2_000_000   # rows per chunk when scanning an output
+HASH_CHUNK = 8 << 20     # bytes per hash update
+
+
+def meta_path(path):
+    return path + META_SUFFIX
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_run_meta(xyz_path):
+    """Metadata record of a segmentation output, or None."""
+    try:
+        with open(meta_path(xyz_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def input_stats(path):
+    """{"path", "blake2b", "points"} of a segmentation input, cached in <input>.meta.json."""
+    st = os.stat(path)
+    cached = read_run_meta(path)
+    if cached and cached.get("size") == st.st_size and cached.get("mtime_ns") == st.st_mtime_ns:
+        return {"path": path, "blake2b": cached["blake2b"], "points": cached["points"]}
+
+    h = hashlib.blake2b(digest_size=20)
+    points = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+            points += chunk.count(b"\n")
+    _write_json(meta_path(path), {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                  "blake2b": h.hexdigest(), "points": points})
+    return {"path": path, "blake2b": h.hexdigest(), "points": points}
+
+
+def _size_summary(sizes):
+    """Record fields from the point count of every cluster."""
+    n_bins = int(np.log2(sizes.max())) + 1 if len(sizes) else 0
+    edges = [2 ** i for i in range(n_bins + 1)]
+    counts = np.histogram(sizes, bins=edges)[0] if len(sizes) else np.array([], dtype=np.int64)
+    return {"points_out": int(sizes.sum()), "clusters": int(len(sizes)),
+            "cluster_sizes": {"edges": edges, "counts": counts.tolist()}}
+
+
+def scan_output(xyz_path):
+    """Points, clusters and log2 cluster size histogram of a segmentation output (tree_id in column 0)."""
+    sizes = pd.Series(dtype=np.int64)
+    for chunk in pd.read_csv(xyz_path, sep=r"\s+", header=None, usecols=[0], chunksize=READ_CHUNK):
+        sizes = sizes.add(chunk[0].value_counts(), fill_value=0)
+    return _size_summary(sizes.to_numpy(dtype=np.int64))
+
+
+def record_output(output_path, meta, tree_ids):
+    """Complete the run record of run_segmenter(scan=False) from the output's tree ids (as loaded by the caller) and write it."""
+    meta.update(_size_summary(np.unique(np.asarray(tree_ids), return_counts=True)[1].astype(np.int64)))
+    _write_json(meta_path(output_path), meta)
+    return meta
+
+
+def output_stats(xyz_path):
+    """Points and clusters of a segmentation output, from its record (written now if missing)."""
+    meta = read_run_meta(xyz_path)
+    if meta is None or "points_out" not in meta:
+        meta = {**(meta or {}), **scan_output(xyz_path)}
+        _write_json(meta_path(xyz_path), meta)
+    return meta["points_out"], meta["clusters"]
+
+
+def run_segmenter(exe, input_path, output_path, radius, vres, min_pts, input_meta=None, scan=True):
+    """
+    Run the C++ segmentation executable and write the run record of its output.
+
+    Parameters:
+    - input_meta (dict | None): input_stats(input_path), computed once by the
+      caller for all runs of a sweep (computed here if None)
+    - scan (bool): scan the output for the record; callers that load the output
+      anyway pass False and write the record with record_output
+
+    Returns:
+    - (bool, float, dict): success, runtime in seconds, the record
+      (on failure the record also has "output": the tail of stdout/stderr)
+    """
+    cmd = [exe, input_path, output_path, str(radius), str(vres), str(min_pts)]
+    meta = {
+        "params": {"radius": radius, "vres": vres, "min_pts": min_pts},
+        "exe": os.path.basename(exe),
+        "input": input_meta if input_meta is not None else input_stats(input_path),
+    }
+
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output = proc.stdout.read()   # single merged pipe: read to EOF, then reap
+    proc.stdout.close()
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        peak = usage.ru_maxrss / (1 << 20) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+        meta["peak_rss_mb"] = round(peak, 1)
+    else:
+        proc.wait()
+        meta["peak_rss_mb"] = None
+    runtime = time.time() - start
+
+    meta["runtime_s"] = round(runtime, 3)
+    meta["returncode"] = proc.returncode
+    success = proc.returncode == 0 and os.path.exists(output_path)
+    if success and scan:
+        meta.update(scan_output(output_path))
+        _write_json(meta_path(output_path), meta)
+    else:
+        meta["output"] = output[-2000:]
+    return success, runtime, meta
@@ -0,0 +1,107 @@
+# coord_join.py
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Quantized-coordinate join
+# ---------------------------------------------------------------------------
+# Labels (tree ids, gtids) are re-attached to LAS points by coordinate. LAS
+# points already live on an integer grid (X, Y, Z with header scale/offset),
+# so the other side is snapped to the same grid, the three integers are packed
+# into one 64-bit key and the join is a sort + searchsorted. Float rounding and
+# string / tuple keys are not needed.
+
+
+def las_grid(las):
+    """Integer grid coordinates (n, 3) of a laspy LasData."""
+    return np.column_stack((np.asarray(las.X), np.asarray(las.Y), np.asarray(las.Z))).astype(np.int64)
+
+
+def coords_to_grid(xyz, scales, offsets):
+    """Snap real-world coordinates (n, 3) to the LAS integer grid of a header."""
+    xyz = np.asarray(xyz, dtype=np.float64)
+    return np.rint((xyz - np.asarray(offsets)) / np.asarray(scales)).astype(np.int64)
+
+
+def _pack_keys(*grids):
+    """
+    Pack integer (n, 3) grids into one uint64 key per row (same packing for all grids).
+    Falls back to dense ranks over the unique rows if the extent needs more than 64 bits.
+    """
+    lo = np.min([g.min(axis=0) for g in grids if len(g)], axis=0)
+    hi = np.max([g.max(axis=0) for g in grids if len(g)], axis=0)
+    bits = [max(1, int(span).bit_length()) for span in hi - lo]
+
+    if sum(bits) <= 64:
+        keys = []
+        for g in grids:
+            rel = (g - lo).astype(np.uint64)
+            keys.append((rel[:, 0] << np.uint64(bits[1] + bits[2]))
+                        | (rel[:, 1] << np.uint64(bits[2]))
+                        | rel[:, 2])
+        return keys
+
+    allg = np.concatenate(grids)
+    _, inverse = np.unique(allg, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1).astype(np.uint64)
+    return np.split(inverse, np.cumsum([len(g) for g in grids])[:-1])
+
+
+def join_on_grid(query_grid, ref_grid, ref_values, fill=-1):
+    """
+    Look up a value for every query point from the reference point with the same grid coordinate.
+
+    Parameters:
+    - query_grid (np.ndarray): (n, 3) int grid coordinates to label (e.g. las_grid(las))
+    - ref_grid (np.ndarray): (m, 3) int grid coordinates of the labelled points
+    - ref_values (array-like): value per reference point
+    - fill: value for query points without a match
+
+    Returns:
+    - values (np.ndarray): n values, fill where unmatched
+    - stats (dict): matched / unmatched query points, reference points that
+      matched nothing and duplicate reference coordinates (the last one in
+      reference order wins, as with the former dict / merge based joins)
+    """
+    query_grid = np.asarray(query_grid, dtype=np.int64).reshape(-1, 3)
+    ref_grid = np.asarray(ref_grid, dtype=np.int64).reshape(-1, 3)
+    ref_values = np.asarray(ref_values)
+
+    values = np.full(len(query_grid), fill, dtype=np.result_type(ref_values.dtype, np.min_scalar_type(fill)))
+    stats = {"n_query": len(query_grid), "n_ref": len(ref_grid), "matched": 0,
+             "unmatched": len(query_grid), "ref_unmatched": len(ref_grid), "ref_duplicates": 0}
+
+    if len(query_grid) == 0 or len(ref_grid) == 0:
+        return values, stats
+
+    q_keys, r_keys = _pack_keys(query_grid, ref_grid)
+
+    order = np.argsort(r_keys, kind="stable")
+    r_sorted = r_keys[order]
+    # stable sort: the last row of each run of equal keys is the last duplicate
+    last = np.r_[r_sorted[1:] != r_sorted[:-1], True]
+    stats["ref_duplicates"] = int((~last).sum())
+    r_sorted, order = r_sorted[last], order[last]
+
+    pos = np.minimum(np.searchsorted(r_sorted, q_keys), len(r_sorted) - 1)
+    hit = r_sorted[pos] == q_keys
+    values[hit] = ref_values[order[pos[hit]]]
+
+    ref_hit = np.zeros(len(r_sorted), dtype=bool)
+    ref_hit[pos[hit]] = True
+
+    stats["matched"] = int(hit.sum())
+    stats["unmatched"] = len(query_grid) - stats["matched"]
+    stats["ref_unmatched"] = len(ref_grid) - stats["ref_duplicates"] - int(ref_hit.sum())
+    return values, stats
+
+
+def log_join_stats(logger, stats, label="points"):
+    """Write join statistics to a logger."""
+    logger.info("Matched %s: %d / %d (reference points: %d)",
+                label, stats["matched"], stats["n_query"], stats["n_ref"])
+    if stats["unmatched"]:
+        logger.warning("Unmatched %s: %d", label, stats["unmatched"])
+    if stats["ref_unmatched"]:
+        logger.warning("Reference points without a match: %d", stats["ref_unmatched"])
+    if stats["ref_duplicates"]:
+        logger.warning("Duplicate reference coordinates (last label kept): %d", stats["ref_duplicates"])
@@ -12,23 +12,19 @@ import matplotlib.cm as cm
 import matplotlib.colors as mcolors
 
 from tqdm import tqdm
-from shapely.geometry import Point
-from shapely.ops import unary_union
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label
+from hull_store import hull_path, write_hulls
 
 logger = None
 
 
-def compute_tree_convex_hulls(gdf, idx=None):
-    hulls = []
-    for tid, group in gdf.groupby("tree_id"):
-        if len(group) < 3:
-            logger.warning(f"Iter {idx}: tree {tid} < 3 pts, skipping hull")
-            continue
-        union = unary_union(group.geometry)
-        hulls.append({"tree_id": tid, "geometry": union.convex_hull})
-    return gpd.GeoDataFrame(hulls, crs=gdf.crs)
+def compute_tree_convex_hulls(seg_df, idx=None, crs="EPSG:28992"):
+    tids, hulls, skipped = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values)
+    for tid in skipped:
+        logger.warning(f"Iter {idx}: tree {tid} < 3 pts, skipping hull")
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
 
 
 def create_tree_hulls_from_segmentation(data_dir, segmentation_filename):
@@ -48,18 +44,15 @@ def create_tree_hulls_from_segmentation(data_dir, segmentation_filename):
 
     try:
         seg_df = pd.read_csv(segmentation_path, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
-        seg_gdf = gpd.GeoDataFrame(seg_df, geometry=gpd.points_from_xy(seg_df.x, seg_df.y), crs="EPSG:28992")
-
-        hulls_gdf = compute_tree_convex_hulls(seg_gdf)
+        hulls_gdf = compute_tree_convex_hulls(seg_df)
 
         if hulls_gdf.empty:
             logger.warning("No hulls generated for %s", segmentation_filename)
             return
 
-        output_geojson = os.path.join(output_dir, f"{os.path.splitext(segmentation_filename)[0]}.geojson")
-        hulls_gdf.to_file(output_geojson, driver="GeoJSON")
+        hulls_file = write_hulls(hulls_gdf, hull_path(output_dir, os.path.splitext(segmentation_filename)[0]))
 
-        logger.info("✓ Hulls saved to: %s", output_geojson)
+        logger.info("✓ Hulls saved to: %s", hulls_file)
 
     except Exception as e:
         logger.exception("Failed to process segmentation %s: %s", segmentation_filename, str(e))
@@ -0,0 +1,82 @@
+# hull_labelling.py
+import numpy as np
+import pandas as pd
+from shapely import STRtree
+
+# ---------------------------------------------------------------------------
+# Hull labelling engine
+# ---------------------------------------------------------------------------
+# Labels every hull by the municipality trees (points) inside it. All
+# municipality trees are queried against one STRtree of the hulls in a single
+# call (predicate "within"), which returns the (point, hull) pairs as two
+# index arrays. Everything else is a bincount over those arrays:
+#
+#   n_points      trees inside the hull                -> muni_class H0 .. H4+
+#   partial       some tree inside also lies in another hull
+#   n_exclusive   trees inside that lie in this hull only
+#   label         Hpartial if partial, else H0 .. H4+ from n_exclusive
+#   value         for label H1: the attribute (e.g. species) of its one tree
+#
+# and per point the number of hulls it lies in (0 = tree not matched,
+# > 1 = tree shared by several hulls).
+
+H_CLASSES = ["H0", "H1", "H2", "H3", "H4+"]
+
+
+def h_class(counts):
+    """H0 / H1 / H2 / H3 / H4+ per count of municipality trees."""
+    return np.asarray(H_CLASSES, dtype=object)[np.minimum(np.asarray(counts, dtype=np.int64), 4)]
+
+
+def point_hull_pairs(hull_geoms, point_geoms):
+    """(point index, hull index) of every point lying within a hull, from one STRtree query."""
+    hull_geoms = np.asarray(hull_geoms, dtype=object)
+    point_geoms = np.asarray(point_geoms, dtype=object)
+    if len(hull_geoms) == 0 or len(point_geoms) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    ip, ih = STRtree(hull_geoms).query(point_geoms, predicate="within")
+    return ip, ih
+
+
+def label_hulls(hull_geoms, point_geoms, point_values=None):
+    """
+    Label hulls by the points inside them.
+
+    Parameters:
+    - hull_geoms (array-like): hull polygons
+    - point_geoms (array-like): municipality tree points (same crs)
+    - point_values (array-like | None): attribute per point copied to H1 hulls (e.g. species)
+
+    Returns:
+    - hull_table (pd.DataFrame): one row per hull (same order) with n_points,
+      muni_class, n_exclusive, partial, label and, if point_values is given, value
+    - hulls_per_point (np.ndarray): number of hulls each point lies in
+    """
+    n_hulls, n_points = len(hull_geoms), len(point_geoms)
+    ip, ih = point_hull_pairs(hull_geoms, point_geoms)
+
+    hulls_per_point = np.bincount(ip, minlength=n_points)
+    points_per_hull = np.bincount(ih, minlength=n_hulls)
+
+    shared = hulls_per_point[ip] > 1
+    partial = np.bincount(ih[shared], minlength=n_hulls) > 0
+    n_exclusive = np.bincount(ih[~shared], minlength=n_hulls)
+
+    label = h_class(n_exclusive)
+    label[partial] = "Hpartial"
+    hull_table = pd.DataFrame({
+        "n_points": points_per_hull,
+        "muni_class": h_class(points_per_hull),
+        "n_exclusive": n_exclusive,
+        "partial": partial,
+        "label": label,
+    })
+
+    if point_values is not None:
+        point_values = np.asarray(point_values, dtype=object)
+        value = np.full(n_hulls, None, dtype=object)
+        # an H1 hull has exactly one exclusive pair
+        one = ~shared & (label[ih] == "H1")
+        value[ih[one]] = point_values[ip[one]]
+        hull_table["value"] = value
+    return hull_table, hulls_per_point
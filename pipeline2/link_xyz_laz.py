@@ -6,6 +6,8 @@ import os
 import logging
 import io
 
+from coord_join import join_on_grid, log_join_stats
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,23 +20,21 @@ def process_forest_data(data_dir, input_las_file_name, clusters_folder_path, out
     columns = ['X', 'Y', 'Z', 'ndvi', 'mtvi2', 'norm_g']
     forest_data = np.column_stack((forest_xyz, forest_las.ndvi, forest_las.mtvi2, forest_las.norm_g))
     forest_df = pd.DataFrame(forest_data, columns=columns)
-    forest_df['tree_id'] = -1
 
     buf = io.StringIO()
     forest_df.info(buf=buf)
     logger.info("Forest DataFrame Info:\n%s", buf.getvalue())
     logger.info("Forest DataFrame Head:\n%s", forest_df.head().to_string())
 
+    # Collect all cluster files and join them in one pass (cluster coordinates
+    # are on the same integer X/Y/Z grid as the LAS points)
+    tree_frames = []
     for tree_file in glob.glob(os.path.join(clusters_folder_path, "*.xyz")):
         tree_id = int(os.path.basename(tree_file).split('_')[1].split('.')[0])
-        tree_xyz = np.loadtxt(tree_file)
+        tree_xyz = np.loadtxt(tree_file, ndmin=2)
         tree_df = pd.DataFrame(tree_xyz, columns=['X', 'Y', 'Z'])
         tree_df['tree_id'] = tree_id
-
-        forest_df = forest_df.merge(tree_df, on=['X', 'Y', 'Z'], how='left', suffixes=('', '_tree'))
-        if 'tree_id_tree' in forest_df.columns:
-            forest_df['tree_id'] = forest_df['tree_id_tree'].fillna(forest_df['tree_id'])
-            forest_df.drop(columns=['tree_id_tree'], inplace=True)
+        tree_frames.append(tree_df)
 
         if tree_id == 1:
             buf = io.StringIO()
@@ -42,6 +42,15 @@ def process_forest_data(data_dir, input_las_file_name, clusters_folder_path, out
             logger.info("Tree 1 DataFrame Info:\n%s", buf.getvalue())
             logger.info("Tree 1 DataFrame Head:\n%s", tree_df.head().to_string())
 
+    if tree_frames:
+        trees_df = pd.concat(tree_frames, ignore_index=True)
+        tree_ids, stats = join_on_grid(np.rint(forest_xyz), np.rint(trees_df[['X', 'Y', 'Z']].values),
+                                       trees_df['tree_id'].values)
+        log_join_stats(logger, stats)
+    else:
+        tree_ids = np.full(len(forest_df), -1)
+    forest_df['tree_id'] = tree_ids
+
     scale = forest_las.header.scales
     offset = forest_las.header.offsets
     forest_df[['X', 'Y', 'Z']] = forest_df[['X', 'Y', 'Z']] * scale + offset
@@ -0,0 +1,74 @@
+import os
+import sys
+import glob
+import logging
+
+from run_meta import META_SUFFIX, read_run_meta
+from sweep_pool import run_sweeps
+from segmentation_public_matching import run_segmentation_public_matching
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Multi-dataset public matching sweep
+# ---------------------------------------------------------------------------
+# Runs the public matching sweep of several data dirs (e.g. whm_100 and
+# whm_100_unfiltered) at once on one shared pool (sweep_pool.run_sweeps)
+# instead of splitting the cores by hand. The memory per task of a data dir
+# is the largest peak_rss_mb of its earlier segmentation run records; the
+# memory budget is MEMORY_SHARE of the physical memory.
+
+MEMORY_SHARE = 0.8
+
+
+def task_memory_mb(segmentation_dir):
+    """Largest peak_rss_mb of the run records in segmentation_dir (0 without records)."""
+    peaks = []
+    for record_path in glob.glob(os.path.join(segmentation_dir, "*.xyz" + META_SUFFIX)):
+        meta = read_run_meta(record_path[:-len(META_SUFFIX)])
+        if meta and meta.get("peak_rss_mb"):
+            peaks.append(meta["peak_rss_mb"])
+    return max(peaks, default=0.0)
+
+
+def physical_memory_mb():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20
+
+
+def matching_spec(data_dir, priority=1.0, **overrides):
+    """run_sweeps spec of the public matching sweep of one data dir."""
+    output_dir = os.path.join(data_dir, "segmentation_results")
+    kwargs = {
+        "data_dir": data_dir,
+        "exe": "./segmentation_code/build/segmentation",
+        "input_xyz": "forest.xyz",
+        "output_dir": output_dir,
+        "radius_vals": [1, 2, 3, 4, 5],
+        "vres_vals": [.5],
+        "min_pts_vals": [1],
+        "municipality_geojson": "Bomen_in_beheer_door_gemeente_Delft.geojson",
+        "forest_las_name": "forest.laz",
+        "csv_name": "segmentation_stats_public.csv",
+        "delete_segmentation_after_processing": True,
+        **overrides,
+    }
+    return {"name": data_dir, "run": run_segmentation_public_matching, "kwargs": kwargs,
+            "priority": priority, "mem_per_task_mb": task_memory_mb(output_dir)}
+
+
+if __name__ == "__main__":
+    from shared_logging import setup_logging
+
+    if len(sys.argv) < 3:
+        raise ValueError("Usage: python multi_sweep.py <cores> <data_dir> [<data_dir> ...]")
+
+    cores = int(sys.argv[1])
+    data_dirs = sys.argv[2:]
+    setup_logging(os.path.join("logs", "multi_sweep.log"))
+
+    specs = [matching_spec(data_dir) for data_dir in data_dirs]
+    for spec in specs:
+        logger.info("%s: %.0f MB per task", spec["name"], spec["mem_per_task_mb"])
+
+    results = run_sweeps(specs, cores=cores, mem_mb=MEMORY_SHARE * physical_memory_mb(), policy="fair")
+    logger.info("Finished sweeps: %s", ", ".join(results))
@@ -0,0 +1,152 @@
+# muni_index.py
+import os
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# ---------------------------------------------------------------------------
+# Municipality tree index
+# ---------------------------------------------------------------------------
+# The municipality tree GeoJSON is read, projected to EPSG:28992 and stored
+# once per case as <geojson stem>.index.npz:
+#
+#   x, y           projected coordinates (float64)
+#   object_id      OBJECTID
+#   species_codes  BOOMSORTIMENT as categorical codes (-1 = missing)
+#   species        the categories
+#   grid_*         points sorted by grid cell (GRID_CELL m), for bbox queries
+#   source         size / mtime_ns of the GeoJSON the index was built from
+#
+# Loading is a plain np.load (no GeoJSON parsing, no reprojection). The index
+# is rebuilt automatically when the source GeoJSON changes.
+
+MUNI_CRS = "EPSG:28992"
+GRID_CELL = 250.0   # metres
+
+
+def muni_index_path(geojson_path):
+    return os.path.splitext(geojson_path)[0] + ".index.npz"
+
+
+def _source_stamp(geojson_path):
+    st = os.stat(geojson_path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def build_muni_index(geojson_path, index_path=None):
+    """Read the municipality GeoJSON once and write its index. Returns the index path."""
+    index_path = index_path or muni_index_path(geojson_path)
+
+    gdf = gpd.read_file(geojson_path, columns=["OBJECTID", "BOOMSORTIMENT"])
+    assert all(gdf.geometry.type == "Point"), "GeoJSON must contain Point geometries"
+    if gdf.crs is None:
+        gdf = gdf.set_crs(MUNI_CRS)
+    gdf = gdf.to_crs(MUNI_CRS)
+
+    x, y = gdf.geometry.x.values, gdf.geometry.y.values
+    species = pd.Categorical(gdf["BOOMSORTIMENT"].astype(pd.StringDtype()))
+
+    # grid index: points ordered by cell key, one key per point
+    origin = np.array([x.min(), y.min()]) if len(x) else np.zeros(2)
+    cx = np.floor((x - origin[0]) / GRID_CELL).astype(np.int64)
+    cy = np.floor((y - origin[1]) / GRID_CELL).astype(np.int64)
+    n_cols = int(cx.max()) + 1 if len(x) else 1
+    keys = cy * n_cols + cx
+    order = np.argsort(keys, kind="stable")
+
+    # one temp file per writer: sweep workers (processes) and sweep drivers
+    # (threads) may build the same index at once; the last replace wins
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    try:
+        np.savez(
+            tmp_path,
+            x=x, y=y,
+            object_id=gdf["OBJECTID"].values.astype(np.int64),
+            species_codes=species.codes.astype(np.int32),
+            species=np.asarray(species.categories, dtype=str),
+            grid_origin=origin,
+            grid_shape=np.array([n_cols, int(cy.max()) + 1 if len(y) else 1], dtype=np.int64),
+            grid_order=order,
+            grid_keys=keys[order],
+            source=_source_stamp(geojson_path),
+        )
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return index_path
+
+
+def load_muni_index(geojson_path, index_path=None):
+    """Load the index of a municipality GeoJSON, (re)building it if missing or out of date."""
+    index_path = index_path or muni_index_path(geojson_path)
+    if os.path.exists(index_path):
+        index = MuniIndex(index_path)
+        if not os.path.exists(geojson_path) or np.array_equal(index.source, _source_stamp(geojson_path)):
+            return index
+    build_muni_index(geojson_path, index_path)
+    return MuniIndex(index_path)
+
+
+class MuniIndex:
+    """Projected municipality trees with a grid index for bbox / polygon queries."""
+
+    def __init__(self, index_path):
+        with np.load(index_path) as data:
+            self.x = data["x"]
+            self.y = data["y"]
+            self.object_id = data["object_id"]
+            self.species_codes = data["species_codes"]
+            self.species_names = data["species"]
+            self._origin = data["grid_origin"]
+            self._shape = data["grid_shape"]
+            self._order = data["grid_order"]
+            self._keys = data["grid_keys"]
+            self.source = data["source"]
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def species(self):
+        """BOOMSORTIMENT per tree as a pandas Categorical."""
+        return pd.Categorical.from_codes(self.species_codes, categories=self.species_names)
+
+    def query_bbox(self, bounds):
+        """Indices (ascending) of the trees inside bounds (minx, miny, maxx, maxy), edges included."""
+        minx, miny, maxx, maxy = bounds
+        n_cols, n_rows = self._shape
+        cx0 = max(int(np.floor((minx - self._origin[0]) / GRID_CELL)), 0)
+        cx1 = min(int(np.floor((maxx - self._origin[0]) / GRID_CELL)), n_cols - 1)
+        cy0 = max(int(np.floor((miny - self._origin[1]) / GRID_CELL)), 0)
+        cy1 = min(int(np.floor((maxy - self._origin[1]) / GRID_CELL)), n_rows - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+
+        # every grid row of the window is one contiguous key range
+        rows = np.arange(cy0, cy1 + 1) * n_cols
+        lo = np.searchsorted(self._keys, rows + cx0, side="left")
+        hi = np.searchsorted(self._keys, rows + cx1, side="right")
+        cand = np.concatenate([self._order[a:b] for a, b in zip(lo, hi)])
+
+        x, y = self.x[cand], self.y[cand]
+        inside = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+        return np.sort(cand[inside])
+
+    def query_geometry(self, geom):
+        """Indices of the trees inside a polygon (e.g. a tile core or a LAS footprint)."""
+        cand = self.query_bbox(geom.bounds)
+        return cand[shapely.contains_xy(geom, self.x[cand], self.y[cand])]
+
+    def to_gdf(self, idx=None):
+        """GeoDataFrame (OBJECTID, BOOMSORTIMENT, point geometry) of all trees or of idx."""
+        idx = np.arange(len(self.x)) if idx is None else np.asarray(idx)
+        species = self.species[idx].astype(object)
+        return gpd.GeoDataFrame(
+            {"OBJECTID": self.object_id[idx],
+             "BOOMSORTIMENT": pd.array(species, dtype=pd.StringDtype())},
+            geometry=gpd.points_from_xy(self.x[idx], self.y[idx]),
+            crs=MUNI_CRS,
+        )
@@ -0,0 +1,160 @@
+# results_store.py
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+import pandas as pd
+
+# ---------------------------------------------------------------------------
+# Sweep results store
+# ---------------------------------------------------------------------------
+# Sweep statistics live in one SQLite database per data_dir
+# (sweep_results.sqlite, WAL mode), one table per sweep. A row is keyed by
+# (dataset, engine, fidelity, radius, vres, min_pts) and holds the result dict
+# as JSON, so the sweeps keep their own column names. fidelity is the share of
+# the point cloud the run used (1.0 = full density, see thinning.py). Writes are upserts in their own
+# transaction (safe with several writer processes), "already done" checks are
+# primary-key lookups, and the CSV the plotting code reads is an export of the
+# table. An existing CSV is imported once when its table is still empty.
+
+RESULTS_DB = "sweep_results.sqlite"
+
+
+class ResultsStore:
+    """
+    Results of one sweep (table) for one dataset and segmentation engine.
+
+    Parameters:
+    - db_path (str): SQLite database (created if missing)
+    - table (str): sweep name, e.g. the CSV stem "hull_analysis"
+    - dataset (str): dataset name, e.g. the data_dir name
+    - engine (str): segmentation engine, e.g. the executable name
+    - key_columns (tuple[str, str, str]): result columns holding radius, vres, min_pts
+    - fidelity (float): share of the point cloud the results were computed on
+    """
+
+    def __init__(self, db_path, table, dataset, engine, key_columns=("Radius", "Vertical Res", "Min Points"),
+                 fidelity=1.0):
+        self.db_path = db_path
+        self.table = table
+        self.dataset = dataset
+        self.engine = engine
+        self.key_columns = tuple(key_columns)
+        self.fidelity = float(fidelity)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")   # persistent: readers never block the writer
+        with self._connect(write=True) as conn:
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            if columns and "fidelity" not in columns:
+                # table from before fidelity levels: its rows are full density
+                conn.execute(f'ALTER TABLE "{table}" RENAME TO "{table}_v1"')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" ('
+                " dataset TEXT NOT NULL, engine TEXT NOT NULL, fidelity REAL NOT NULL,"
+                " radius REAL NOT NULL, vres REAL NOT NULL, min_pts INTEGER NOT NULL,"
+                " idx INTEGER NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL,"
+                " PRIMARY KEY (dataset, engine, fidelity, radius, vres, min_pts))"
+            )
+            if columns and "fidelity" not in columns:
+                conn.execute(
+                    f'INSERT INTO "{table}" SELECT dataset, engine, 1.0, radius, vres, min_pts, idx, data, updated'
+                    f' FROM "{table}_v1"')
+                conn.execute(f'DROP TABLE "{table}_v1"')
+
+    def at_fidelity(self, fidelity):
+        """The same sweep's store for another fidelity level."""
+        return ResultsStore(self.db_path, self.table, self.dataset, self.engine, self.key_columns, fidelity)
+
+    @contextmanager
+    def _connect(self, write=False):
+        # one short-lived connection per call: safe across threads and processes;
+        # writes take the database lock up front (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if write:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            if write:
+                conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _key(self, radius, vres, min_pts):
+        return (self.dataset, self.engine, self.fidelity, float(radius), float(vres), int(min_pts))
+
+    def has(self, radius, vres, min_pts):
+        """True if this parameter combination has a stored result."""
+        with self._connect() as conn:
+            row = conn.execute(
+                f'SELECT 1 FROM "{self.table}" WHERE dataset=? AND engine=? AND fidelity=? AND radius=? AND vres=? AND min_pts=?',
+                self._key(radius, vres, min_pts)).fetchone()
+        return row is not None
+
+    def done(self):
+        """Set of (radius, vres, min_pts) with a stored result."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT radius, vres, min_pts FROM "{self.table}" WHERE dataset=? AND engine=? AND fidelity=?',
+                (self.dataset, self.engine, self.fidelity)).fetchall()
+        return set(rows)
+
+    def next_index(self):
+        """Next free result index (used for naming output files)."""
+        with self._connect() as conn:
+            (n,) = conn.execute(f'SELECT COALESCE(MAX(idx) + 1, 0) FROM "{self.table}"').fetchone()
+        return int(n)
+
+    def upsert(self, row, idx=None):
+        """Insert or replace the result of one combination (key taken from row[key_columns])."""
+        key = self._key(*(row[c] for c in self.key_columns))
+        data = json.dumps(row, default=lambda v: v.item() if hasattr(v, "item") else str(v))
+        with self._connect(write=True) as conn:
+            if idx is None:
+                existing = conn.execute(
+                    f'SELECT idx FROM "{self.table}" WHERE dataset=? AND engine=? AND fidelity=? AND radius=? AND vres=? AND min_pts=?',
+                    key).fetchone()
+                idx = existing[0] if existing else conn.execute(
+                    f'SELECT COALESCE(MAX(idx) + 1, 0) FROM "{self.table}"').fetchone()[0]
+            conn.execute(
+                f'INSERT INTO "{self.table}" (dataset, engine, fidelity, radius, vres, min_pts, idx, data, updated)'
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (dataset, engine, fidelity, radius, vres, min_pts)"
+                " DO UPDATE SET idx=excluded.idx, data=excluded.data, updated=excluded.updated",
+                key + (int(idx), data, time.time()))
+
+    def to_frame(self, columns=None):
+        """Stored results of this dataset / engine / fidelity as a DataFrame, in index order."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT data FROM "{self.table}" WHERE dataset=? AND engine=? AND fidelity=? ORDER BY idx',
+                (self.dataset, self.engine, self.fidelity)).fetchall()
+        df = pd.DataFrame([json.loads(r[0]) for r in rows])
+        if columns is not None:
+            df = df.reindex(columns=list(columns))
+        return df
+
+    def export_csv(self, csv_path, columns=None):
+        """Write the stored results to a CSV for the plotting code (atomic replace). Returns the row count."""
+        df = self.to_frame(columns)
+        tmp_path = csv_path + ".tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, csv_path)
+        return len(df)
+
+    def import_csv(self, csv_path):
+        """Load the rows of an existing sweep CSV once, when this fidelity has no results yet. Returns the row count."""
+        if not os.path.exists(csv_path) or self.done():
+            return 0
+        df = pd.read_csv(csv_path)
+        if df.empty or not all(c in df.columns for c in self.key_columns):
+            return 0
+        for i, row in enumerate(df.to_dict("records")):
+            self.upsert({k: v for k, v in row.items() if not pd.isna(v)}, idx=i)
+        return len(df)
@@ -0,0 +1,106 @@
+# sampled_metrics.py
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Sampled metric estimation
+# ---------------------------------------------------------------------------
+# To rank sweep combinations, most metrics do not have to be exact. With
+# evaluation="sampled" a sweep evaluates them on a stratified random sample of
+# units (municipality trees or hulls):
+#
+#   strata    square grid cells of `cell` metres over the unit locations, so
+#             the sample covers the whole study area
+#   sample    fraction of every stratum (at least min_per_stratum units, or
+#             all of a smaller stratum), drawn with a fixed seed
+#   estimate  stratified mean of a per-unit value, with the 95% confidence
+#             half-width from the within-stratum variances (finite population
+#             corrected, so a stratum sampled completely adds no variance)
+#
+# Rates and counts are means of 0/1 indicators (times 100 or the population
+# size). An objective gets an interval as the mean of its per-unit score.
+# After the sweep only the combinations whose objective interval overlaps the
+# best one are evaluated exactly (escalation_candidates).
+
+Z_95 = 1.96
+
+
+class StratifiedSample:
+    """
+    Stratified random sample of units at (x, y).
+
+    Parameters:
+    - x, y (array-like): unit locations (e.g. tree points, hull centroids)
+    - fraction (float): share of every stratum sampled
+    - cell (float): stratum cell size in map units
+    - min_per_stratum (int): minimum units per stratum (2 keeps its variance defined)
+    - seed (int): random seed
+
+    Attributes:
+    - index (np.ndarray): sampled unit indices, ascending
+    - size (int): number of sampled units, population (int): number of units
+    """
+
+    def __init__(self, x, y, fraction, cell=50.0, min_per_stratum=2, seed=0):
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        self.population = len(x)
+        if self.population == 0:
+            self.index = np.empty(0, dtype=np.int64)
+            self.size = 0
+            self._stratum, self._N, self._n = self.index, np.empty(0), np.empty(0)
+            return
+
+        cells = np.column_stack((np.floor((x - x.min()) / cell), np.floor((y - y.min()) / cell))).astype(np.int64)
+        keys = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+        _, strata = np.unique(keys, return_inverse=True)
+        N_h = np.bincount(strata)
+        n_h = np.minimum(N_h, np.maximum(min_per_stratum, np.ceil(fraction * N_h).astype(np.int64)))
+
+        # random order within each stratum, keep the first n_h
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(self.population), strata))
+        starts = np.concatenate(([0], np.cumsum(N_h)[:-1]))
+        rank = np.arange(self.population) - np.repeat(starts, N_h)
+        keep = order[rank < n_h[strata[order]]]
+
+        self.index = np.sort(keep)
+        self.size = len(self.index)
+        self._stratum = strata[self.index]
+        self._N = N_h.astype(np.float64)
+        self._n = n_h.astype(np.float64)
+
+    def estimate(self, values):
+        """
+        Population mean of a per-unit value from its values on the sampled units.
+
+        Returns:
+        - (float, float): estimate and 95% confidence half-width
+        """
+        if self.size == 0:
+            return np.nan, np.nan
+        values = np.asarray(values, dtype=np.float64)
+        W = self._N / self.population
+        mean_h = np.bincount(self._stratum, weights=values, minlength=len(self._N)) / self._n
+        ss_h = np.bincount(self._stratum, weights=(values - mean_h[self._stratum]) ** 2, minlength=len(self._N))
+        var_h = np.where(self._n > 1, ss_h / np.maximum(self._n - 1, 1), 0.0)
+
+        mean = float(np.sum(W * mean_h))
+        var = float(np.sum(W ** 2 * (1 - self._n / self._N) * var_h / self._n))
+        return mean, float(Z_95 * np.sqrt(var))
+
+
+def escalation_candidates(intervals):
+    """
+    Keys whose interval overlaps the interval of the best estimate.
+
+    Parameters:
+    - intervals (dict): key -> (estimate, half-width), higher is better
+
+    Returns:
+    - list: keys to evaluate exactly (the best one included)
+    """
+    finite = {k: (s, h) for k, (s, h) in intervals.items() if np.isfinite(s)}
+    if not finite:
+        return []
+    best_score, best_hw = max(finite.values(), key=lambda sh: sh[0])
+    best_lower = best_score - (best_hw if np.isfinite(best_hw) else 0.0)
+    return [k for k, (s, h) in finite.items() if s + (h if np.isfinite(h) else np.inf) >= best_lower]
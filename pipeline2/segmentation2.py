@@ -1,13 +1,14 @@
 # segmentation.py  –  unified single + tuning runner
 # ---------------------------------------------------
 import os
-import subprocess
 import logging
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor
 from itertools import product
 from tqdm import tqdm
 
+from run_meta import run_segmenter, output_stats
+
 logger = logging.getLogger(__name__)
 
 # ---------- small helpers ------------------------------------------------
@@ -23,25 +24,14 @@ def run_segment_trees(exe: str, params, input_xyz: str, out_file: str):
     cmd = [exe, input_xyz, out_file, str(radius), str(vres), str(min_pts)]
     logger.info("Running: %s", " ".join(cmd))
 
-    try:
-        res = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-
-        logger.info("C++ stdout:\n%s", res.stdout or "<no stdout>")
-        if res.stderr:
-            logger.warning("C++ stderr:\n%s", res.stderr)
-
-    except subprocess.CalledProcessError as e:
-        logger.error("C++ failed (code %d)", e.returncode)
-        logger.error("stdout:\n%s", e.stdout or "<no stdout>")
-        logger.error("stderr:\n%s", e.stderr or "<no stderr>")
+    # also writes <out_file>.meta.json (points, clusters, runtime, peak memory)
+    success, runtime, meta = run_segmenter(exe, input_xyz, out_file, radius, vres, min_pts)
+    if not success:
+        logger.error("C++ failed (code %d)", meta["returncode"])
+        logger.error("output:\n%s", meta.get("output") or "<no output>")
         return None
 
+    logger.info("C++ finished in %.2fs, peak memory %s MB", runtime, meta["peak_rss_mb"])
     return out_file
 
 
@@ -57,10 +47,7 @@ def create_or_update_csv(csv_path: str, out_dir: str, new_rows: list[dict]):
 
     for row in new_rows:
         xyz_path = os.path.join(out_dir, row["file"])
-        xyz_df   = pd.read_csv(xyz_path, sep=r"\s+", header=None,
-                               names=["tree_id", "x", "y", "z"])
-        num_pts  = len(xyz_df)
-        tree_cnt = xyz_df["tree_id"].nunique()
+        num_pts, tree_cnt = output_stats(xyz_path)   # from the run record
 
         df.loc[len(df)] = [row["file"], row["radius"], row["vres"],
                            row["min_pts"], num_pts, tree_cnt]
@@ -1,49 +1,24 @@
 import os
 import sys
-import subprocess
 import laspy
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, box, Polygon
-from shapely.ops import unary_union
+from shapely.geometry import box
 from concurrent.futures import ThreadPoolExecutor
 from itertools import product
 from tqdm import tqdm
-import time
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label
+from muni_index import load_muni_index
+from run_meta import run_segmenter, record_output, input_stats
 
 logger = None
 
-def load_municipality_geojson(filename):
-    gdf = gpd.read_file(filename)
-    assert all(gdf.geometry.type == "Point"), "GeoJSON must contain Point geometries"
-    gdf = gdf[["OBJECTID", "BOOMSORTIMENT", "geometry"]]
-    gdf["BOOMSORTIMENT"] = gdf["BOOMSORTIMENT"].astype(pd.StringDtype())
-    return gdf.to_crs("EPSG:28992")
-
-
-def load_forest_gdf(laz_file_path):
-    with laspy.open(laz_file_path) as las:
-        points = las.read()
-        scale = las.header.scales
-        offset = las.header.offsets
-
-        X = points.X * scale[0] + offset[0]
-        Y = points.Y * scale[1] + offset[1]
-        Z = points.Z * scale[2] + offset[2]
-
-        attributes = {dim.name: np.array(getattr(points, dim.name)) for dim in points.point_format}
-        df = pd.DataFrame(attributes)
-        df['X'] = X
-        df['Y'] = Y
-        df['Z'] = Z
-
-        # df = df[['tree_id', 'X', 'Y', 'Z', 'red', 'green', 'blue', 'nir', 'ndvi', 'norm_g', 'mtvi2']]
-        df['geometry'] = df.apply(lambda row: Point(row['X'], row['Y'], row['Z']), axis=1)
-        df.drop(columns=['X', 'Y', 'Z'], inplace=True)
-
-        return gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:28992")
+def load_municipality_geojson(filename, bbox=None):
+    """Municipality trees (OBJECTID, BOOMSORTIMENT, geometry) in EPSG:28992 from the cached index, optionally only inside bbox."""
+    index = load_muni_index(filename)
+    return index.to_gdf(None if bbox is None else index.query_bbox(bbox))
 
 
 def get_bbox_from_las(las_path):
@@ -53,25 +28,17 @@ def get_bbox_from_las(las_path):
     return box(bbox_min[0], bbox_min[1], bbox_max[0], bbox_max[1])
 
 
-def compute_tree_convex_hulls(gdf):
-    gdf = gdf[gdf["tree_id"] != -1]
-    hull_gdf = gdf.groupby("tree_id")["geometry"].apply(
-        lambda geom: Polygon(unary_union(geom).convex_hull.exterior)
-    ).reset_index()
-    return gpd.GeoDataFrame(hull_gdf, geometry="geometry", crs=gdf.crs)
+def compute_tree_convex_hulls(seg_df, crs="EPSG:28992"):
+    seg_df = seg_df[seg_df["tree_id"] != -1]
+    tids, hulls, _ = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values)
+    return gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
 
 
-def run_cpp_segmenter_local(exe, input_path, output_path, radius, vres, min_pts):
-    cmd = [exe, input_path, output_path, str(radius), str(vres), str(min_pts)]
-    try:
-        start = time.time()
-        subprocess.run(cmd, check=True, text=True,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE)
-        runtime = time.time() - start
-        return True, runtime
-    except subprocess.CalledProcessError:
-        return False, 0.0
+def run_cpp_segmenter_local(exe, input_path, output_path, radius, vres, min_pts, input_meta=None):
+    # the run record (<output>.meta.json) is written by the caller from the loaded output (record_output)
+    success, runtime, meta = run_segmenter(exe, input_path, output_path, radius, vres, min_pts,
+                                           input_meta=input_meta, scan=False)
+    return (True, runtime, meta) if success else (False, 0.0, meta)
 
 
 def run_segmentation_and_analyze(data_dir, exe, input_xyz, output_dir,
@@ -92,9 +59,8 @@ def run_segmentation_and_analyze(data_dir, exe, input_xyz, output_dir,
     csv_path = os.path.join(data_dir, csv_name)
 
     logger.info("Loading and clipping municipality public trees")
-    muni_gdf = load_municipality_geojson(municipality_geojson)
     forest_bbox = get_bbox_from_las(os.path.join(data_dir, forest_las_name))
-    muni_gdf = muni_gdf[muni_gdf.within(forest_bbox)].copy()
+    muni_gdf = load_municipality_geojson(municipality_geojson, forest_bbox.bounds)
     logger.info("Clipped municipality points, remaining: %d", len(muni_gdf))
 
     combos = list(product(radius_vals, vres_vals, min_pts_vals))
@@ -104,6 +70,8 @@ def run_segmentation_and_analyze(data_dir, exe, input_xyz, output_dir,
         df_existing = pd.read_csv(csv_path)
         existing_combos = set(zip(df_existing["Radius"], df_existing["Vertical Res"], df_existing["Min Points"]))
 
+    input_meta = input_stats(os.path.join(data_dir, input_xyz))   # hashed once, not in every run
+
     def process_task(args):
         (r, v, m), idx = args
         out_file = os.path.join(segmentation_dir, f"segmentation_{idx:04d}.xyz")
@@ -114,8 +82,8 @@ def run_segmentation_and_analyze(data_dir, exe, input_xyz, output_dir,
 
         logger.info("Processing new combination: Radius=%.2f, VRes=%.2f, MinPts=%d", r, v, m)
 
-        success, runtime = run_cpp_segmenter_local(
-            exe, os.path.join(data_dir, input_xyz), out_file, r, v, m
+        success, runtime, meta = run_cpp_segmenter_local(
+            exe, os.path.join(data_dir, input_xyz), out_file, r, v, m, input_meta
         )
 
         if not success:
@@ -123,8 +91,8 @@ def run_segmentation_and_analyze(data_dir, exe, input_xyz, output_dir,
 
         try:
             seg_df = pd.read_csv(out_file, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
-            seg_gdf = gpd.GeoDataFrame(seg_df, geometry=gpd.points_from_xy(seg_df.x, seg_df.y), crs="EPSG:28992")
-            hulls_gdf = compute_tree_convex_hulls(seg_gdf)
+            record_output(out_file, meta, seg_df["tree_id"].to_numpy())
+            hulls_gdf = compute_tree_convex_hulls(seg_df)
 
             if hulls_gdf.empty:
                 logger.warning("No hulls generated for %s", out_file)
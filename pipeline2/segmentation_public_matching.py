@@ -1,45 +1,213 @@
 import os
-import sys
-import subprocess
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, box, Polygon
-from shapely.ops import unary_union
-from concurrent.futures import ThreadPoolExecutor
 from itertools import product
-from concurrent.futures import as_completed
-from tqdm import tqdm
-import time
 
 from shared_logging import setup_module_logger
+from hull_kernel import convex_hulls_by_label
+from hull_labelling import label_hulls
 from segmentation_analysis import load_municipality_geojson, get_bbox_from_las
+from sweep_pool import run_sweep, run_adaptive_sweep, worker_state, dedupe_key_for
+from param_search import AdaptiveGridSearch, successive_halving
+from thinning import thinned_xyz
+from run_meta import run_segmenter, record_output, input_stats, meta_path
+from results_store import RESULTS_DB, ResultsStore
+from sampled_metrics import StratifiedSample, escalation_candidates
+from hull_store import hull_path, read_hulls, write_hulls
 
 logger = None
 
-def compute_tree_convex_hulls(gdf, idx=None):
+# objectives for search="adaptive" (maximized, computed from a result row)
+MATCHING_OBJECTIVES = {
+    "one_to_one": lambda row: row["1_hull (%)"],                                        # public trees in exactly one hull
+    "one_to_one_minus_split": lambda row: row["1_hull (%)"] - row["2_hull (%)"] - row["3_hull (%)"] - row["4+_hull (%)"],
+}
+
+# the same objectives as per-tree scores (k: hulls containing the tree) whose
+# mean is the objective, for the confidence interval of evaluation="sampled"
+MATCHING_UNIT_SCORES = {
+    "one_to_one": lambda k: 100.0 * (k == 1),
+    "one_to_one_minus_split": lambda k: 100.0 * ((k == 1).astype(float) - (k >= 2)),
+}
+
+HULL_COUNT_COLUMNS = ["0_hulls (%)", "1_hull (%)", "2_hull (%)", "3_hull (%)", "4+_hull (%)"]
+
+def compute_tree_convex_hulls(seg_df, idx=None, crs="EPSG:28992"):
     """
     Compute convex hulls per tree_id.
     Only create a hull if enough points are available.
     """
-    hulls = []
+    tids, hulls, skipped = convex_hulls_by_label(seg_df["x"].values, seg_df["y"].values, seg_df["tree_id"].values)
 
-    for tree_id, group in gdf.groupby("tree_id"):
-        if group.empty or len(group) < 3:
-            logger.warning(f"Iteration {idx}: Tree ID {tree_id} has less than 3 points, skipping hull computation.")
-            continue  # Skip if less than 3 points
+    for tree_id in skipped:
+        logger.warning(f"Iteration {idx}: Tree ID {tree_id} has less than 3 points, skipping hull computation.")
 
-        union = unary_union(group.geometry)
+    hulls_gdf = gpd.GeoDataFrame({"tree_id": tids}, geometry=hulls, crs=crs)
+    return hulls_gdf
 
-        hull = union.convex_hull  # Should be a Polygon
 
-        hulls.append({
-            "tree_id": tree_id,
-            "geometry": hull
-        })
 
-    hulls_gdf = gpd.GeoDataFrame(hulls, crs=gdf.crs)
-    return hulls_gdf
+def tree_match_metrics(hulls_per_tree, sample=None, unit_score=None):
+    """
+    Shares (%) of public trees inside 0 / 1 / 2 / 3 / 4+ hulls. With a sample
+    (sampled_metrics.StratifiedSample, hulls_per_tree given for its trees only)
+    they are estimates with 95% half-widths ("<n>_hull CI (%)") and unit_score
+    gives the objective_ci.
+    """
+    k = np.minimum(np.asarray(hulls_per_tree), 4)
+    metrics = {}
+    for i, column in enumerate(HULL_COUNT_COLUMNS):
+        if sample is None:
+            metrics[column] = float((k == i).mean() * 100) if len(k) else np.nan
+        else:
+            share, half_width = sample.estimate(k == i)
+            metrics[column] = share * 100
+            metrics[column.replace(" (%)", " CI (%)")] = half_width * 100
+
+    if sample is None:
+        metrics.update(evaluation="exact", sample_size=len(k), objective_ci=0.0)
+    else:
+        metrics.update(evaluation="sampled", sample_size=sample.size,
+                       objective_ci=sample.estimate(unit_score(np.asarray(hulls_per_tree)))[1])
+    return metrics
+
+
+def _load_matching_static(settings):
+    """Pool initializer payload: sweep settings + public trees inside the forest bbox, loaded once per worker."""
+    global logger
+    logger = setup_module_logger("segmentation_public_match", settings["data_dir"])
 
+    public_trees_gdf = load_municipality_geojson(settings["municipality_geojson"], settings["forest_bounds"])
+    public_trees_gdf = public_trees_gdf.reset_index(drop=True)
+    public_trees_gdf["public_tree_id"] = public_trees_gdf.index
+
+    # fixed seed: every worker draws the same tree sample
+    tree_sample = None
+    if settings["evaluation"] == "sampled":
+        tree_sample = StratifiedSample(public_trees_gdf.geometry.x, public_trees_gdf.geometry.y,
+                                       settings["sample_fraction"], settings["sample_cell"])
+    return {**settings, "public_trees_gdf": public_trees_gdf, "tree_sample": tree_sample}
+
+
+def run_segmentation_task(args):
+    """One sweep combination (segmentation + public tree matching), run in a worker process."""
+    s = worker_state()
+    data_dir, exe, input_xyz, segmentation_dir = s["data_dir"], s["exe"], s["input_xyz"], s["segmentation_dir"]
+    existing_combos, public_trees_gdf = s["existing_combos"], s["public_trees_gdf"]
+    overwrite_existing_combos = s["overwrite_existing_combos"]
+    delete_segmentation_after_processing = s["delete_segmentation_after_processing"]
+
+    (r, v, m), idx = args
+    out_file = os.path.join(segmentation_dir, f"segmentation_{idx:04d}.xyz")
+
+    if not overwrite_existing_combos and (r, v, m) in existing_combos:
+        logger.info("Skipping existing combination: Radius=%.2f, VRes=%.2f, MinPts=%d", r, v, m)
+        return None
+
+    logger.info("Running segmentation for iteration %d: Radius=%.2f, VRes=%.2f, MinPts=%d", idx, r, v, m)
+
+    # on a thinned cloud min_pts is scaled with the point density (scale_min_pts)
+    m_run = max(1, int(round(m * s["min_pts_scale"])))
+    # the run record <out_file>.meta.json is completed from the loaded output below
+    success, runtime, meta = run_segmenter(exe, os.path.join(data_dir, input_xyz), out_file, r, v, m_run,
+                                           input_meta=s["input_meta"], scan=False)
+    if success:
+        logger.info("✓ Segmentation finished for iteration %d (%.2fs)", idx, runtime)
+    else:
+        logger.error("Segmentation failed for iteration %d: return code %d", idx, meta["returncode"])
+        return None
+
+    # Analyze segmentation result
+    try:
+        seg_df = pd.read_csv(out_file, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
+        record_output(out_file, meta, seg_df["tree_id"].to_numpy())
+        N_points = len(seg_df)
+
+        hulls_gdf = compute_tree_convex_hulls(seg_df, idx)
+        N_hulls = len(hulls_gdf)
+
+
+        if hulls_gdf.empty:
+            logger.warning("No hulls generated for iteration %d", idx)
+            return None
+
+        # For each public tree (or each sampled tree), count how many hulls contain it
+        # (one STRtree query, see hull_labelling.py)
+        total = len(public_trees_gdf)
+        tree_sample = s["tree_sample"]
+        if tree_sample is None:
+            _, counts = label_hulls(hulls_gdf.geometry.values, public_trees_gdf.geometry.values)
+            metrics = tree_match_metrics(counts)
+        else:
+            _, counts = label_hulls(hulls_gdf.geometry.values, public_trees_gdf.geometry.values[tree_sample.index])
+            metrics = tree_match_metrics(counts, tree_sample, MATCHING_UNIT_SCORES[s["objective"]])
+            # kept for the exact evaluation of the combinations that may be the best
+            write_hulls(hulls_gdf, hull_path(segmentation_dir, f"segmentation_hulls_{idx:04d}"))
+
+        logger.info("Iteration %d results (%s): N_trees= %d,0hulls=%.2f%%, 1hull=%.2f%%, 2hull=%.2f%%, 3hull=%.2f%%, 4+hull=%.2f%%",
+                    idx, metrics["evaluation"], total, *(metrics[c] for c in HULL_COUNT_COLUMNS))
+
+        result_row = {
+            "iteration_id": idx,
+            "Radius": r,
+            "Vertical Res": v,
+            "Min Points": m,
+            "fidelity": s["fidelity"],
+            "Runtime (s)": runtime,
+            "N_points": N_points,
+            "N_hulls": N_hulls,
+            "N_trees_public": total,
+            **metrics,
+        }
+
+        # Delete the .xyz if requested
+        if delete_segmentation_after_processing:
+            try:
+                os.remove(out_file)
+                logger.info("Deleted segmentation file: %s", out_file)
+            except Exception as e:
+                logger.error("Failed to delete file %s: %s", out_file, str(e))
+
+        return result_row
+
+    except Exception as e:
+        logger.exception("Failed to process segmentation for iteration %d: %s", idx, str(e))
+        return None
+
+
+def _escalate_task(args):
+    """Exact matching of one combination evaluated on the tree sample, from the hulls it kept (worker process)."""
+    s = worker_state()
+    (r, v, m), idx = args
+    hulls_file = hull_path(s["segmentation_dir"], f"segmentation_hulls_{idx:04d}")
+    if not os.path.exists(hulls_file):
+        logger.error("Hulls of iteration %d not found, cannot evaluate it exactly", idx)
+        return None
+
+    _, counts = label_hulls(read_hulls(hulls_file).geometry.values, s["public_trees_gdf"].geometry.values)
+    os.remove(hulls_file)
+    return {"Radius": r, "Vertical Res": v, "Min Points": m, **tree_match_metrics(counts)}
+
+
+def _clean_level_dir(level_dir, ids, keep_runs):
+    """
+    Remove the files a finished lower fidelity level left for the given
+    iterations: the hulls kept by sampled evaluation (only full-density
+    combinations are escalated) and, unless keep_runs, the run records.
+    The level dir itself is removed once it is empty.
+    """
+    for idx in ids:
+        paths = [hull_path(level_dir, f"segmentation_hulls_{idx:04d}")]
+        if not keep_runs:
+            paths.append(meta_path(os.path.join(level_dir, f"segmentation_{idx:04d}.xyz")))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    try:
+        os.rmdir(level_dir)
+    except OSError:   # kept segmentations (or another sweep's files)
+        pass
 
 
 def run_segmentation_public_matching(data_dir, exe, input_xyz, output_dir,
@@ -48,12 +216,44 @@ def run_segmentation_public_matching(data_dir, exe, input_xyz, output_dir,
                                       csv_name,
                                       cores=4,
                                       overwrite_existing_combos=False,
-                                      delete_segmentation_after_processing=False):
+                                      delete_segmentation_after_processing=False,
+                                      search="grid", objective="one_to_one", search_budget=None,
+                                      fidelities=(0.15, 0.5, 1.0), halving_keep=0.25, thin_method="voxel",
+                                      scale_min_pts=True, evaluation="exact", sample_fraction=0.1, sample_cell=50.0,
+                                      pool=None):
+    """
+    Public tree matching sweep over radius x vres x min_pts.
+    search: "grid" runs every combination; "adaptive" proposes the next
+    combinations from the finished results (param_search.AdaptiveGridSearch)
+    to maximize objective (a MATCHING_OBJECTIVES name or a row -> float
+    callable), with at most search_budget segmentation runs; "halving" runs
+    every combination on a thinned input (fidelities[0], thin_method) and only
+    the best halving_keep share at each next fidelity, with min_pts scaled to
+    the fidelity if scale_min_pts. Lower levels are exported to
+    <csv stem>_f<fidelity>.csv.
+    evaluation: "exact" counts the hulls around every public tree; "sampled"
+    estimates the shares on a stratified sample of sample_fraction of the
+    trees (sample_cell m grid strata, see sampled_metrics.py) with 95%
+    half-widths, and when the sweep ends evaluates exactly only the
+    full-density combinations whose objective interval overlaps the best one.
+    Sampled evaluation needs a named objective.
+    pool: a sweep_pool.SweepSpec to run the combinations on a scheduler shared
+    with other sweeps (sweep_pool.run_sweeps) instead of an own pool of `cores`;
+    combinations that another sweep of the scheduler runs on the same input
+    with the same settings and output dir are then run only once (exact
+    evaluation only).
+    """
     global logger
     if logger is None:
         logger = setup_module_logger("segmentation_public_match", data_dir)
 
     logger.info("[segmentation_public_match] Starting public tree matching sweep")
+    if search not in ("grid", "adaptive", "halving"):
+        raise ValueError(f"Unknown search '{search}'")
+    if evaluation not in ("exact", "sampled"):
+        raise ValueError(f"Unknown evaluation '{evaluation}'")
+    if evaluation == "sampled" and objective not in MATCHING_UNIT_SCORES:
+        raise ValueError("evaluation='sampled' needs one of the objectives " + ", ".join(MATCHING_UNIT_SCORES))
 
     segmentation_dir = output_dir
     os.makedirs(segmentation_dir, exist_ok=True)
@@ -62,11 +262,8 @@ def run_segmentation_public_matching(data_dir, exe, input_xyz, output_dir,
 
     # Load and prepare public trees
     logger.info("Loading municipality public tree dataset")
-    muni_gdf = load_municipality_geojson(municipality_geojson)
-    muni_gdf = muni_gdf.to_crs("EPSG:28992")
-
     forest_bbox = get_bbox_from_las(os.path.join(data_dir, forest_las_name))
-    public_trees_gdf = muni_gdf[muni_gdf.within(forest_bbox)].copy()
+    public_trees_gdf = load_municipality_geojson(municipality_geojson, forest_bbox.bounds)
 
     logger.info("Clipped public trees to forest bbox, remaining: %d trees", len(public_trees_gdf))
 
@@ -75,124 +272,122 @@ def run_segmentation_public_matching(data_dir, exe, input_xyz, output_dir,
 
     combos = list(product(radius_vals, vres_vals, min_pts_vals))
 
-    existing_combos = set()
-    if os.path.exists(csv_path):
-        df_existing = pd.read_csv(csv_path)
-        existing_combos = set(zip(df_existing["Radius"], df_existing["Vertical Res"], df_existing["Min Points"]))
-
-    def run_segmentation_task(args):
-        (r, v, m), idx = args
-        out_file = os.path.join(segmentation_dir, f"segmentation_{idx:04d}.xyz")
-
-        if not overwrite_existing_combos and (r, v, m) in existing_combos:
-            logger.info("Skipping existing combination: Radius=%.2f, VRes=%.2f, MinPts=%d", r, v, m)
-            return None
-
-        logger.info("Running segmentation for iteration %d: Radius=%.2f, VRes=%.2f, MinPts=%d", idx, r, v, m)
-
-        cmd = [exe, os.path.join(data_dir, input_xyz), out_file, str(r), str(v), str(m)]
-
-        try:
-            start = time.time()
-            subprocess.run(cmd, check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            runtime = time.time() - start
-            logger.info("✓ Segmentation finished for iteration %d (%.2fs)", idx, runtime)
-        except subprocess.CalledProcessError as e:
-            logger.error("Segmentation failed for iteration %d: %s", idx, str(e))
-            return None
-
-        # Analyze segmentation result
-        try:
-            seg_df = pd.read_csv(out_file, sep=r"\s+", header=None, names=["tree_id", "x", "y", "z"])
-            N_points = len(seg_df)
-
-            seg_gdf = gpd.GeoDataFrame(seg_df, geometry=gpd.points_from_xy(seg_df.x, seg_df.y), crs="EPSG:28992")
-
-            hulls_gdf = compute_tree_convex_hulls(seg_gdf, idx)
-            N_hulls = len(hulls_gdf)
-
-
-            if hulls_gdf.empty:
-                logger.warning("No hulls generated for iteration %d", idx)
-                return None
-
-            # For each public tree, count how many hulls contain it
-            counts = []
-            for pt in public_trees_gdf.geometry:
-                num_enclosed = hulls_gdf.geometry.contains(pt).sum()
-                counts.append(num_enclosed)
-
-            counts_series = pd.Series(counts)
-
-            total = len(public_trees_gdf)
-            zero_hulls = (counts_series == 0).sum() / total * 100
-            one_hull = (counts_series == 1).sum() / total * 100
-            two_hull = (counts_series == 2).sum() / total * 100
-            three_hull = (counts_series == 3).sum() / total * 100
-            fourplus_hull = (counts_series >= 4).sum() / total * 100
-
-            logger.info("Iteration %d results: N_trees= %d,0hulls=%.2f%%, 1hull=%.2f%%, 2hull=%.2f%%, 3hull=%.2f%%, 4+hull=%.2f%%",
-                        idx, total, zero_hulls, one_hull, two_hull, three_hull, fourplus_hull)
-
-            result_row = {
-                "iteration_id": idx,
-                "Radius": r,
-                "Vertical Res": v,
-                "Min Points": m,
-                "Runtime (s)": runtime,
-                "N_points": N_points,
-                "N_hulls": N_hulls,
-                "N_trees_public": total,
-                "0_hulls (%)": zero_hulls,
-                "1_hull (%)": one_hull,
-                "2_hull (%)": two_hull,
-                "3_hull (%)": three_hull,
-                "4+_hull (%)": fourplus_hull
-            }
-
-            # Delete the .xyz if requested
-            if delete_segmentation_after_processing:
-                try:
-                    os.remove(out_file)
-                    logger.info("Deleted segmentation file: %s", out_file)
-                except Exception as e:
-                    logger.error("Failed to delete file %s: %s", out_file, str(e))
-
-            return result_row
-
-        except Exception as e:
-            logger.exception("Failed to process segmentation for iteration %d: %s", idx, str(e))
+    # Results store (one row per combination); the CSV is exported from it
+    store = ResultsStore(
+        os.path.join(data_dir, RESULTS_DB),
+        table=os.path.splitext(csv_name)[0],
+        dataset=os.path.basename(os.path.normpath(data_dir)),
+        engine=os.path.basename(exe),
+    )
+    imported = store.import_csv(csv_path)
+    if imported:
+        logger.info("Imported %d rows from %s into the results store", imported, csv_path)
+    existing_combos = store.done()
+
+    header = ["iteration_id", "Runtime (s)", "Radius", "Vertical Res", "Min Points", "N_points", "N_hulls", "N_trees_public", "0_hulls (%)", "1_hull (%)", "2_hull (%)", "3_hull (%)", "4+_hull (%)",
+              "evaluation", "sample_size", "objective_ci"] + [c.replace(" (%)", " CI (%)") for c in HULL_COUNT_COLUMNS]
+
+    # analysis runs in worker processes; each worker loads the public trees once
+    settings = {
+        "data_dir": data_dir, "exe": exe, "input_xyz": input_xyz, "segmentation_dir": segmentation_dir,
+        "input_meta": input_stats(os.path.join(data_dir, input_xyz)),   # hashed once, not in every run
+        "existing_combos": existing_combos, "municipality_geojson": municipality_geojson,
+        "forest_bounds": forest_bbox.bounds,
+        "overwrite_existing_combos": overwrite_existing_combos,
+        "delete_segmentation_after_processing": delete_segmentation_after_processing,
+        "fidelity": 1.0, "min_pts_scale": 1.0,
+        "evaluation": evaluation, "sample_fraction": sample_fraction, "sample_cell": sample_cell,
+        "objective": objective if isinstance(objective, str) else None,
+    }
+
+    # iteration ids are the grid position in every search mode
+    grid_index = {combo: idx for idx, combo in enumerate(combos)}
+
+    def dedupe_key(task_settings):
+        # sampled runs keep their hulls for the escalation, which every sweep
+        # runs (and cleans up) on its own, so only exact runs are shared
+        if pool is None or evaluation == "sampled":
             return None
-
-    # Prepare tasks
-    tasks = [((r, v, m), idx) for idx, (r, v, m) in enumerate(combos)]
-
-    # Prepare CSV if it does not exist
-    if not os.path.exists(csv_path):
-        header = ["iteration_id", "Runtime (s)", "Radius", "Vertical Res", "Min Points", "N_points", "N_hulls", "N_trees_public", "0_hulls (%)", "1_hull (%)", "2_hull (%)", "3_hull (%)", "4+_hull (%)"]
-        pd.DataFrame(columns=header).to_csv(csv_path, index=False)
-
-    results = []
-    with ThreadPoolExecutor(max_workers=cores) as pool:
-        futures = [pool.submit(run_segmentation_task, task) for task in tasks]
-        for future in tqdm(as_completed(futures), total=len(tasks), desc="Public Matching Sweep", disable=not sys.stdout.isatty()):
-            result = future.result()
-            if result:
-                result_key = (result["Radius"], result["Vertical Res"], result["Min Points"])
-
-                if os.path.exists(csv_path):
-                    df = pd.read_csv(csv_path)
-                    df = df[~((df["Radius"] == result_key[0]) &
-                            (df["Vertical Res"] == result_key[1]) &
-                            (df["Min Points"] == result_key[2]))]
-                else:
-                    df = pd.DataFrame()
-
-                df = pd.concat([df, pd.DataFrame([result])], ignore_index=True)
-                df.to_csv(csv_path, index=False)
-                existing_combos.add(result_key)
-
-
+        return dedupe_key_for(os.path.join(data_dir, task_settings["input_xyz"]), task_settings)
+
+    def own_id(upsert):
+        # a result shared with another sweep (dedupe) carries that sweep's iteration id
+        return lambda res: upsert({**res, "iteration_id": grid_index[tuple(res[c] for c in store.key_columns)]})
+
+    # a rerun combination replaces its row (upsert); export also on interrupt
+    try:
+        if search == "grid":
+            tasks = [((r, v, m), idx) for idx, (r, v, m) in enumerate(combos)]
+            run_sweep(run_segmentation_task, tasks, _load_matching_static, (settings,), workers=cores,
+                      desc="Public Matching Sweep", on_result=own_id(store.upsert), pool=pool,
+                      dedupe_key=dedupe_key(settings))
+        elif search == "halving":
+            score = MATCHING_OBJECTIVES[objective] if isinstance(objective, str) else objective
+
+            def run_level(fidelity, level_combos):
+                level_store = store.at_fidelity(fidelity)
+                level_settings = {**settings, "fidelity": fidelity, "existing_combos": level_store.done()}
+                if fidelity < 1.0:
+                    level_xyz, _ = thinned_xyz(data_dir, input_xyz, fidelity, thin_method)
+                    level_dir = os.path.join(segmentation_dir, f"fidelity_{fidelity:g}")
+                    os.makedirs(level_dir, exist_ok=True)
+                    level_settings.update(input_xyz=level_xyz, segmentation_dir=level_dir,
+                                          input_meta=input_stats(os.path.join(data_dir, level_xyz)),
+                                          min_pts_scale=fidelity if scale_min_pts else 1.0)
+
+                tasks = [(combo, grid_index[combo]) for combo in level_combos]
+                run_sweep(run_segmentation_task, tasks, _load_matching_static, (level_settings,), workers=cores,
+                          desc=f"Public Matching @ {fidelity:g}", on_result=own_id(level_store.upsert), pool=pool,
+                          dedupe_key=dedupe_key(level_settings))
+                if fidelity < 1.0:
+                    level_store.export_csv(os.path.join(data_dir, f"{os.path.splitext(csv_name)[0]}_f{fidelity:g}.csv"),
+                                           header + ["fidelity"])
+                    _clean_level_dir(level_settings["segmentation_dir"], [idx for _, idx in tasks],
+                                     keep_runs=not delete_segmentation_after_processing)
+
+                wanted = set(level_combos)
+                rows = level_store.to_frame().to_dict("records")
+                return {key: row for row in rows if (key := tuple(row[c] for c in store.key_columns)) in wanted}
+
+            for fidelity, results in successive_halving(combos, run_level, score, fidelities, halving_keep):
+                logger.info("Fidelity %g: %d combinations", fidelity, len(results))
+        else:
+            score = MATCHING_OBJECTIVES[objective] if isinstance(objective, str) else objective
+            searcher = AdaptiveGridSearch([radius_vals, vres_vals, min_pts_vals], score, budget=search_budget)
+            if not overwrite_existing_combos:
+                searcher.seed_rows(store.to_frame().to_dict("records"), store.key_columns)
+            # iteration ids stay the grid position, as in the grid sweep
+            run_adaptive_sweep(run_segmentation_task, searcher, lambda combo: (combo, searcher.index[combo]),
+                               _load_matching_static, (settings,), workers=cores,
+                               desc="Public Matching Search", on_result=own_id(store.upsert), pool=pool,
+                               dedupe_key=dedupe_key(settings))
+            best, best_score = searcher.best_combo()
+            logger.info("Adaptive search: %d of %d combinations run, best %s (objective %s)",
+                        searcher.n_proposed, len(combos), best, best_score)
+
+        if evaluation == "sampled":
+            # exact matching only for the combinations that may still be the best
+            score = MATCHING_OBJECTIVES[objective]
+            rows = {tuple(row[c] for c in store.key_columns): row for row in store.to_frame().to_dict("records")}
+            intervals = {key: (score(row), row["objective_ci"] if row.get("evaluation") == "sampled" else 0.0)
+                         for key, row in rows.items()}
+            escalate = [key for key in escalation_candidates(intervals) if rows[key].get("evaluation") == "sampled"]
+            logger.info("Sampled evaluation: %d of %d combinations overlap the best, evaluating them exactly",
+                        len(escalate), len(rows))
+
+            def on_exact(res):
+                row = rows[tuple(res[c] for c in store.key_columns)]
+                store.upsert({**{k: val for k, val in row.items() if " CI " not in k}, **res})
+
+            tasks = [(key, int(rows[key]["iteration_id"])) for key in escalate]
+            run_sweep(_escalate_task, tasks, _load_matching_static, (settings,), workers=cores,
+                      desc="Exact evaluation", on_result=on_exact, pool=pool)
+            for key, row in rows.items():   # hulls kept by the combinations that stay sampled
+                hulls_file = hull_path(segmentation_dir, f"segmentation_hulls_{int(row['iteration_id']):04d}")
+                if key not in escalate and os.path.exists(hulls_file):
+                    os.remove(hulls_file)
+    finally:
+        store.export_csv(csv_path, header)
 
     logger.info("[segmentation_public_match] Sweep finished!")
 
@@ -0,0 +1,10 @@
+import numpy as np
+
+from coord_join import join_on_grid
+
+
+def test_join_on_grid_duplicate_reference_last_wins():
+    ref = np.array([[0, 0, 0], [1, 1, 1], [0, 0, 0]])
+    values, stats = join_on_grid([[0, 0, 0], [1, 1, 1], [2, 2, 2]], ref, [10, 11, 12])
+    assert values.tolist() == [12, 11, -1]
+    assert stats["ref_duplicates"] == 1 and stats["matched"] == 2 and stats["ref_unmatched"] == 0
@@ -0,0 +1,19 @@
+import numpy as np
+
+from hull_kernel import convex_hulls_by_label, concave_hulls_by_label, crown_metrics_3d_by_label
+
+
+def test_convex_hulls_empty_input():
+    hull_labels, hulls, skipped = convex_hulls_by_label([], [], [])
+    assert len(hull_labels) == 0 and len(hulls) == 0 and len(skipped) == 0
+
+
+def test_concave_hulls_empty_input():
+    hull_labels, hulls, skipped = concave_hulls_by_label(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+    assert len(hull_labels) == 0 and len(hulls) == 0 and len(skipped) == 0
+
+
+def test_crown_metrics_empty_input():
+    hull_labels, metrics = crown_metrics_3d_by_label([], [], [], [])
+    assert len(hull_labels) == 0
+    assert all(len(v) == 0 for v in metrics.values())
@@ -0,0 +1,88 @@
+# thinning.py
+import os
+import numpy as np
+import pandas as pd
+
+# ---------------------------------------------------------------------------
+# Thinned point clouds for multi-fidelity sweeps
+# ---------------------------------------------------------------------------
+# A low-fidelity sweep run segments a thinned copy of the sweep input
+# (data_dir/<stem>_f<fraction>_<method>.xyz) instead of the full cloud:
+#
+#   random   a uniform random subset of fraction * N points
+#   voxel    one point per occupied voxel, with the voxel size chosen so
+#            that about fraction * N points remain; keeps the point density
+#            even, so dense crowns lose more points than sparse ones
+#
+# Thinned files are written once and reused while they are newer than the
+# input. The seed is fixed, so every combination of a level sees the same cloud.
+
+THIN_METHODS = ("random", "voxel")
+
+
+def read_xyz(path):
+    """x, y, z columns of a whitespace separated .xyz file as an (N, 3) float array."""
+    return pd.read_csv(path, sep=r"\s+", header=None, usecols=[0, 1, 2]).to_numpy(dtype=np.float64)
+
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(8 << 20), b""))
+
+
+def voxel_thin_index(xyz, n_target, rng, iterations=20):
+    """Indices of one random point per voxel, voxel size bisected so about n_target voxels are occupied."""
+    order = rng.permutation(len(xyz))
+    pts = xyz[order] - xyz.min(axis=0)
+    extent = float(np.ptp(xyz, axis=0).max()) or 1.0
+
+    lo, hi = extent / 1e5, extent   # voxel edge lengths: too many / too few occupied voxels
+    keep = None
+    for _ in range(iterations):
+        size = np.sqrt(lo * hi)
+        cells = np.floor(pts / size).astype(np.int64)
+        dims = cells.max(axis=0) + 1
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+        _, first = np.unique(keys, return_index=True)   # first = a random point of each voxel
+        if keep is None or abs(len(first) - n_target) < abs(len(keep) - n_target):
+            keep = first
+        if len(first) > n_target:
+            lo = size
+        else:
+            hi = size
+        if abs(len(first) - n_target) <= 0.01 * n_target:
+            break
+    return np.sort(order[keep])
+
+
+def thinned_xyz(data_dir, input_xyz, fraction, method="voxel", seed=0):
+    """
+    Thinned copy of data_dir/input_xyz for a sweep at fidelity `fraction`.
+
+    Returns:
+    - (str, int): file name inside data_dir and its point count
+      (input_xyz itself when fraction >= 1)
+    """
+    if method not in THIN_METHODS:
+        raise ValueError(f"Unknown thinning method '{method}'")
+    src = os.path.join(data_dir, input_xyz)
+    if fraction >= 1.0:
+        return input_xyz, count_lines(src)
+
+    name = f"{os.path.splitext(input_xyz)[0]}_f{fraction:g}_{method}.xyz"
+    dst = os.path.join(data_dir, name)
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return name, count_lines(dst)
+
+    xyz = read_xyz(src)
+    rng = np.random.default_rng(seed)
+    n_target = max(1, int(round(fraction * len(xyz))))
+    if method == "random":
+        keep = np.sort(rng.choice(len(xyz), size=n_target, replace=False))
+    else:
+        keep = voxel_thin_index(xyz, n_target, rng)
+
+    tmp = dst + ".tmp"
+    np.savetxt(tmp, xyz[keep], fmt="%.6f")
+    os.replace(tmp, dst)
+    return name, len(keep)
@@ -3,6 +3,8 @@ import pandas as pd
 from tqdm import tqdm
 import logging
 
+from run_meta import output_stats, meta_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,11 +14,7 @@ def process_xyz_file(file_name, file_path):
     vertical_res = int(parts[4])
     min_points = int(parts[6])
 
-    columns = ["tree_id", "x", "y", "z", "red", "green", "blue"]
-    data = pd.read_csv(file_path, delimiter=' ', header=None, names=columns)
-
-    num_points = len(data)
-    tree_count = data["tree_id"].nunique()
+    num_points, tree_count = output_stats(file_path)   # from the run record (scanned once if missing)
 
     return file_name, radius, vertical_res, min_points, num_points, tree_count
 
@@ -41,6 +39,8 @@ def create_tuning_csv(data_dir, input_dir, output_csv):
             if not df[(df["Radius"] == radius) & (df["Vertical Res"] == vertical_res) & (df["Min Points"] == min_points)].empty:
                 logger.info("Duplicate found for R=%d, VRES=%d, MINP=%d — removing %s", radius, vertical_res, min_points, file_name)
                 os.remove(file_path)
+                if os.path.exists(meta_path(file_path)):
+                    os.remove(meta_path(file_path))
                 continue
 
             result = process_xyz_file(file_name, file_path)
@@ -49,6 +49,7 @@ def create_tuning_csv(data_dir, input_dir, output_csv):
             new_file_name = f"{data_dir}_{len(df)-1:04d}.xyz"
             new_file_path = os.path.join(input_dir, new_file_name)
             os.rename(file_path, new_file_path)
+            os.rename(meta_path(file_path), meta_path(new_file_path))   # written by output_stats above
             df.at[len(df) - 1, "File Name"] = new_file_name
             logger.info("Renamed %s to %s", file_name, new_file_name)
 